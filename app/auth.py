@@ -1,26 +1,32 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from . import models, database
+from .cache import LRUCache
 from .core.config import settings
-import hashlib
+from .core.passwords import get_password_hash, pwd_context, verify_password  # noqa: F401 (re-exported)
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
-def verify_password(plain_password, hashed_password):
-    # Pre-hash with SHA256 to handle passwords > 72 bytes
-    hashed_input = hashlib.sha256(plain_password.encode()).hexdigest()
-    return pwd_context.verify(hashed_input, hashed_password)
 
-def get_password_hash(password):
-    # Pre-hash with SHA256 to handle passwords > 72 bytes
-    hashed_input = hashlib.sha256(password.encode()).hexdigest()
-    return pwd_context.hash(hashed_input)
+@dataclass(frozen=True)
+class CurrentUser:
+    """The authenticated user as seen by route handlers."""
+    id: int
+    email: str
+    token_version: int
+
+
+# Resolved users keyed by id, so authenticated requests usually skip the user
+# lookup. Entries are dropped on password reset in this process; other worker
+# processes see the new token version once their entry's TTL runs out.
+_user_cache = LRUCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -32,20 +38,81 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
-    credentials_exception = HTTPException(
+def create_user_token(user: models.User) -> str:
+    """Issue an access token carrying the user's id and token version."""
+    return create_access_token(
+        data={"sub": user.email, "uid": user.id, "ver": user.token_version or 0},
+        expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+
+def invalidate_user(user_id: int) -> None:
+    """Drop a cached user, e.g. after their password or token version changed."""
+    _user_cache.pop(user_id)
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+def _cached_user(payload: dict) -> Optional[CurrentUser]:
+    """Return the cached user for a token, if the token version still matches."""
+    user_id = payload.get("uid")
+    if user_id is None:
+        return None
+    user = _user_cache.get(user_id)
+    if user is not None and user.token_version == payload.get("ver", 0):
+        return user
+    return None
+
+def _resolve_user(user: Optional[models.User], payload: dict) -> CurrentUser:
+    # Tokens issued before the last password reset carry an older version
+    if user is None or (user.token_version or 0) != payload.get("ver", 0):
+        raise _credentials_exception()
+    current_user = CurrentUser(id=user.id, email=user.email, token_version=user.token_version or 0)
+    _user_cache.set(user.id, current_user)
+    return current_user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> CurrentUser:
+    payload = _decode_token(token)
+    cached = _cached_user(payload)
+    if cached is not None:
+        return cached
+    if "uid" in payload:
+        user = db.get(models.User, payload["uid"])
+    else:
+        # Tokens issued before user ids were added to the claims
+        user = db.query(models.User).filter(models.User.email == payload["sub"]).first()
+    return _resolve_user(user, payload)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)) -> CurrentUser:
+    """Async variant of get_current_user for async route handlers."""
+    return await authenticate_token(token, db)
+
+async def authenticate_token(token: str, db: AsyncSession) -> CurrentUser:
+    """
+    Resolve the user for a bearer token, e.g. one passed to a WebSocket.
+
+    Raises:
+        HTTPException: 401 if the token is invalid or has been revoked
+    """
+    payload = _decode_token(token)
+    cached = _cached_user(payload)
+    if cached is not None:
+        return cached
+    if "uid" in payload:
+        user = await db.get(models.User, payload["uid"])
+    else:
+        result = await db.execute(select(models.User).where(models.User.email == payload["sub"]))
+        user = result.scalars().first()
+    return _resolve_user(user, payload)
@@ -0,0 +1,74 @@
+"""
+JSON encoding for map documents and API responses.
+
+Map documents are the largest payloads the app handles, so they go through
+the fastest JSON library available: orjson if installed, then msgspec, and
+the stdlib ``json`` module otherwise. All backends produce compact JSON and
+raise ``ValueError`` on invalid input.
+"""
+from typing import Any, Union
+import json
+
+from starlette.responses import JSONResponse as _StarletteJSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - depends on the environment
+    msgspec = None
+
+
+def _json_dumps_bytes(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            # orjson refuses documents nested deeper than 255 levels
+            return _json_dumps_bytes(obj)
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def loads(data: Union[str, bytes]) -> Any:
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return _encoder.encode(obj)
+
+else:
+    BACKEND = "json"
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    dumps_bytes = _json_dumps_bytes
+
+
+def dumps(obj: Any) -> str:
+    """Encode ``obj`` as a JSON string (for storing in text columns)."""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+class JSONResponse(_StarletteJSONResponse):
+    """JSON response rendered with the codec's backend."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -20,24 +20,99 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # Cache of authenticated users, so most requests skip the user lookup
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_SIZE: int = 10000
+
+    # Number of parsed descriptions kept per worker so unchanged ones skip bleach
+    SANITIZE_CACHE_SIZE: int = 20000
+
+    # Write-behind buffer for map saves: saves are acknowledged from memory and
+    # written once a map is idle, or at the latest after the flush interval.
+    # Keeps state per process, so only enable it with a single worker.
+    WRITE_BUFFER_ENABLED: bool = False
+    WRITE_BUFFER_FLUSH_MS: int = 2000
+    WRITE_BUFFER_IDLE_MS: int = 500
+
+    # Fan-out of collaborative edits: "memory" (one process) or "redis"
+    # (shared by all workers, needs the redis package)
+    PUBSUB_BACKEND: str = "memory"
+    REDIS_URL: str = "redis://localhost:6379/0"
+
+    # Server (python -m app): WEB_CONCURRENCY=0 starts one worker per available
+    # CPU core. Keep-alive should outlast the load balancer's idle timeout;
+    # GRACEFUL_TIMEOUT is how long SIGTERM waits for running requests.
+    # FORWARDED_ALLOW_IPS lists the proxies trusted for the client IP ("*" behind
+    # a load balancer), which rate limits are keyed on.
+    HOST: str = "127.0.0.1"
+    PORT: int = 8000
+    WEB_CONCURRENCY: int = 0
+    KEEPALIVE_TIMEOUT: int = 65
+    BACKLOG: int = 2048
+    GRACEFUL_TIMEOUT: int = 30
+    FORWARDED_ALLOW_IPS: str = "127.0.0.1"
+
     # Database Settings
     # Use absolute path to ensure DB is always in the db/ folder relative to project root
     DATABASE_URL: str = f"sqlite:///{Path(__file__).resolve().parent.parent.parent / 'db' / 'mindmap.db'}"
 
+    # Mind map storage backend: "blob" keeps each map as one JSON document,
+    # "nodes" keeps one row per node so subtrees can be loaded on their own
+    MINDMAP_STORAGE: str = "blob"
+
+    # PostgreSQL connection pool per worker process. With DB_MAX_CONNECTIONS set
+    # (the server's max_connections minus what other clients need), python -m app
+    # shrinks the pools, and if necessary the workers, to stay within it.
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_MAX_CONNECTIONS: int = 0
+    # Seconds to wait for a free connection, and after which connections are replaced
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Behind PgBouncer (transaction pooling): no local pool and no server-side
+    # prepared statements. Pool statistics are on GET /metrics.
+    DB_PGBOUNCER: bool = False
+
+    # Responses smaller than this many bytes are sent uncompressed
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+
     # CORS Settings
     CORS_ORIGINS: List[str] = [
         "http://localhost:8000",
         "http://127.0.0.1:8000",
     ]
 
-    # Rate Limiting
+    # Rate Limiting (requests per minute, 0 to disable; see app/ratelimit.py).
+    # Login/reset and signup are limited per client IP, everything else under
+    # /api and /auth per user. Buckets are kept per process ("memory"), in a
+    # SQLite file shared by the workers on this host ("sqlite"), or in Redis
+    # ("redis", shared by every host, uses REDIS_URL).
     RATE_LIMIT_PER_MINUTE: int = 60
     LOGIN_RATE_LIMIT: int = 5
     SIGNUP_RATE_LIMIT: int = 3
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_SQLITE_PATH: str = str(Path(__file__).resolve().parent.parent.parent / 'db' / 'ratelimit.db')
 
     # Password Settings
     MIN_PASSWORD_LENGTH: int = 8
 
+    # Password hash policy (see app/core/passwords.py). Set the work factor per
+    # environment with "python db/db_manager.py benchmark-hash"; stored hashes
+    # made with another scheme or cost are upgraded on the user's next login.
+    PASSWORD_HASH_SCHEME: str = "pbkdf2_sha256"
+    PBKDF2_ROUNDS: int = 29000
+    BCRYPT_ROUNDS: int = 12
+
+    # Password hashing runs in its own process pool: -1 sizes it from the CPU
+    # count (up to 4), 0 hashes on the request threadpool instead. Hashes
+    # beyond the workers plus HASH_QUEUE_SIZE are rejected with 503.
+    HASH_WORKERS: int = -1
+    HASH_QUEUE_SIZE: int = 32
+
+    # Bearer token required by GET /metrics; leave empty to leave it open
+    METRICS_TOKEN: str = ""
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
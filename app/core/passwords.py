@@ -0,0 +1,115 @@
+"""
+Password hashing policy, shared by the app and db/db_manager.py.
+
+New hashes use ``PASSWORD_HASH_SCHEME`` at the configured work factor
+(``PBKDF2_ROUNDS`` or ``BCRYPT_ROUNDS``). Hashes made with the other scheme,
+or with a different work factor, still verify but count as outdated:
+``verify_and_update`` returns a fresh hash for them so the caller can store
+it, and every account moves to the current policy on its next login.
+
+Each environment picks its own work factor; ``db_manager.py benchmark-hash``
+measures this host and prints the setting that hits a target verify latency.
+
+Passwords are pre-hashed with SHA256 so bcrypt's 72 byte limit never
+truncates them.
+"""
+from typing import Optional, Tuple
+import hashlib
+import math
+import time
+
+from passlib.context import CryptContext
+
+from .config import settings
+
+SCHEMES = ("pbkdf2_sha256", "bcrypt")
+
+# Valid work factors per scheme (bcrypt's is a log2 cost)
+ROUNDS_LIMITS = {"pbkdf2_sha256": (1000, 10_000_000), "bcrypt": (4, 31)}
+
+
+def build_context(
+    scheme: Optional[str] = None,
+    pbkdf2_rounds: Optional[int] = None,
+    bcrypt_rounds: Optional[int] = None,
+) -> CryptContext:
+    """
+    A CryptContext that hashes with ``scheme`` and flags any other scheme or
+    work factor as needing an update. Defaults come from the settings.
+    """
+    scheme = scheme or settings.PASSWORD_HASH_SCHEME
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown password hash scheme: {scheme}")
+    rounds = {
+        "pbkdf2_sha256": pbkdf2_rounds or settings.PBKDF2_ROUNDS,
+        "bcrypt": bcrypt_rounds or settings.BCRYPT_ROUNDS,
+    }
+    options = {}
+    for name, value in rounds.items():
+        # min == max == default, so hashes made at any other cost are rehashed
+        for key in ("default_rounds", "min_rounds", "max_rounds"):
+            options[f"{name}__{key}"] = value
+    return CryptContext(
+        schemes=[scheme] + [name for name in SCHEMES if name != scheme],
+        default=scheme,
+        deprecated="auto",
+        **options,
+    )
+
+
+pwd_context = build_context()
+
+
+def _prehash(password: str) -> str:
+    # Pre-hash with SHA256 to handle passwords > 72 bytes
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(_prehash(password))
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(_prehash(plain_password), hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and, if it matches a hash made under an older policy,
+    also return its hash under the current one (``None`` when up to date).
+    """
+    return pwd_context.verify_and_update(_prehash(plain_password), hashed_password)
+
+
+def _verify_seconds(context: CryptContext, samples: int) -> float:
+    """Best of ``samples`` verifies of a fresh hash, in seconds."""
+    secret = _prehash("benchmark password")
+    hashed = context.hash(secret)
+    best = math.inf
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.verify(secret, hashed)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(scheme: str, target_ms: float, samples: int = 3) -> Tuple[int, float]:
+    """
+    Find the work factor for ``scheme`` whose verify takes about ``target_ms``
+    on this host. Returns ``(rounds, measured_ms)``.
+
+    PBKDF2 time grows linearly with rounds, bcrypt time doubles with each
+    cost step, so one calibration run is scaled and then measured once more.
+    """
+    low, high = ROUNDS_LIMITS[scheme]
+    if scheme == "bcrypt":
+        seconds = _verify_seconds(build_context(scheme, bcrypt_rounds=8), samples)
+        rounds = 8 + round(math.log2(max(target_ms / 1000 / seconds, 1e-9)))
+        rounds = int(min(max(rounds, low), high))
+        context = build_context(scheme, bcrypt_rounds=rounds)
+    else:
+        seconds = _verify_seconds(build_context(scheme, pbkdf2_rounds=20_000), samples)
+        rounds = round(20_000 * target_ms / 1000 / seconds, -3)
+        rounds = int(min(max(rounds, low), high))
+        context = build_context(scheme, pbkdf2_rounds=rounds)
+    return rounds, _verify_seconds(context, samples) * 1000
@@ -1,29 +1,169 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 from .core.config import settings
+import time
+import uuid
 
 # Use DATABASE_URL from settings (supports both SQLite and PostgreSQL)
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-# Configure engine based on database type
+
+def to_async_url(url: str) -> str:
+    """Swap the sync driver in a database URL for its asyncio counterpart."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    for prefix in ("postgresql+psycopg2:", "postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return url.replace(prefix, "postgresql+asyncpg:", 1)
+    return url
+
+
+ASYNC_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
+
+class PoolStats:
+    """
+    Checkout latency and connection counts for one engine's pool, updated
+    by pool events. Checkout time includes waiting for a free connection,
+    opening a new one and the pre-ping.
+    """
+    # Checkouts at least this slow are counted separately
+    SLOW_CHECKOUT_SECONDS = 0.1
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self.pool_class = None
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.overflow_connects = 0
+        self.invalidated = 0
+
+    def snapshot(self) -> dict:
+        pool = self.pool
+        stats = {
+            "pool": self.pool_class,
+            "checked_out": self.checkouts - self.checkins,
+            "checkouts": self.checkouts,
+            "avg_checkout_ms": round(self.checkout_seconds / max(self.checkouts, 1) * 1000, 3),
+            "max_checkout_ms": round(self.max_checkout_seconds * 1000, 3),
+            "slow_checkouts": self.slow_checkouts,
+            "timeouts": self.timeouts,
+            "connects": self.connects,
+            "overflow_connects": self.overflow_connects,
+            "invalidated": self.invalidated,
+        }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), idle=pool.checkedin(), overflow=max(pool.overflow(), 0))
+        return stats
+
+
+def _instrumented(pool_class, stats: PoolStats):
+    """A subclass of ``pool_class`` that times checkouts into ``stats`` (kept when the pool is recreated)."""
+    stats.pool_class = pool_class.__name__
+
+    class InstrumentedPool(pool_class):
+        def connect(self):
+            stats.pool = self
+            start = time.perf_counter()
+            try:
+                connection = super().connect()
+            except PoolTimeoutError:
+                stats.timeouts += 1
+                raise
+            elapsed = time.perf_counter() - start
+            stats.checkouts += 1
+            stats.checkout_seconds += elapsed
+            stats.max_checkout_seconds = max(stats.max_checkout_seconds, elapsed)
+            if elapsed >= stats.SLOW_CHECKOUT_SECONDS:
+                stats.slow_checkouts += 1
+            return connection
+
+    return InstrumentedPool
+
+
+def _listen(engine, stats: PoolStats) -> None:
+    def on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+        if isinstance(stats.pool, QueuePool) and stats.pool.overflow() > 0:
+            stats.overflow_connects += 1
+
+    def on_checkin(dbapi_connection, connection_record):
+        stats.checkins += 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        stats.invalidated += 1
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "checkin", on_checkin)
+    event.listen(engine, "invalidate", on_invalidate)
+
+
+def _engine_options(url: str, stats: PoolStats) -> dict:
+    """Pool settings for an engine on ``url``, with an instrumented pool class."""
+    parsed = make_url(url)
+    if url.startswith("sqlite"):
+        # SQLite keeps the driver's default pool (a static one for :memory:)
+        return {"poolclass": _instrumented(parsed.get_dialect().get_pool_class(parsed), stats)}
+
+    options = {
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,  # Verify connections before using
+        "pool_recycle": settings.DB_POOL_RECYCLE,    # Replace connections older than this
+    }
+    if settings.DB_PGBOUNCER:
+        # PgBouncer does the pooling; server-side prepared statements don't survive
+        # its transaction mode, so asyncpg must not cache or reuse statement names
+        options.update(poolclass=_instrumented(NullPool, stats), pool_pre_ping=False)  # Connections are always new
+        if parsed.drivername.endswith("asyncpg"):
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+    else:
+        options.update(
+            poolclass=_instrumented(parsed.get_dialect().get_pool_class(parsed), stats),
+            pool_size=settings.DB_POOL_SIZE,         # Connection pool size
+            max_overflow=settings.DB_MAX_OVERFLOW,   # Maximum overflow connections
+            pool_timeout=settings.DB_POOL_TIMEOUT,   # Seconds to wait for a free connection
+        )
+    return options
+
+
+# Configure engines based on database type. Pool sizes are per worker
+# process; python -m app fits them to DB_MAX_CONNECTIONS.
+sync_pool_stats = PoolStats("sync")
+async_pool_stats = PoolStats("async")
+sync_options = _engine_options(SQLALCHEMY_DATABASE_URL, sync_pool_stats)
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     # SQLite-specific configuration
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
-else:
-    # PostgreSQL and other databases
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        pool_pre_ping=True,  # Verify connections before using
-        pool_size=10,         # Connection pool size
-        max_overflow=20       # Maximum overflow connections
-    )
+    sync_options["connect_args"] = {"check_same_thread": False}
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **sync_options)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, async_pool_stats))
+_listen(engine, sync_pool_stats)
+_listen(async_engine.sync_engine, async_pool_stats)
+sync_pool_stats.pool = engine.pool
+async_pool_stats.pool = async_engine.sync_engine.pool
+
+
+def pool_metrics() -> dict:
+    """Pool statistics of both engines, for the metrics endpoint."""
+    return {stats.name: stats.snapshot() for stats in (async_pool_stats, sync_pool_stats)}
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Objects stay usable after commit; async sessions cannot lazy-load expired attributes
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -32,3 +172,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
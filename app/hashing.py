@@ -0,0 +1,154 @@
+"""
+Password hashing off the event loop and off the request threadpool.
+
+Hashes are computed in a dedicated process pool (``HASH_WORKERS`` processes,
+so they run in parallel regardless of the GIL). At most
+``HASH_QUEUE_SIZE`` hashes wait for a free worker; beyond that
+``HashingPool.run`` raises ``HashingBusy`` straight away, and routes answer
+503 with ``Retry-After``. A login storm therefore queues behind a bounded
+number of workers instead of filling the threadpool that map requests use.
+
+With ``HASH_WORKERS=0`` hashes run on the request threadpool instead (same
+admission limit), for hosts where spawning processes is not an option.
+
+Per-endpoint counts and timings are available from ``hashing_pool.metrics()``.
+The hash policy itself lives in ``core.passwords``.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from .core.config import settings
+from .core.passwords import get_password_hash, pwd_context, verify_and_update, verify_password  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+
+def _timed(func: Callable, *args):
+    """Run in the worker: return the result and how long it took there."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class HashingBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+@dataclass
+class _EndpointStats:
+    calls: int = 0
+    rejected: int = 0
+    failed: int = 0
+    wait_seconds: float = 0.0
+    run_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def snapshot(self) -> dict:
+        completed = max(self.calls - self.failed, 1)
+        return {
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.wait_seconds / completed * 1000, 2),
+            "avg_run_ms": round(self.run_seconds / completed * 1000, 2),
+            "max_ms": round(self.max_seconds * 1000, 2),
+        }
+
+
+class HashingPool:
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None):
+        if workers is None:
+            workers = settings.HASH_WORKERS if settings.HASH_WORKERS >= 0 else min(4, os.cpu_count() or 1)
+        self.workers = workers
+        self.queue_size = settings.HASH_QUEUE_SIZE if queue_size is None else queue_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._in_flight = 0
+        self._stats: Dict[str, _EndpointStats] = {}
+
+    @property
+    def capacity(self) -> int:
+        """Hashes that may be running or waiting at once."""
+        return max(self.workers, 1) + self.queue_size
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers import only this module, not the forked state of the server
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def run(self, endpoint: str, func: Callable, *args):
+        """
+        Run ``func(*args)`` on the pool and return its result. ``func`` must be
+        a module-level function so it can be sent to a worker process.
+
+        Raises:
+            HashingBusy: If ``capacity`` hashes are already running or waiting
+        """
+        stats = self._stats.setdefault(endpoint, _EndpointStats())
+        if self._in_flight >= self.capacity:
+            stats.rejected += 1
+            raise HashingBusy()
+
+        self._in_flight += 1
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            if self.workers == 0:
+                result, run_seconds = await run_in_threadpool(_timed, func, *args)
+            else:
+                loop = asyncio.get_running_loop()
+                result, run_seconds = await loop.run_in_executor(self._get_executor(), _timed, func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool next time
+            stats.failed += 1
+            logger.error("Password hashing pool broke, restarting it")
+            self._executor = None
+            raise
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+        elapsed = time.perf_counter() - start
+        stats.run_seconds += run_seconds
+        stats.wait_seconds += max(elapsed - run_seconds, 0.0)
+        stats.max_seconds = max(stats.max_seconds, elapsed)
+        return result
+
+    async def hash(self, endpoint: str, password: str) -> str:
+        return await self.run(endpoint, get_password_hash, password)
+
+    async def verify(self, endpoint: str, password: str, hashed_password: str) -> bool:
+        return await self.run(endpoint, verify_password, password, hashed_password)
+
+    async def verify_and_update(self, endpoint: str, password: str, hashed_password: str):
+        """``(matches, new_hash)``; see ``core.passwords.verify_and_update``."""
+        return await self.run(endpoint, verify_and_update, password, hashed_password)
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self._in_flight,
+            "endpoints": {name: stats.snapshot() for name, stats in self._stats.items()},
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool()
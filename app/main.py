@@ -1,15 +1,22 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from .database import engine, Base
-from .routers import auth, maps, pages
+from .database import engine, async_engine, AsyncSessionLocal, Base, pool_metrics
+from .hashing import hashing_pool
+from .migrations import add_missing_columns, add_missing_indexes
+from .pubsub import pubsub
+from .ratelimit import RateLimitMiddleware, limiter
+from .search import create_index, index_missing_maps
+from .storage import BlobStorage
+from .routers import auth, collab, maps, pages
+from .write_buffer import write_buffer
 from .core.config import settings
 from datetime import datetime, timezone
+from sqlalchemy.exc import IntegrityError
+import asyncio
 import logging
 
 # Configure logging
@@ -21,6 +28,12 @@ logger = logging.getLogger(__name__)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine, Base.metadata)
+add_missing_indexes(engine, Base.metadata)
+create_index(engine)
+
+# Requests only use the async engine; don't keep an idle sync connection in every worker
+engine.dispose()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -31,10 +44,8 @@ app = FastAPI(
     redoc_url="/redoc" if not settings.is_production else None,
 )
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address, default_limits=["100/minute"])
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+# Rate limiting (inside CORS, so 429 responses still carry CORS headers)
+app.add_middleware(RateLimitMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -45,6 +56,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses (map documents compress very well)
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+except ImportError:
+    # Level 6 compresses large maps nearly as well as 9 at a fraction of the CPU
+    app.add_middleware(GZipMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE, compresslevel=6)
+
 # Add security headers middleware
 @app.middleware("http")
 async def add_security_headers(request: Request, call_next):
@@ -56,6 +75,33 @@ async def add_security_headers(request: Request, call_next):
         response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
     return response
 
+async def index_old_maps() -> None:
+    """
+    Index maps saved before search existed, one batch per transaction, in
+    the background so startup doesn't wait on it. Reads either storage
+    format without migrating.
+    """
+    load = BlobStorage().load
+    after_id, total = 0, 0
+    while after_id is not None:
+        start = after_id
+        async with AsyncSessionLocal() as db:
+            try:
+                after_id, indexed = await db.run_sync(lambda session: index_missing_maps(session, load, start, skip=write_buffer.is_buffered))
+                await db.commit()
+                total += indexed
+            except IntegrityError:
+                # Another worker indexed some of these maps first; retry without them
+                await db.rollback()
+                after_id = start + 1
+            except Exception as e:
+                logger.error(f"Indexing maps for search failed: {str(e)}", exc_info=True)
+                return
+    if total:
+        logger.info(f"Indexed {total} mind maps for search")
+
+_background_tasks = set()
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -67,11 +113,23 @@ async def startup_event():
     if not settings.is_production:
         logger.info(f"📚 API Docs: http://127.0.0.1:8000/docs")
     logger.info("="*60)
+    await write_buffer.start()
+    task = asyncio.create_task(index_old_maps())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("👋 Shutting down Mind Map App...")
+    for task in list(_background_tasks):
+        task.cancel()
+    # Write any buffered map saves before the connections go away
+    await write_buffer.stop()
+    await pubsub.close()
+    await limiter.close()
+    hashing_pool.shutdown()
+    await async_engine.dispose()
 
 # Health check endpoint
 @app.api_route("/health", methods=["GET", "HEAD"])
@@ -87,6 +145,22 @@ def health_check():
         "database": "connected"
     }
 
+# Metrics endpoint
+@app.get("/metrics")
+def metrics(request: Request):
+    """
+    Runtime metrics for this worker process. Requires
+    ``Authorization: Bearer <METRICS_TOKEN>`` when ``METRICS_TOKEN`` is set.
+    """
+    if settings.METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "password_hashing": hashing_pool.metrics(),
+        "rate_limits": limiter.metrics(),
+        "database_pools": pool_metrics(),
+    }
+
 # Root redirect
 @app.get("/api")
 def api_root():
@@ -103,6 +177,7 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Include routers
 app.include_router(auth.router)
 app.include_router(maps.router)
+app.include_router(collab.router)
 app.include_router(pages.router)
 
 # Global exception handler
@@ -0,0 +1,45 @@
+"""
+Lightweight, additive schema migrations.
+
+``Base.metadata.create_all`` only creates missing tables, it never alters
+tables that already exist. The helpers here add columns and indexes
+introduced after a table was first created so existing SQLite and
+PostgreSQL databases keep working across upgrades.
+"""
+from sqlalchemy import inspect, text
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine, metadata) -> None:
+    """Add any model columns that are missing from existing tables."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.server_default is not None:
+                    default = getattr(column.server_default.arg, "text", column.server_default.arg)
+                    ddl += f" DEFAULT {default}"
+                conn.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+
+def add_missing_indexes(engine, metadata) -> None:
+    """Create any model indexes that are missing from existing tables."""
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                logger.info(f"Created index {index.name} on {table.name}")
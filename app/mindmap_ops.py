@@ -0,0 +1,320 @@
+"""
+Node-level operations on mind map documents.
+
+A mind map document is the nested dict stored in ``MindMap.data``::
+
+    {"id": "...", "name": "...", "description": "...", "isCollapsed": false,
+     "children": [...]}
+
+Every node carries a stable string ``id`` so that edits can address a node
+directly instead of resending the whole document.
+"""
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+import uuid
+
+# Fields a client may change with an "update" operation
+UPDATABLE_FIELDS = ("name", "description", "isCollapsed")
+
+
+class OperationError(ValueError):
+    """Raised when an operation cannot be applied to a document."""
+
+
+def new_node_id() -> str:
+    return uuid.uuid4().hex
+
+
+def iter_nodes(root: dict) -> Iterable[Tuple[dict, Optional[dict]]]:
+    """Yield ``(node, parent)`` pairs depth-first without recursion."""
+    stack = [(root, None)]
+    while stack:
+        node, parent = stack.pop()
+        yield node, parent
+        children = node.get("children")
+        if isinstance(children, list):
+            for child in reversed(children):
+                if isinstance(child, dict):
+                    stack.append((child, node))
+
+
+def ensure_node_ids(root: dict) -> bool:
+    """Assign an id to every node that lacks one. Returns True if any were added."""
+    changed = False
+    for node, _ in iter_nodes(root):
+        if not node.get("id"):
+            node["id"] = new_node_id()
+            changed = True
+    return changed
+
+
+def count_nodes(root: dict) -> int:
+    return sum(1 for _ in iter_nodes(root))
+
+
+def index_nodes(root: dict) -> Dict[str, Tuple[dict, Optional[dict]]]:
+    """Map node id -> ``(node, parent)`` for every node that has an id."""
+    return {node["id"]: (node, parent) for node, parent in iter_nodes(root) if node.get("id")}
+
+
+def _sanitize_subtree(node: dict, sanitize: Callable[[str], str]) -> None:
+    for item, _ in iter_nodes(node):
+        if item.get("description"):
+            item["description"] = sanitize(item["description"])
+
+
+def _lookup(index, node_id: Optional[str]) -> Tuple[dict, Optional[dict]]:
+    if not node_id or node_id not in index:
+        raise OperationError(f"Unknown node id: {node_id}")
+    return index[node_id]
+
+
+def _detach(parent: dict, child: dict) -> int:
+    """Remove ``child`` from its parent's children and return its former position."""
+    children = parent["children"]
+    for position, item in enumerate(children):
+        if item is child:
+            del children[position]
+            return position
+    return len(children)
+
+
+def _insert_child(parent: dict, child: dict, position: Optional[int]) -> None:
+    children = parent.get("children")
+    if not isinstance(children, list):
+        children = parent["children"] = []
+    if position is None or position > len(children):
+        position = len(children)
+    children.insert(position, child)
+
+
+def apply_operations(root: dict, operations: Iterable[dict], sanitize: Callable[[str], str],
+                     index: Optional[Dict[str, Tuple[dict, Optional[dict]]]] = None) -> dict:
+    """
+    Apply node-level operations to a document in place.
+
+    Supported operations (all addressed by stable node id):
+      - ``{"op": "add", "parent_id", "node", "index"?}``
+      - ``{"op": "update", "id", "name"?, "description"?, "isCollapsed"?}``
+      - ``{"op": "move", "id", "parent_id", "index"?}``
+      - ``{"op": "delete", "id"}``
+
+    Only descriptions of touched nodes are passed through ``sanitize``.
+    ``index`` is the document's ``index_nodes`` map, kept up to date, so a
+    caller holding on to a document doesn't walk it for every batch. If an
+    operation fails, the ones before it are undone, so the document and
+    ``index`` are left as they were.
+
+    Raises:
+        OperationError: If an operation references unknown nodes or would
+            corrupt the tree (e.g. deleting the root or creating a cycle).
+        ValueError: Propagated from ``sanitize``.
+    """
+    if index is None:
+        ensure_node_ids(root)
+        index = index_nodes(root)
+    undo: List[Callable[[], None]] = []
+    try:
+        for operation in operations:
+            _apply_operation(index, operation, sanitize, undo)
+    except Exception:
+        for action in reversed(undo):
+            action()
+        raise
+    return root
+
+
+def _apply_operation(index: Dict[str, Tuple[dict, Optional[dict]]], operation: dict,
+                     sanitize: Callable[[str], str], undo: List[Callable[[], None]]) -> None:
+    """Apply one operation, appending to ``undo`` what reverses it."""
+    op = operation.get("op")
+
+    if op == "add":
+        parent, _ = _lookup(index, operation.get("parent_id"))
+        node = operation.get("node")
+        if not isinstance(node, dict):
+            raise OperationError("Add operation requires a node")
+        ensure_node_ids(node)
+        added = index_nodes(node)
+        duplicates = set(added) & set(index)
+        if duplicates:
+            raise OperationError(f"Node id already exists: {sorted(duplicates)[0]}")
+        _sanitize_subtree(node, sanitize)
+        _insert_child(parent, node, operation.get("index"))
+        index.update(added)
+        index[node["id"]] = (node, parent)
+
+        def undo_add():
+            _detach(parent, node)
+            for node_id in added:
+                del index[node_id]
+        undo.append(undo_add)
+
+    elif op == "update":
+        node, _ = _lookup(index, operation.get("id"))
+        # Sanitize everything before changing anything
+        values = {}
+        for field in UPDATABLE_FIELDS:
+            if field not in operation:
+                continue
+            value = operation[field]
+            if field == "description":
+                value = sanitize(value) if value else ""
+            values[field] = value
+        missing = object()
+        previous = {field: node.get(field, missing) for field in values}
+        node.update(values)
+
+        def undo_update():
+            for field, value in previous.items():
+                if value is missing:
+                    node.pop(field, None)
+                else:
+                    node[field] = value
+        undo.append(undo_update)
+
+    elif op == "move":
+        node, old_parent = _lookup(index, operation.get("id"))
+        new_parent, _ = _lookup(index, operation.get("parent_id"))
+        if old_parent is None:
+            raise OperationError("Cannot move the root node")
+        # Walk up from the new parent to make sure we are not moving a node into itself
+        ancestor = new_parent
+        while ancestor is not None:
+            if ancestor is node:
+                raise OperationError("Cannot move a node into its own subtree")
+            ancestor = index[ancestor["id"]][1]
+        old_position = _detach(old_parent, node)
+        _insert_child(new_parent, node, operation.get("index"))
+        index[node["id"]] = (node, new_parent)
+
+        def undo_move():
+            _detach(new_parent, node)
+            _insert_child(old_parent, node, old_position)
+            index[node["id"]] = (node, old_parent)
+        undo.append(undo_move)
+
+    elif op == "delete":
+        node, parent = _lookup(index, operation.get("id"))
+        if parent is None:
+            raise OperationError("Cannot delete the root node")
+        position = _detach(parent, node)
+        removed = {}
+        for item, _ in iter_nodes(node):
+            if item.get("id") in index:
+                removed[item["id"]] = index.pop(item["id"])
+
+        def undo_delete():
+            _insert_child(parent, node, position)
+            index.update(removed)
+        undo.append(undo_delete)
+
+    else:
+        raise OperationError(f"Unsupported operation: {op}")
+
+
+def flatten_document(root: dict) -> List[dict]:
+    """
+    Flatten a document into node rows (``id``, ``parent_id``, ``ordinal``,
+    ``name``, ``description``, ``is_collapsed``), parents before children.
+
+    Missing or duplicate ids are replaced so every row has a unique id.
+    """
+    rows = []
+    seen = set()
+    stack = [(root, None, 0)]
+    while stack:
+        node, parent_id, ordinal = stack.pop()
+        node_id = node.get("id")
+        if not node_id or node_id in seen:
+            node_id = node["id"] = new_node_id()
+        seen.add(node_id)
+        rows.append({
+            "id": node_id,
+            "parent_id": parent_id,
+            "ordinal": ordinal,
+            "name": node.get("name") or "",
+            "description": node.get("description") or "",
+            "is_collapsed": bool(node.get("isCollapsed")),
+        })
+        children = [child for child in (node.get("children") or []) if isinstance(child, dict)]
+        for position in range(len(children) - 1, -1, -1):
+            stack.append((children[position], node_id, position))
+    return rows
+
+
+def node_from_row(row: Mapping) -> dict:
+    """Build a document node (without children) from a node row mapping."""
+    return {
+        "id": row["id"],
+        "name": row["name"] or "",
+        "description": row["description"] or "",
+        "isCollapsed": bool(row["is_collapsed"]),
+        "children": [],
+    }
+
+
+def build_document(rows: Iterable[Mapping], root_id: Optional[str] = None) -> Optional[dict]:
+    """
+    Rebuild a nested document from node rows.
+
+    Rows may arrive in any order; siblings are sorted by ``ordinal``. Returns
+    the node ``root_id`` (or the parentless root) or None if it is missing.
+    """
+    nodes = {}
+    children_of: Dict[Optional[str], List[Tuple[int, str]]] = {}
+    for row in rows:
+        node = node_from_row(row)
+        nodes[node["id"]] = node
+        children_of.setdefault(row["parent_id"], []).append((row["ordinal"], node["id"]))
+
+    for parent_id, entries in children_of.items():
+        parent = nodes.get(parent_id)
+        if parent is None:
+            continue
+        entries.sort()
+        parent["children"] = [nodes[node_id] for _, node_id in entries]
+
+    if root_id is not None:
+        return nodes.get(root_id)
+    roots = children_of.get(None)
+    return nodes[roots[0][1]] if roots else None
+
+
+def view_document(root: dict, root_id: Optional[str] = None, depth: Optional[int] = None) -> Optional[dict]:
+    """
+    Return the subtree rooted at ``root_id`` (the whole document if None),
+    limited to ``depth`` levels if given, or None if the node does not exist.
+    """
+    if root_id is not None:
+        entry = index_nodes(root).get(root_id)
+        if entry is None:
+            return None
+        root = entry[0]
+    if depth is not None:
+        root = truncate_document(root, depth)
+    return root
+
+
+def truncate_document(root: dict, depth: int) -> dict:
+    """
+    Return a copy of ``root`` limited to ``depth`` levels below it.
+
+    Nodes whose children were cut off keep an empty ``children`` list and a
+    ``childCount`` so the client can fetch that subtree on demand.
+    """
+    copy = {key: value for key, value in root.items() if key != "children"}
+    stack = [(root, copy, 0)]
+    while stack:
+        source, target, level = stack.pop()
+        children = [child for child in (source.get("children") or []) if isinstance(child, dict)]
+        if level >= depth:
+            target["children"] = []
+            if children:
+                target["childCount"] = len(children)
+            continue
+        target["children"] = []
+        for child in children:
+            child_copy = {key: value for key, value in child.items() if key != "children"}
+            target["children"].append(child_copy)
+            stack.append((child, child_copy, level + 1))
+    return copy
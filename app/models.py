@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime, timezone
@@ -13,6 +13,7 @@ class User(Base):
     security_question = Column(String)
     security_answer_hash = Column(String)
     hint = Column(String)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0") # Bumped to revoke issued tokens
 
     mindmaps = relationship("MindMap", back_populates="owner")
 
@@ -22,8 +23,53 @@ class MindMap(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     data = Column(Text) # JSON string of the mind map data
+    revision = Column(Integer, nullable=False, default=1, server_default="1") # Bumped on every write
+    node_count = Column(Integer, nullable=True) # Maintained on write for cheap listings
     user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     owner = relationship("User", back_populates="mindmaps")
+
+    __table_args__ = (
+        # Per-user listings, newest first, and per-user counts without touching the data pages
+        Index("ix_mindmaps_user_updated", "user_id", "updated_at", "id"),
+    )
+
+
+class MindMapNode(Base):
+    """One row per node, used when MINDMAP_STORAGE is "nodes"."""
+    __tablename__ = "mindmap_nodes"
+
+    map_id = Column(Integer, ForeignKey("mindmaps.id", ondelete="CASCADE"), primary_key=True)
+    id = Column(String, primary_key=True) # Stable node id from the document
+    parent_id = Column(String, nullable=True) # None for the root node
+    ordinal = Column(Integer, nullable=False, default=0) # Position among siblings
+    name = Column(String, nullable=False, default="")
+    description = Column(Text, nullable=False, default="")
+    is_collapsed = Column(Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        Index("ix_mindmap_nodes_map_parent", "map_id", "parent_id"),
+    )
+
+
+class SearchEntry(Base):
+    """
+    One row per node for full-text search, kept in step with the map by
+    ``app.search``. Titles and descriptions are stored as plain text.
+    """
+    __tablename__ = "search_entries"
+
+    id = Column(Integer, primary_key=True) # Stable rowid for SQLite's FTS5 table
+    map_id = Column(Integer, ForeignKey("mindmaps.id", ondelete="CASCADE"), nullable=False)
+    node_id = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True) # Copied from the map so searches skip the join
+    parent_id = Column(String, nullable=True) # Used to build the node's path for results
+    title = Column(String, nullable=False, default="")
+    body = Column(Text, nullable=False, default="")
+
+    __table_args__ = (
+        Index("ix_search_entries_map_node", "map_id", "node_id", unique=True),
+        Index("ix_search_entries_map_parent", "map_id", "parent_id"),
+    )
@@ -0,0 +1,183 @@
+"""
+Publish/subscribe for map events (collaborative edits, saves, deletes).
+
+``MemoryPubSub`` delivers messages within one process. ``RedisPubSub``
+relays them through Redis so that sessions connected to different workers
+see each other's edits; each process keeps one Redis subscription per
+channel and fans messages out to its local subscribers.
+
+The backend is chosen with ``PUBSUB_BACKEND`` ("memory" or "redis", which
+needs the ``redis`` package and ``REDIS_URL``).
+"""
+from typing import Dict, Optional, Set
+import asyncio
+import logging
+
+from . import codec
+from .core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - depends on the environment
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Messages published on one channel, in order. Iterate with ``async for``.
+
+    A subscriber that falls ``max_pending`` messages behind is dropped: the
+    iteration ends and ``overflowed`` is set, so it can resynchronize
+    instead of holding up everyone else.
+    """
+    _CLOSED = object()
+
+    def __init__(self, pubsub: "MemoryPubSub", channel: str, max_pending: int):
+        self._pubsub = pubsub
+        self.channel = channel
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending + 1)
+        self._max_pending = max_pending
+        self.overflowed = False
+        self.closed = False
+
+    def _deliver(self, message: dict) -> None:
+        if self.closed:
+            return
+        if self._queue.qsize() >= self._max_pending:
+            self.overflowed = True
+            self._end()
+            return
+        self._queue.put_nowait(message)
+
+    def _end(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._queue.put_nowait(self._CLOSED)
+            self._pubsub._remove(self)
+
+    async def close(self) -> None:
+        self._end()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        message = await self._queue.get()
+        if message is self._CLOSED:
+            raise StopAsyncIteration
+        return message
+
+
+class MemoryPubSub:
+    """Fan-out to subscribers in this process."""
+
+    def __init__(self, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self._channels: Dict[str, Set[Subscription]] = {}
+
+    async def publish(self, channel: str, message: dict) -> None:
+        self._deliver(channel, message)
+
+    def _deliver(self, channel: str, message: dict) -> None:
+        for subscription in list(self._channels.get(channel, ())):
+            subscription._deliver(message)
+
+    async def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(self, channel, self.max_pending)
+        self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def _remove(self, subscription: Subscription) -> None:
+        subscribers = self._channels.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._channels[subscription.channel]
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._channels.get(channel, ()))
+
+    async def close(self) -> None:
+        for subscribers in list(self._channels.values()):
+            for subscription in list(subscribers):
+                subscription._end()
+
+
+class RedisPubSub(MemoryPubSub):
+    """Fan-out across processes through Redis, then locally as ``MemoryPubSub``."""
+
+    def __init__(self, url: str, max_pending: int = 1000):
+        if aioredis is None:
+            raise RuntimeError("PUBSUB_BACKEND=redis requires the redis package")
+        super().__init__(max_pending)
+        self._redis = aioredis.from_url(url)
+        self._pubsub = self._redis.pubsub()
+        self._reader: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: dict) -> None:
+        # Local subscribers get the message back from Redis like everyone else
+        await self._redis.publish(channel, codec.dumps_bytes(message))
+
+    async def subscribe(self, channel: str) -> Subscription:
+        first = self.subscriber_count(channel) == 0
+        subscription = await super().subscribe(channel)
+        if first:
+            await self._pubsub.subscribe(channel)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+        return subscription
+
+    def _remove(self, subscription: Subscription) -> None:
+        super()._remove(subscription)
+        if self.subscriber_count(subscription.channel) == 0:
+            asyncio.ensure_future(self._unsubscribe(subscription.channel))
+
+    async def _unsubscribe(self, channel: str) -> None:
+        try:
+            if self.subscriber_count(channel) == 0:
+                await self._pubsub.unsubscribe(channel)
+        except Exception as e:
+            logger.error(f"Error unsubscribing from {channel}: {str(e)}")
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                self._deliver(channel, codec.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reading from Redis pub/sub: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        await super().close()
+        await self._pubsub.close()
+        await self._redis.close()
+
+
+def map_channel(map_id: int) -> str:
+    return f"map:{map_id}"
+
+
+def create_pubsub() -> MemoryPubSub:
+    if settings.PUBSUB_BACKEND == "redis":
+        return RedisPubSub(settings.REDIS_URL)
+    return MemoryPubSub()
+
+
+pubsub = create_pubsub()
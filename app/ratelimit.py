@@ -0,0 +1,306 @@
+"""
+Rate limiting with GCRA (the generic cell rate algorithm).
+
+Each bucket stores a single number, its theoretical arrival time (TAT): the
+moment it would be empty again if requests kept coming at exactly the
+allowed rate. A request is allowed unless it would push the TAT more than
+one burst ahead of now. That is token-bucket behaviour (a burst of up to
+the limit, then a steady rate) with one float per key and nothing to refill.
+
+Limits come from the settings, in requests per minute (0 turns a rule off):
+
+- ``LOGIN_RATE_LIMIT``: POST /auth/token and /auth/reset-password, per client IP
+- ``SIGNUP_RATE_LIMIT``: POST /auth/signup, per client IP
+- ``RATE_LIMIT_PER_MINUTE``: every other request under /api and /auth, per
+  user (per client IP for requests without a valid token)
+
+Buckets live in the store chosen with ``RATE_LIMIT_BACKEND``: "memory" (per
+process), "sqlite" (a file shared by every worker on the host) or "redis"
+(shared by every host; needs the ``redis`` package and ``REDIS_URL``). If
+the store fails, requests are let through and the error is logged.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import math
+import sqlite3
+import time
+
+from jose import JWTError, jwt
+from starlette.responses import JSONResponse
+
+from .cache import LRUCache
+from .core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - depends on the environment
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Rule:
+    """``limit`` requests per ``period`` seconds, in bursts of up to ``limit``."""
+    name: str
+    limit: int
+    period: float = 60.0
+
+
+class MemoryStore:
+    """Buckets in this process."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tats: Dict[str, float] = {}
+
+    async def update(self, key: str, now: float, interval: float, window: float) -> float:
+        """
+        Count one request against a bucket. Returns 0 if it is allowed,
+        otherwise the seconds until it would be.
+        """
+        tat = max(self._tats.get(key, now), now) + interval
+        if tat - window > now:
+            return tat - window - now
+        self._tats[key] = tat
+        if len(self._tats) > self.max_keys:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float) -> None:
+        # Buckets whose TAT has passed are full again, the same as no entry
+        self._tats = {key: tat for key, tat in self._tats.items() if tat > now}
+        # Still too many active clients: forget the oldest ones
+        for key in list(self._tats)[:len(self._tats) - self.max_keys // 2]:
+            del self._tats[key]
+
+    async def close(self) -> None:
+        self._tats.clear()
+
+
+class SQLiteStore:
+    """
+    Buckets in a SQLite file, so every worker process on the host shares
+    them. Each check is a single upsert, run on one thread of its own so a
+    locked file never stalls the event loop; the file is in WAL mode without
+    fsync, as losing it only resets the limits. A check that cannot get the
+    lock within ``BUSY_TIMEOUT`` lets the request through.
+    """
+    _SCHEMA = "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID"
+    # Inserts a new bucket, or advances an existing one only if that stays within the burst
+    _UPDATE = (
+        "INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval) "
+        "ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval "
+        "WHERE max(tat, :now) + :interval - :window <= :now "
+        "RETURNING tat"
+    )
+    # Expired rows are deleted after this many updates
+    PRUNE_EVERY = 10_000
+    # Seconds to wait for another worker's write before giving up on a check
+    BUSY_TIMEOUT = 0.05
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._updates = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            # A single thread, so the connection is only ever used by one check at a time
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+        return self._executor
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=self.BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(self._SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _update(self, key: str, now: float, interval: float, window: float) -> float:
+        conn = self._connect()
+        params = {"key": key, "now": now, "interval": interval, "window": window}
+        try:
+            if conn.execute(self._UPDATE, params).fetchone() is None:
+                row = conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+                return max(row[0], now) + interval - window - now if row else 0.0
+            self._updates += 1
+            if self._updates % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+        except sqlite3.OperationalError as e:
+            # Usually "database is locked": other workers hold the file, so let this one through
+            logger.warning(f"Rate limit store busy, allowing request: {str(e)}")
+        return 0.0
+
+    async def update(self, key: str, now: float, interval: float, window: float) -> float:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), self._update, key, now, interval, window)
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+            self._executor.shutdown()
+            self._executor = None
+        else:
+            self._close()
+
+
+class RedisStore:
+    """Buckets in Redis, updated atomically by a Lua script."""
+    _SCRIPT = """
+local now, interval, window = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now) + interval
+if tat - window > now then
+    return tostring(tat - window - now)
+end
+redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000))
+return '0'
+"""
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package (pip install redis)")
+        self._client = aioredis.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    async def update(self, key: str, now: float, interval: float, window: float) -> float:
+        return float(await self._script(keys=[f"ratelimit:{key}"], args=[now, interval, window]))
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def create_store():
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisStore(settings.REDIS_URL)
+    if settings.RATE_LIMIT_BACKEND == "sqlite":
+        return SQLiteStore(settings.RATE_LIMIT_SQLITE_PATH)
+    return MemoryStore()
+
+
+class RateLimiter:
+    """
+    Picks the rule for a request and counts it against the caller's bucket.
+
+    Args:
+        store: Where buckets are kept (see ``create_store``)
+        route_rules: ``(method, path) -> Rule`` for routes limited per client IP
+        default_rule: Per-user rule for the rest of /api and /auth, or None
+    """
+
+    def __init__(self, store, route_rules: Dict[Tuple[str, str], Rule], default_rule: Optional[Rule]):
+        self.store = store
+        self.route_rules = route_rules
+        self.default_rule = default_rule
+        self._limited: Dict[str, int] = {}
+        # Verifying a JWT costs far more than the check itself, so remember whose token it is
+        self._token_users = LRUCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+    def _token_user(self, token: str) -> Optional[str]:
+        user = self._token_users.get(token)
+        if user is None:
+            try:
+                payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            except JWTError:
+                return None
+            subject = payload.get("uid") or payload.get("sub")
+            if subject is None:
+                return None
+            user = f"user:{subject}"
+            self._token_users.set(token, user)
+        return user
+
+    def classify(self, scope: dict) -> Tuple[Optional[Rule], str]:
+        """The rule for a request and the identity its bucket belongs to."""
+        client = scope.get("client")
+        address = f"ip:{client[0]}" if client else "ip:unknown"
+        rule = self.route_rules.get((scope["method"], scope["path"]))
+        if rule is not None:
+            return rule, address
+        if self.default_rule is None or scope["method"] == "OPTIONS" or not scope["path"].startswith(("/api/", "/auth/")):
+            return None, address
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if value[:7].lower() == b"bearer ":
+                    return self.default_rule, self._token_user(value[7:].decode("latin-1")) or address
+                break
+        return self.default_rule, address
+
+    async def hit(self, rule: Rule, identity: str) -> float:
+        """Count a request. Returns 0 if it is allowed, else the seconds to wait."""
+        interval = rule.period / rule.limit
+        try:
+            retry_after = await self.store.update(f"{rule.name}:{identity}", time.time(), interval, interval * rule.limit)
+        except Exception as e:
+            logger.error(f"Rate limit store failed, allowing request: {str(e)}")
+            return 0.0
+        if retry_after > 0:
+            self._limited[rule.name] = self._limited.get(rule.name, 0) + 1
+        return retry_after
+
+    def metrics(self) -> dict:
+        return {
+            "backend": type(self.store).__name__,
+            "limited": dict(self._limited),
+        }
+
+    async def close(self) -> None:
+        await self.store.close()
+
+
+def _rule(name: str, per_minute: int) -> Optional[Rule]:
+    return Rule(name, per_minute) if per_minute > 0 else None
+
+
+def create_limiter() -> RateLimiter:
+    login = _rule("login", settings.LOGIN_RATE_LIMIT)
+    signup = _rule("signup", settings.SIGNUP_RATE_LIMIT)
+    route_rules = {
+        route: rule for route, rule in (
+            (("POST", "/auth/token"), login),
+            (("POST", "/auth/reset-password"), login),
+            (("POST", "/auth/signup"), signup),
+        ) if rule is not None
+    }
+    return RateLimiter(create_store(), route_rules, _rule("default", settings.RATE_LIMIT_PER_MINUTE))
+
+
+limiter = create_limiter()
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware answering 429 with ``Retry-After`` once a bucket is
+    empty. A plain ASGI class rather than ``@app.middleware`` keeps the
+    per-request cost to the bucket check itself.
+    """
+
+    def __init__(self, app, rate_limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = rate_limiter or limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            rule, identity = self.limiter.classify(scope)
+            if rule is not None:
+                retry_after = await self.limiter.hit(rule, identity)
+                if retry_after > 0:
+                    response = JSONResponse(
+                        {"detail": "Too many requests, please try again later"},
+                        status_code=429,
+                        headers={"Retry-After": str(math.ceil(retry_after))},
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import timedelta
 from .. import models, database, auth, schemas
-from ..core.config import settings
+from ..hashing import HashingBusy, hashing_pool
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,18 +14,46 @@ router = APIRouter(
     tags=["auth"]
 )
 
+async def _get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+def _busy(endpoint: str) -> HTTPException:
+    logger.warning(f"Password hashing pool saturated, rejecting {endpoint}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please try again shortly",
+        headers={"Retry-After": "1"},
+    )
+
+async def _hash(endpoint: str, *passwords: str):
+    """Hash one or more passwords in parallel on the hashing pool."""
+    try:
+        return await asyncio.gather(*(hashing_pool.hash(endpoint, password) for password in passwords))
+    except HashingBusy:
+        raise _busy(endpoint)
+
+async def _verify(endpoint: str, password: str, hashed_password: str):
+    """
+    Verify a password on the hashing pool. Returns ``(matches, new_hash)``,
+    where ``new_hash`` is set when the stored hash predates the current policy.
+    """
+    try:
+        return await hashing_pool.verify_and_update(endpoint, password, hashed_password)
+    except HashingBusy:
+        raise _busy(endpoint)
+
 @router.post("/signup")
-def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
     try:
         # Check if user already exists
-        db_user = db.query(models.User).filter(models.User.email == user.email).first()
+        db_user = await _get_user_by_email(db, user.email)
         if db_user:
             logger.warning(f"Signup attempt with existing email: {user.email}")
             raise HTTPException(status_code=400, detail="Email already registered")
 
-        # Hash password and security answer
-        hashed_password = auth.get_password_hash(user.password)
-        hashed_answer = auth.get_password_hash(user.security_answer)
+        # Hash password and security answer (CPU-bound, on the hashing pool)
+        hashed_password, hashed_answer = await _hash("signup", user.password, user.security_answer)
 
         # Create new user
         new_user = models.User(
@@ -35,8 +64,7 @@ def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
             hint=user.hint
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
 
         logger.info(f"New user registered: {user.email}")
         return {"message": "User created successfully"}
@@ -44,18 +72,18 @@ def signup(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
         raise
     except Exception as e:
         logger.error(f"Error during signup: {str(e)}")
-        db.rollback()
+        await db.rollback()
         # Return the specific error message to the client as requested
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/check-email/{email}")
-def check_email(email: str, db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == email).first()
+async def check_email(email: str, db: AsyncSession = Depends(database.get_async_db)):
+    user = await _get_user_by_email(db, email)
     return {"exists": user is not None}
 
 @router.get("/security-question/{email}")
-def get_security_question(email: str, db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == email).first()
+async def get_security_question(email: str, db: AsyncSession = Depends(database.get_async_db)):
+    user = await _get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {
@@ -64,22 +92,27 @@ def get_security_question(email: str, db: Session = Depends(database.get_db)):
     }
 
 @router.post("/reset-password")
-def reset_password(reset_data: schemas.PasswordReset, db: Session = Depends(database.get_db)):
+async def reset_password(reset_data: schemas.PasswordReset, db: AsyncSession = Depends(database.get_async_db)):
     try:
-        user = db.query(models.User).filter(models.User.email == reset_data.email).first()
+        user = await _get_user_by_email(db, reset_data.email)
         if not user:
             # Don't reveal if user exists or not (security best practice)
             logger.warning(f"Password reset attempt for non-existent user: {reset_data.email}")
             raise HTTPException(status_code=400, detail="Invalid email or security answer")
 
         # Verify security answer
-        if not auth.verify_password(reset_data.security_answer, user.security_answer_hash):
+        answer_ok, new_answer_hash = await _verify("reset_password", reset_data.security_answer, user.security_answer_hash)
+        if not answer_ok:
             logger.warning(f"Failed password reset attempt for: {reset_data.email}")
             raise HTTPException(status_code=400, detail="Invalid email or security answer")
+        if new_answer_hash:
+            user.security_answer_hash = new_answer_hash
 
-        # Update password
-        user.hashed_password = auth.get_password_hash(reset_data.new_password)
-        db.commit()
+        # Update password and revoke tokens issued with the old one
+        (user.hashed_password,) = await _hash("reset_password", reset_data.new_password)
+        user.token_version = (user.token_version or 0) + 1
+        await db.commit()
+        auth.invalidate_user(user.id)
 
         logger.info(f"Password reset successful for: {reset_data.email}")
         return {"message": "Password reset successfully"}
@@ -87,14 +120,17 @@ def reset_password(reset_data: schemas.PasswordReset, db: Session = Depends(data
         raise
     except Exception as e:
         logger.error(f"Error during password reset: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="An error occurred during password reset")
 
 @router.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
     try:
-        user = db.query(models.User).filter(models.User.email == form_data.username).first()
-        if not user or not auth.verify_password(form_data.password, user.hashed_password):
+        user = await _get_user_by_email(db, form_data.username)
+        password_ok, new_hash = (False, None)
+        if user:
+            password_ok, new_hash = await _verify("login", form_data.password, user.hashed_password)
+        if not password_ok:
             logger.warning(f"Failed login attempt for: {form_data.username}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -102,12 +138,19 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = auth.create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
-        )
-
+        access_token = auth.create_user_token(user)
         logger.info(f"Successful login for: {user.email}")
+
+        if new_hash:
+            # Stored hash predates the current policy; the login still succeeds if saving fails
+            try:
+                user.hashed_password = new_hash
+                await db.commit()
+                logger.info(f"Upgraded password hash for: {form_data.username}")
+            except Exception as e:
+                logger.error(f"Error upgrading password hash: {str(e)}")
+                await db.rollback()
+
         return {"access_token": access_token, "token_type": "bearer"}
     except HTTPException:
         raise
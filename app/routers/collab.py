@@ -0,0 +1,226 @@
+"""
+Live collaborative editing of a map over WebSockets.
+
+Every editor session of a map connects to ``/ws/maps/{map_id}``, sends its
+access token in the first message (not the URL, which ends up in access
+logs)::
+
+    {"type": "auth", "token": "..."}
+
+and then its edits as node-level operations::
+
+    {"type": "ops", "id": 1, "ops": [{"op": "update", "id": "...", "name": "..."}]}
+
+The token is checked again before every batch of operations and every
+``REAUTH_SECONDS``; once it is revoked (e.g. by a password reset) or expires
+the session is closed with code 1008. Batches count against the same
+per-user rate limit as API requests; over it, the sender gets an error with
+``"status": 429`` and ``retry_after`` and the batch is not applied.
+
+Operations address nodes by stable id, so they are applied to the latest
+version of the map rather than checked against a base revision; edits to
+different nodes merge and concurrent edits to the same field go to the
+last writer. The sender gets ``{"type": "ack", "id", "revision"}`` (or
+``{"type": "error", "id", "detail"}``, after which it should reload the
+map) and every other session gets ``{"type": "ops", "revision", "ops"}``.
+REST saves are forwarded too: ``{"type": "replace", "revision"}`` after a
+full save and ``{"type": "deleted"}``.
+
+With ``WRITE_BUFFER_ENABLED`` the live document of each map is held in
+memory and written to the database in batches (single worker). Otherwise
+each batch of operations is written as it arrives, and ``PUBSUB_BACKEND=redis``
+shares the fan-out between workers.
+"""
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import TypeAdapter, ValidationError
+from typing import List
+import asyncio
+import logging
+import math
+import uuid
+
+from .. import auth, codec, database, schemas
+from ..pubsub import map_channel, pubsub
+from ..ratelimit import limiter
+from .maps import _get_revision, apply_map_operations, publish_map_event
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["collab"])
+
+_operations = TypeAdapter(List[schemas.NodeOperation])
+
+# Largest batch of operations accepted in one message, as for PATCH
+MAX_OPS = 1000
+
+# Seconds a new connection has to send its token
+AUTH_TIMEOUT_SECONDS = 10
+
+# Seconds between token checks of a session that isn't sending edits
+REAUTH_SECONDS = 60
+
+
+class _Session:
+    """One connected editor: serializes sends from the reader and the forwarder."""
+
+    def __init__(self, websocket: WebSocket, map_id: int, user_id: int, token: str):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.map_id = map_id
+        self.user_id = user_id
+        self.token = token
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict) -> None:
+        async with self._send_lock:
+            await self.websocket.send_text(codec.dumps(message))
+
+    async def close(self, code: int) -> None:
+        async with self._send_lock:
+            await self.websocket.close(code=code)
+
+
+async def _read_token(websocket: WebSocket) -> str:
+    """Wait for the ``auth`` message. Returns "" if none arrives in time."""
+    try:
+        message = codec.loads(await asyncio.wait_for(websocket.receive_text(), AUTH_TIMEOUT_SECONDS))
+    except (asyncio.TimeoutError, ValueError):
+        return ""
+    if not isinstance(message, dict) or message.get("type") != "auth" or not isinstance(message.get("token"), str):
+        return ""
+    return message["token"]
+
+
+async def _authenticate(token: str):
+    """Return the token's user or raise ``HTTPException`` (401)."""
+    async with database.AsyncSessionLocal() as db:
+        return await auth.authenticate_token(token, db)
+
+
+async def _revision(map_id: int, user_id: int) -> int:
+    """The map's current revision, or ``HTTPException`` (404)."""
+    async with database.AsyncSessionLocal() as db:
+        return await _get_revision(db, map_id, user_id)
+
+
+async def _authorized(session: _Session) -> bool:
+    """Check the session's token again; close the session if it is no longer valid."""
+    try:
+        # Usually answered from the user cache without a query
+        async with database.AsyncSessionLocal() as db:
+            await auth.authenticate_token(session.token, db)
+    except HTTPException:
+        logger.info(f"Closing live session {session.id}: its token was revoked or expired")
+        await session.close(status.WS_1008_POLICY_VIOLATION)
+        return False
+    return True
+
+
+async def _apply(session: _Session, message: dict) -> None:
+    request_id = message.get("id")
+    rule = limiter.default_rule
+    if rule is not None:
+        retry_after = await limiter.hit(rule, f"user:{session.user_id}")
+        if retry_after > 0:
+            await session.send({
+                "type": "error", "id": request_id, "status": 429,
+                "detail": "Too many requests, please try again later", "retry_after": math.ceil(retry_after),
+            })
+            return
+    try:
+        raw_ops = message.get("ops")
+        if not isinstance(raw_ops, list) or not 0 < len(raw_ops) <= MAX_OPS:
+            raise ValueError(f"Send between 1 and {MAX_OPS} operations")
+        operations = [op.model_dump(exclude_none=True) for op in _operations.validate_python(raw_ops)]
+    except (ValueError, ValidationError) as e:
+        await session.send({"type": "error", "id": request_id, "detail": str(e)})
+        return
+
+    try:
+        async with database.AsyncSessionLocal() as db:
+            result = await apply_map_operations(db, session.map_id, session.user_id, None, operations)
+    except HTTPException as e:
+        await session.send({"type": "error", "id": request_id, "detail": e.detail})
+        return
+
+    await session.send({"type": "ack", "id": request_id, "revision": result.revision})
+    await publish_map_event(session.map_id, {"type": "ops", "revision": result.revision, "ops": operations}, session.id)
+
+
+async def _receive(session: _Session) -> None:
+    while True:
+        try:
+            message = codec.loads(await session.websocket.receive_text())
+        except ValueError:
+            await session.send({"type": "error", "id": None, "detail": "Invalid JSON"})
+            continue
+        if not isinstance(message, dict):
+            continue
+        if message.get("type") == "ops":
+            if not await _authorized(session):
+                return
+            await _apply(session, message)
+        elif message.get("type") == "ping":
+            await session.send({"type": "pong"})
+
+
+async def _forward(session: _Session, subscription) -> None:
+    async for event in subscription:
+        if event.get("origin") != session.id:
+            await session.send({key: value for key, value in event.items() if key != "origin"})
+    if subscription.overflowed:
+        # This session fell too far behind; it has to reload the map
+        await session.send({"type": "replace", "revision": None})
+
+
+async def _watch_token(session: _Session) -> None:
+    while True:
+        await asyncio.sleep(REAUTH_SECONDS)
+        if not await _authorized(session):
+            return
+
+
+@router.websocket("/ws/maps/{map_id}")
+async def map_session(websocket: WebSocket, map_id: int):
+    await websocket.accept()
+    subscription = None
+    try:
+        token = await _read_token(websocket)
+        user = await _authenticate(token)
+        # Subscribe before reading the revision, so every edit after the
+        # revision in "hello" reaches this session (edits at or below it are
+        # already in the map the client loads)
+        subscription = await pubsub.subscribe(map_channel(map_id))
+        revision = await _revision(map_id, user.id)
+    except WebSocketDisconnect:
+        if subscription is not None:
+            await subscription.close()
+        return
+    except HTTPException as e:
+        if subscription is not None:
+            await subscription.close()
+        code = status.WS_1008_POLICY_VIOLATION if e.status_code == 401 else 4404
+        await websocket.close(code=code)
+        return
+
+    session = _Session(websocket, map_id, user.id, token)
+    tasks = []
+    try:
+        await session.send({"type": "hello", "session": session.id, "revision": revision})
+        tasks = [
+            asyncio.create_task(_receive(session)),
+            asyncio.create_task(_forward(session, subscription)),
+            asyncio.create_task(_watch_token(session)),
+        ]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in live session for map {map_id}: {str(e)}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await subscription.close()
+        logger.debug(f"Live session {session.id} for map {map_id} closed")
@@ -1,97 +1,624 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from .. import models, database, auth, schemas
-from ..utils import sanitize_html  # NEW IMPORT
-import json
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import defer
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from typing import Iterator, List, Literal, Optional, Tuple
+from .. import codec, models, database, auth, schemas, search
+from ..mindmap_ops import view_document
+from ..pubsub import map_channel, pubsub
+from ..sanitizer import prepare_document, sanitize_description, sanitize_document
+from ..storage import BlobStorage, get_storage, stored_size_expression
+from ..write_buffer import RevisionConflict, write_buffer
+import base64
+import gzip
+import hashlib
 import logging
+import zipfile
+import zlib
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/api/maps",
-    tags=["maps"]
+    tags=["maps"],
+    default_response_class=codec.JSONResponse
 )
 
+def _map_response(map_item, data: str) -> schemas.MindMapResponse:
+    """
+    Build a response for a map whose document may not live in ``MindMap.data``.
+    ``map_item`` is a ``MindMap`` row or a map pending in the write buffer.
+    """
+    return schemas.MindMapResponse(
+        id=map_item.id,
+        title=map_item.title,
+        data=data,
+        user_id=map_item.user_id,
+        revision=map_item.revision,
+        created_at=map_item.created_at,
+        updated_at=map_item.updated_at,
+    )
+
+def _encode_cursor(updated_at: datetime, map_id: int) -> str:
+    raw = codec.dumps([updated_at.isoformat() if updated_at else None, map_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        updated_at, map_id = codec.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(updated_at) if updated_at else None), int(map_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _map_etag(map_id: int, revision: int, updated_at: Optional[datetime],
+              depth: Optional[int] = None, node_id: Optional[str] = None) -> str:
+    """
+    Strong ETag for a map representation. ``updated_at`` is included because
+    moving a map between storage backends changes its serialized form
+    without a new revision.
+    """
+    if updated_at is not None and updated_at.tzinfo is None:
+        # Timestamps read back from the database are naive UTC
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    stamp = int(updated_at.timestamp() * 1_000_000) if updated_at else 0
+    tag = f"{map_id}-{revision}-{stamp:x}"
+    if depth is not None or node_id is not None:
+        variant = hashlib.blake2b(f"{depth}:{node_id}".encode(), digest_size=4).hexdigest()
+        tag = f"{tag}-{variant}"
+    return f'"{tag}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _parse_if_match(if_match: str, map_id: int) -> Optional[int]:
+    """Read the expected revision from an If-Match header: an ETag from GET or a bare revision."""
+    value = if_match.strip()
+    if value == "*":
+        return None
+    if value.startswith("W/"):
+        value = value[2:]
+    parts = value.strip('"').split("-")
+    try:
+        if len(parts) >= 2 and parts[0] == str(map_id):
+            return int(parts[1])
+        if len(parts) == 1:
+            return int(parts[0])
+    except ValueError:
+        pass
+    raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+async def _get_user_map(db: AsyncSession, map_id: int, user_id: int, load_data: bool = True) -> Optional[models.MindMap]:
+    query = select(models.MindMap).where(
+        models.MindMap.id == map_id,
+        models.MindMap.user_id == user_id
+    )
+    if not load_data:
+        query = query.options(defer(models.MindMap.data))
+    result = await db.execute(query.execution_options(populate_existing=True))
+    return result.scalars().first()
+
+async def _get_revision(db: AsyncSession, map_id: int, user_id: int) -> int:
+    pending = write_buffer.get(map_id, user_id)
+    if pending is not None:
+        return pending.revision
+    revision = (await db.execute(select(models.MindMap.revision).where(
+        models.MindMap.id == map_id,
+        models.MindMap.user_id == user_id
+    ))).scalar()
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Mind Map not found")
+    return revision
+
+async def _claim_revision(db: AsyncSession, map_id: int, user_id: int, expected: Optional[int], **values) -> None:
+    """
+    Bump a map's revision with one conditional ``UPDATE ... WHERE revision = ?``.
+
+    If another save got there first no row matches and this raises 409. Once
+    the row is updated, the rest of the transaction's writes are serialized
+    behind it, so there is no read-modify-write race.
+    """
+    query = update(models.MindMap).where(
+        models.MindMap.id == map_id,
+        models.MindMap.user_id == user_id
+    )
+    if expected is not None:
+        query = query.where(models.MindMap.revision == expected)
+    result = await db.execute(
+        query.values(revision=models.MindMap.revision + 1, **values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        await db.rollback()
+        await _get_revision(db, map_id, user_id)  # 404 if the map is gone
+        raise HTTPException(status_code=409, detail="Mind Map has changed since base revision")
+
+async def publish_map_event(map_id: int, message: dict, origin: Optional[str] = None) -> None:
+    """
+    Tell live editor sessions about a change to a map. ``origin`` is the
+    session that made it, which already has the change.
+    """
+    try:
+        await pubsub.publish(map_channel(map_id), {**message, "origin": origin})
+    except Exception as e:
+        # The change is saved; sessions that miss it catch up on their next save
+        logger.error(f"Error publishing event for map {map_id}: {str(e)}")
+
+def sanitize_operations(operations: List[dict]) -> List[dict]:
+    """Sanitize the descriptions carried by node operations, in place."""
+    for operation in operations:
+        if operation.get("description"):
+            operation["description"] = sanitize_description(operation["description"])
+        if isinstance(operation.get("node"), dict):
+            sanitize_document(operation["node"])
+    return operations
+
+async def apply_map_operations(db: AsyncSession, map_id: int, user_id: int, expected: Optional[int], operations: List[dict]):
+    """
+    Apply node-level operations to a map, through the write buffer if enabled.
+
+    ``operations`` are sanitized in place first, so they can be passed on to
+    other sessions exactly as applied. With ``expected`` the operations only
+    apply if the map is still at that revision.
+
+    Returns:
+        The updated ``MindMap`` row or buffered map (with ``revision`` and ``updated_at``)
+
+    Raises:
+        HTTPException: 404 if the map is not found, 409 on a revision
+            conflict, 400 if an operation cannot be applied
+    """
+    try:
+        sanitize_operations(operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if write_buffer.enabled:
+        try:
+            return await write_buffer.save(
+                db, map_id, user_id, expected,
+                operations=operations, sanitize=sanitize_description
+            )
+        except LookupError:
+            raise HTTPException(status_code=404, detail="Mind Map not found")
+        except RevisionConflict:
+            raise HTTPException(status_code=409, detail="Mind Map has changed since base revision")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    await _claim_revision(db, map_id, user_id, expected)
+    map_item = await _get_user_map(db, map_id, user_id)
+
+    def apply(session):
+        get_storage().apply(session, map_item, operations, sanitize_description)
+        search.apply_operations(session, map_item, operations)
+
+    try:
+        await db.run_sync(apply)
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await db.commit()
+    await db.refresh(map_item, ["revision", "updated_at"])
+    return map_item
+
 @router.get("/", response_model=List[schemas.MindMapResponse])
-def get_maps(db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def get_maps(db: AsyncSession = Depends(database.get_async_db), current_user: auth.CurrentUser = Depends(auth.get_current_user_async)):
     try:
-        maps = db.query(models.MindMap).filter(models.MindMap.user_id == current_user.id).all()
-        return maps
+        storage = get_storage()
+        result = await db.execute(select(models.MindMap).where(models.MindMap.user_id == current_user.id))
+        maps = result.scalars().all()
+        # Storage backends use the sync Session API; run_sync bridges them onto the async connection
+        responses = await db.run_sync(lambda session: [_map_response(m, storage.dumps(session, m)) for m in maps])
+        for index, map_item in enumerate(maps):
+            pending = write_buffer.get(map_item.id, current_user.id)
+            if pending is not None:
+                responses[index] = _map_response(pending, codec.dumps(pending.document))
+        return responses
     except Exception as e:
         logger.error(f"Error fetching maps for user {current_user.email}: {str(e)}")
         raise HTTPException(status_code=500, detail="Error fetching mind maps")
 
+@router.get("/summary", response_model=schemas.MindMapSummaryPage)
+async def get_map_summaries(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    stats: bool = Query(False, description="Include node_count and byte_size"),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    List maps without their documents, most recently updated first.
 
-def sanitize_mindmap_data(data_str: str) -> str:
+    Only metadata columns are selected, so ``MindMap.data`` is never loaded.
+    Pages use keyset pagination on ``(updated_at, id)``.
     """
-    Recursively sanitize all descriptions in mind map data.
-    
+    MindMap = models.MindMap
+    columns = [MindMap.id, MindMap.title, MindMap.revision, MindMap.created_at, MindMap.updated_at]
+    if stats:
+        columns += [MindMap.node_count, stored_size_expression().label("byte_size")]
+
+    query = select(*columns).where(MindMap.user_id == current_user.id)
+    if cursor:
+        updated_at, map_id = _decode_cursor(cursor)
+        query = query.where(or_(
+            MindMap.updated_at < updated_at,
+            and_(MindMap.updated_at == updated_at, MindMap.id < map_id)
+        ))
+    query = query.order_by(MindMap.updated_at.desc(), MindMap.id.desc()).limit(limit + 1)
+
+    try:
+        rows = (await db.execute(query)).mappings().all()
+    except Exception as e:
+        logger.error(f"Error fetching map summaries for user {current_user.email}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error fetching mind maps")
+
+    # The cursor is the last row's position in the database, not its buffered state
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_cursor(last["updated_at"], last["id"])
+    items = [schemas.MindMapSummary(**row) for row in rows[:limit]]
+    for item in items:
+        pending = write_buffer.get(item.id, current_user.id)
+        if pending is not None:
+            item.title, item.revision, item.updated_at = pending.title, pending.revision, pending.updated_at
+    return schemas.MindMapSummaryPage(items=items, next_cursor=next_cursor)
+
+@router.get("/search", response_model=List[schemas.SearchResult])
+async def search_maps(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    Find nodes across all of the user's maps whose title or description
+    contains every word of ``q`` (words match as prefixes), best match first.
+    """
+    try:
+        return await db.run_sync(lambda session: search.search(session, current_user.id, q, limit))
+    except Exception as e:
+        logger.error(f"Error searching maps for user {current_user.email}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error searching mind maps")
+
+
+def sanitize_mindmap_data(document: dict) -> Tuple[str, int]:
+    """
+    Validate and sanitize a decoded mind map in place, in a single pass, and
+    give every node a stable id so later edits can be sent as operations.
+
     Args:
-        data_str: JSON string of mind map data
-    
+        document: Mind map data as decoded by the request schema
+
     Returns:
-        Sanitized JSON string
+        Sanitized JSON string and the number of nodes in the map
     """
     try:
-        data = json.loads(data_str)
-        sanitized_data = _sanitize_node(data)
-        return json.dumps(sanitized_data)
+        node_count = prepare_document(document)
+        return codec.dumps(document), node_count
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error sanitizing mind map data: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid mind map data structure")
 
 
-def _sanitize_node(node: dict) -> dict:
-    """Recursively sanitize a single node and its children."""
-    # Sanitize description if present
-    if 'description' in node and node['description']:
-        try:
-            node['description'] = sanitize_html(node['description'])
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-    
-    # Recursively sanitize children
-    if 'children' in node and isinstance(node['children'], list):
-        node['children'] = [_sanitize_node(child) for child in node['children']]
-    
-    return node
-
 @router.post("/", response_model=schemas.MindMapResponse)
-def create_map(map: schemas.MindMapCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def create_map(map: schemas.MindMapCreate, db: AsyncSession = Depends(database.get_async_db), current_user: auth.CurrentUser = Depends(auth.get_current_user_async)):
     try:
-        # Validate JSON structure (already done by schema)
-        # Sanitize all descriptions in the data
-        sanitized_data = sanitize_mindmap_data(map.data)
-        
+        # The schema decoded the JSON; validate and sanitize the tree in one
+        # pass (CPU-bound, keep it off the event loop)
+        sanitized_data, node_count = await run_in_threadpool(sanitize_mindmap_data, map.document)
+
         new_map = models.MindMap(
             title=map.title,
-            data=sanitized_data,  # Use sanitized data
             user_id=current_user.id
         )
         db.add(new_map)
-        db.commit()
-        db.refresh(new_map)
+        await db.flush()
+        def save(session):
+            get_storage().save(session, new_map, sanitized_data, node_count, map.document)  # Use sanitized data
+            search.index_document(session, new_map, map.document)
+
+        await db.run_sync(save)
+        await db.commit()
+        await db.refresh(new_map)
 
         logger.info(f"Created new mind map '{map.title}' for user {current_user.email}")
-        return new_map
+        return _map_response(new_map, sanitized_data)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error creating map: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error creating mind map")
 
+# Maps fetched per round trip while exporting, and written per transaction while importing
+EXPORT_BATCH_SIZE = 50
+IMPORT_BATCH_SIZE = 50
+# Largest single map accepted by an import (one NDJSON line or zip entry)
+IMPORT_MAX_RECORD_BYTES = 16 * 1024 * 1024
+# Failures listed in an import result; the rest are only counted
+IMPORT_MAX_ERRORS = 100
+
+def _timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+async def _export_records(user_id: int):
+    """
+    Yield ``(map_id, record)`` for each of a user's maps, where ``record`` is
+    the map as JSON in the shape ``POST /`` and ``/import`` accept.
+
+    Rows come through a server-side cursor in batches, so only one batch of
+    maps is in memory at a time.
+    """
+    MindMap = models.MindMap
+    blob_storage = BlobStorage()
+    # Maps kept as node rows are loaded on a second session while the cursor is open
+    async with database.AsyncSessionLocal() as db, database.AsyncSessionLocal() as loader:
+        result = await db.stream(
+            select(MindMap.id, MindMap.title, MindMap.data, MindMap.revision, MindMap.created_at, MindMap.updated_at)
+            .where(MindMap.user_id == user_id)
+            .order_by(MindMap.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for row in result:
+            title, data, revision, updated_at = row.title, row.data, row.revision, row.updated_at
+            pending = write_buffer.get(row.id, user_id)
+            if pending is not None:
+                title, data, revision, updated_at = pending.title, codec.dumps(pending.document), pending.revision, pending.updated_at
+            elif data is None:
+                map_item = MindMap(id=row.id, title=row.title)
+                data = await loader.run_sync(lambda session: blob_storage.dumps(session, map_item))
+            yield row.id, codec.dumps({
+                "title": title,
+                "data": data,
+                "revision": revision,
+                "created_at": _timestamp(row.created_at),
+                "updated_at": _timestamp(updated_at),
+            })
+
+async def _export_ndjson(user_id: int):
+    async for _, record in _export_records(user_id):
+        yield record + "\n"
+
+class _ZipStream:
+    """Unseekable file object that collects what ``zipfile`` writes until it is taken."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def _export_zip(user_id: int):
+    stream = _ZipStream()
+    archive = zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED)
+    async for map_id, record in _export_records(user_id):
+        # Compressing is CPU-bound; keep it off the event loop
+        await run_in_threadpool(archive.writestr, f"map-{map_id}.json", record)
+        yield stream.take()
+    archive.close()
+    yield stream.take()
+
+def _read_lines(stream, label_prefix: str = "") -> Iterator[Tuple[str, bytes]]:
+    """Yield ``(label, line)`` for each non-empty line, with oversized lines reported as ``None``."""
+    number = 0
+    while True:
+        line = stream.readline(IMPORT_MAX_RECORD_BYTES + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > IMPORT_MAX_RECORD_BYTES:
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(IMPORT_MAX_RECORD_BYTES)
+            yield f"{label_prefix}line {number}", None
+        elif line.strip():
+            yield f"{label_prefix}line {number}", line
+
+def _import_records(upload) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """
+    Yield ``(label, raw_record)`` from an uploaded NDJSON file (optionally
+    gzipped) or a zip of ``.json``/``.ndjson`` files, reading one record at a
+    time. Records over ``IMPORT_MAX_RECORD_BYTES`` come through as ``None``.
+    """
+    magic = upload.read(4)
+    upload.seek(0)
+    if magic.startswith(b"PK"):
+        with zipfile.ZipFile(upload) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if info.filename.endswith(".ndjson"):
+                    with archive.open(info) as member:
+                        yield from _read_lines(member, f"{info.filename} ")
+                elif info.file_size > IMPORT_MAX_RECORD_BYTES:
+                    yield info.filename, None
+                else:
+                    yield info.filename, archive.read(info)
+    elif magic.startswith(b"\x1f\x8b"):
+        with gzip.GzipFile(fileobj=upload, mode="rb") as stream:
+            yield from _read_lines(stream)
+    else:
+        yield from _read_lines(upload)
+
+# Raised while reading a damaged zip or gzip upload
+_CORRUPT_UPLOAD_ERRORS = (zipfile.BadZipFile, gzip.BadGzipFile, EOFError, zlib.error)
+
+def _prepare_import_batch(records: Iterator[Tuple[str, Optional[bytes]]], size: int) -> list:
+    """
+    Parse, validate and sanitize up to ``size`` records. Returns
+    ``(label, map, sanitized_data, node_count)`` for good records and
+    ``(label, error)`` for bad ones; an empty list once the upload is done.
+    """
+    batch = []
+    for label, raw in records:
+        try:
+            if raw is None:
+                raise ValueError(f"Record is larger than {IMPORT_MAX_RECORD_BYTES} bytes")
+            record = codec.loads(raw)
+            if not isinstance(record, dict):
+                raise ValueError("Record must be a JSON object")
+            map_create = schemas.MindMapCreate.model_validate(record)
+            sanitized_data, node_count = sanitize_mindmap_data(map_create.document)
+            batch.append((label, map_create, sanitized_data, node_count))
+        except ValidationError as e:
+            batch.append((label, "; ".join(error["msg"] for error in e.errors())))
+        except HTTPException as e:
+            batch.append((label, e.detail))
+        except ValueError as e:
+            batch.append((label, str(e)))
+        if len(batch) >= size:
+            break
+    return batch
+
+@router.get("/export")
+async def export_maps(
+    format: Literal["ndjson", "zip"] = Query("ndjson", description="ndjson: one map per line; zip: one JSON file per map"),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    Stream all of the user's maps. Each map is a JSON object with ``title``
+    and ``data`` (as for ``POST /``) plus its revision and timestamps, so an
+    export can be fed back to ``POST /import``.
+    """
+    if format == "zip":
+        # A Content-Encoding makes the compression middleware pass the already deflated archive through
+        return StreamingResponse(
+            _export_zip(current_user.id), media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="mindmaps.zip"', "Content-Encoding": "identity"}
+        )
+    return StreamingResponse(
+        _export_ndjson(current_user.id), media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="mindmaps.ndjson"'}
+    )
+
+@router.post("/import", response_model=schemas.MapImportResult)
+async def import_maps(
+    file: UploadFile = File(..., description="NDJSON (optionally gzipped) or zip, as produced by /export"),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    Create maps from an uploaded export. Records are read and sanitized a
+    batch at a time and each batch is written in one transaction, so memory
+    use does not grow with the size of the upload. Invalid records are
+    skipped and reported; the rest are imported.
+    """
+    storage = get_storage()
+    records = _import_records(file.file)
+    imported, failed, errors = 0, 0, []
+    try:
+        while True:
+            batch = await run_in_threadpool(_prepare_import_batch, records, IMPORT_BATCH_SIZE)
+            if not batch:
+                break
+            new_maps = []
+            for entry in batch:
+                if len(entry) == 2:
+                    failed += 1
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append(schemas.MapImportError(record=entry[0], detail=entry[1]))
+                    continue
+                _, map_create, sanitized_data, node_count = entry
+                new_map = models.MindMap(title=map_create.title, user_id=current_user.id)
+                db.add(new_map)
+                new_maps.append((new_map, map_create.document, sanitized_data, node_count))
+            if not new_maps:
+                continue
+            await db.flush()
+
+            def save(session):
+                for new_map, document, sanitized_data, node_count in new_maps:
+                    storage.save(session, new_map, sanitized_data, node_count, document)
+                    search.index_document(session, new_map, document)
+
+            await db.run_sync(save)
+            await db.commit()
+            imported += len(new_maps)
+            db.expunge_all()
+    except _CORRUPT_UPLOAD_ERRORS as e:
+        logger.warning(f"Corrupt import upload from user {current_user.email} after {imported} maps: {str(e)}")
+        await db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=f"Upload is not a valid zip or gzip file ({imported} imported before the error)"
+        )
+    except Exception as e:
+        logger.error(f"Error importing maps for user {current_user.email} after {imported} maps: {str(e)}")
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error importing mind maps ({imported} imported before the error)")
+
+    logger.info(f"Imported {imported} mind maps for user {current_user.email} ({failed} failed)")
+    return schemas.MapImportResult(imported=imported, failed=failed, errors=errors)
+
 @router.get("/{map_id}", response_model=schemas.MindMapResponse)
-def get_map(map_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def get_map(
+    map_id: int,
+    response: Response,
+    depth: Optional[int] = Query(None, ge=0, description="Only return this many levels below the starting node"),
+    node_id: Optional[str] = Query(None, description="Return the subtree rooted at this node instead of the whole map"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    Fetch a map, optionally as a depth-limited subtree.
+
+    Nodes whose children were cut off by ``depth`` come back with an empty
+    ``children`` list and a ``childCount``; fetch them later with ``node_id``.
+
+    Responses carry an ETag. A request whose ``If-None-Match`` still matches
+    gets a 304 after a query for the revision only, without loading the map.
+    """
+    headers = {"Cache-Control": "private, no-cache"}
     try:
-        map_item = db.query(models.MindMap).filter(
-            models.MindMap.id == map_id,
-            models.MindMap.user_id == current_user.id
-        ).first()
+        pending = write_buffer.get(map_id, current_user.id)
+        if if_none_match:
+            current = pending or (await db.execute(
+                select(models.MindMap.revision, models.MindMap.updated_at).where(
+                    models.MindMap.id == map_id,
+                    models.MindMap.user_id == current_user.id
+                )
+            )).first()
+            if not current:
+                raise HTTPException(status_code=404, detail="Mind Map not found")
+            etag = _map_etag(map_id, current.revision, current.updated_at, depth, node_id)
+            if _etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={**headers, "ETag": etag})
+
+        if pending is not None:
+            # Unsaved changes in the write buffer are the current state of the map
+            document = view_document(pending.document, node_id, depth)
+            if document is None:
+                raise HTTPException(status_code=404, detail="Node not found")
+            response.headers.update({**headers, "ETag": _map_etag(map_id, pending.revision, pending.updated_at, depth, node_id)})
+            return _map_response(pending, codec.dumps(document))
+
+        map_item = await _get_user_map(db, map_id, current_user.id)
         if not map_item:
             raise HTTPException(status_code=404, detail="Mind Map not found")
-        return map_item
+
+        data = await db.run_sync(lambda session: get_storage().dumps(session, map_item, root_id=node_id, depth=depth))
+        if data is None:
+            raise HTTPException(status_code=404, detail="Node not found")
+        response.headers.update({**headers, "ETag": _map_etag(map_id, map_item.revision, map_item.updated_at, depth, node_id)})
+        return _map_response(map_item, data)
     except HTTPException:
         raise
     except Exception as e:
@@ -99,83 +626,165 @@ def get_map(map_id: int, db: Session = Depends(database.get_db), current_user: m
         raise HTTPException(status_code=500, detail="Error fetching mind map")
 
 @router.put("/{map_id}", response_model=schemas.MindMapResponse)
-def update_map(map_id: int, map_update: schemas.MindMapUpdate, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def update_map(
+    map_id: int,
+    map_update: schemas.MindMapUpdate,
+    if_match: Optional[str] = Header(None),
+    x_collab_session: Optional[str] = Header(None),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    Replace a map's title and/or document.
+
+    With ``base_revision`` (or ``If-Match``) the save only applies if the map
+    is still at that revision, otherwise 409. Stale saves are rejected before
+    the document is sanitized. Live editor sessions other than
+    ``X-Collab-Session`` are told to reload the map.
+    """
     try:
-        map_item = db.query(models.MindMap).filter(
-            models.MindMap.id == map_id,
-            models.MindMap.user_id == current_user.id
-        ).first()
-        if not map_item:
-            raise HTTPException(status_code=404, detail="Mind Map not found")
+        expected = map_update.base_revision
+        if expected is None and if_match:
+            expected = _parse_if_match(if_match, map_id)
+
+        # Cheap precheck on the revision alone, before any document work
+        current = await _get_revision(db, map_id, current_user.id)
+        if expected is not None and current != expected:
+            raise HTTPException(status_code=409, detail="Mind Map has changed since base revision")
+
+        storage = get_storage()
 
         # Sanitize data if being updated
+        sanitized_data = None
         if map_update.data is not None:
-            sanitized_data = sanitize_mindmap_data(map_update.data)
-            map_item.data = sanitized_data
+            sanitized_data, node_count = await run_in_threadpool(sanitize_mindmap_data, map_update.document)
 
-        if map_update.title is not None:
-            map_item.title = map_update.title
+        if write_buffer.enabled:
+            try:
+                pending = await write_buffer.save(
+                    db, map_id, current_user.id, expected,
+                    document=map_update.document, title=map_update.title
+                )
+            except LookupError:
+                raise HTTPException(status_code=404, detail="Mind Map not found")
+            except RevisionConflict:
+                raise HTTPException(status_code=409, detail="Mind Map has changed since base revision")
+            await publish_map_event(map_id, {"type": "replace", "revision": pending.revision}, x_collab_session)
+            return _map_response(pending, sanitized_data or codec.dumps(pending.document))
 
-        db.commit()
-        db.refresh(map_item)
+        values = {"title": map_update.title} if map_update.title is not None else {}
+        await _claim_revision(db, map_id, current_user.id, expected, **values)
+
+        map_item = await _get_user_map(db, map_id, current_user.id, load_data=False)
+        if sanitized_data is not None:
+            def save(session):
+                storage.save(session, map_item, sanitized_data, node_count, map_update.document)
+                search.index_document(session, map_item, map_update.document)
+
+            await db.run_sync(save)
+        await db.commit()
+        await db.refresh(map_item, ["title", "revision", "updated_at"])
 
         logger.info(f"Updated mind map {map_id} for user {current_user.email}")
-        return map_item
+        await publish_map_event(map_id, {"type": "replace", "revision": map_item.revision}, x_collab_session)
+        data = sanitized_data or await db.run_sync(lambda session: storage.dumps(session, map_item))
+        return _map_response(map_item, data)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error updating map {map_id}: {str(e)}")
-        db.rollback()
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Error updating mind map")
+
+@router.patch("/{map_id}", response_model=schemas.MindMapPatchResponse)
+async def patch_map(
+    map_id: int,
+    patch: schemas.MindMapPatch,
+    x_collab_session: Optional[str] = Header(None),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: auth.CurrentUser = Depends(auth.get_current_user_async)
+):
+    """
+    Apply node-level operations to a map.
+
+    Only the touched nodes are sanitized, so the cost of a save scales with
+    the size of the edit. Returns 409 if the map has moved past ``base_revision``.
+    The operations are forwarded to live editor sessions other than ``X-Collab-Session``.
+    """
+    try:
+        operations = [op.model_dump(exclude_none=True) for op in patch.ops]
+        result = await apply_map_operations(db, map_id, current_user.id, patch.base_revision, operations)
+
+        logger.info(f"Patched mind map {map_id} ({len(patch.ops)} ops) for user {current_user.email}")
+        await publish_map_event(map_id, {"type": "ops", "revision": result.revision, "ops": operations}, x_collab_session)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error patching map {map_id}: {str(e)}")
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error updating mind map")
 
 @router.delete("/{map_id}")
-def delete_map(map_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def delete_map(map_id: int, db: AsyncSession = Depends(database.get_async_db), current_user: auth.CurrentUser = Depends(auth.get_current_user_async)):
     try:
-        map_item = db.query(models.MindMap).filter(
-            models.MindMap.id == map_id,
-            models.MindMap.user_id == current_user.id
-        ).first()
+        map_item = await _get_user_map(db, map_id, current_user.id)
         if not map_item:
             raise HTTPException(status_code=404, detail="Mind Map not found")
 
-        db.delete(map_item)
-        db.commit()
+        write_buffer.discard(map_id)
+
+        def remove(session):
+            get_storage().delete(session, map_item)
+            search.remove_map(session, map_item)
+
+        await db.run_sync(remove)
+        await db.delete(map_item)
+        await db.commit()
 
         logger.info(f"Deleted mind map {map_id} for user {current_user.email}")
+        await publish_map_event(map_id, {"type": "deleted"})
         return {"message": "Mind Map deleted"}
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error deleting map {map_id}: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error deleting mind map")
 
 @router.post("/{map_id}/copy", response_model=schemas.MindMapResponse)
-def copy_map(map_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def copy_map(map_id: int, db: AsyncSession = Depends(database.get_async_db), current_user: auth.CurrentUser = Depends(auth.get_current_user_async)):
     try:
-        original_map = db.query(models.MindMap).filter(
-            models.MindMap.id == map_id,
-            models.MindMap.user_id == current_user.id
-        ).first()
+        if write_buffer.get(map_id, current_user.id) is not None:
+            # Copy what the user sees, including changes not yet written
+            await write_buffer.flush(map_id)
+
+        original_map = await _get_user_map(db, map_id, current_user.id)
         if not original_map:
             raise HTTPException(status_code=404, detail="Mind Map not found")
 
+        storage = get_storage()
         new_title = f"copy-{original_map.title}"
-        sanitized_data = sanitize_mindmap_data(original_map.data)
         new_map = models.MindMap(
             title=new_title,
-            data=sanitized_data,
             user_id=current_user.id
         )
         db.add(new_map)
-        db.commit()
-        db.refresh(new_map)
+        await db.flush()
+        def copy(session):
+            storage.copy(session, original_map, new_map)
+            search.copy_map(session, original_map, new_map)
+
+        await db.run_sync(copy)
+        await db.commit()
+        await db.refresh(new_map)
 
         logger.info(f"Copied mind map {map_id} to {new_map.id} for user {current_user.email}")
-        return new_map
+        data = await db.run_sync(lambda session: storage.dumps(session, new_map))
+        return _map_response(new_map, data)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error copying map {map_id}: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error copying mind map")
@@ -0,0 +1,136 @@
+"""
+Sanitization of mind map documents.
+
+``sanitize_html`` parses every description with bleach (html5lib), which is by
+far the most expensive part of saving a map. Most descriptions never need it:
+
+  - Text without markup characters is returned unchanged by bleach, so it
+    skips the parse entirely (the fast path).
+  - Descriptions that were parsed before are looked up in a bounded LRU keyed
+    by a hash of the text, so a map that is saved again only parses the
+    descriptions that actually changed.
+
+``prepare_document`` validates, sanitizes and assigns ids to a decoded
+document in a single walk, so a save decodes and serializes the map once.
+"""
+from typing import Optional
+import hashlib
+import re
+
+from .cache import LRUCache
+from .core.config import settings
+from .mindmap_ops import iter_nodes, new_node_id
+from .utils import sanitize_html
+
+# Characters bleach may rewrite: markup and entities, and the control
+# characters html5lib replaces or drops (including CR, which becomes LF).
+# Text without any of them comes back from bleach unchanged.
+_NEEDS_PARSE = re.compile(r"[<>&\x00-\x08\x0b-\x1f]")
+
+# Cache value for descriptions bleach left as they were, so the cache does
+# not hold a second copy of the text
+_UNCHANGED = object()
+
+_clean_cache = LRUCache(maxsize=settings.SANITIZE_CACHE_SIZE)
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def sanitize_description(html_content: Optional[str], max_length: int = 5000) -> str:
+    """
+    Sanitize a node description. Same result as ``sanitize_html``.
+
+    Raises:
+        ValueError: If content exceeds max_length
+    """
+    if not html_content:
+        return ""
+
+    text = html_content.strip()
+    if len(text) > max_length:
+        raise ValueError(f"Description too long. Maximum {max_length} characters allowed.")
+    if not _NEEDS_PARSE.search(text):
+        return text
+
+    key = _digest(text)
+    cached = _clean_cache.get(key)
+    if cached is not None:
+        return text if cached is _UNCHANGED else cached
+
+    cleaned = sanitize_html(text, max_length)
+    _clean_cache.set(key, _UNCHANGED if cleaned == text else cleaned)
+    return cleaned
+
+
+def sanitize_document(root: dict) -> dict:
+    """
+    Sanitize every description in a document in place.
+
+    Walks the tree with an explicit stack, so deeply nested maps cannot hit
+    the recursion limit.
+
+    Raises:
+        ValueError: If a description is too long
+    """
+    for node, _ in iter_nodes(root):
+        if node.get("description"):
+            node["description"] = sanitize_description(node["description"])
+    return root
+
+
+def prepare_document(root: dict, max_length: int = 5000, sanitize: bool = True) -> int:
+    """
+    Make a decoded document safe to store, in place and in one traversal:
+    check its structure and field types and description lengths, sanitize
+    descriptions (unless ``sanitize`` is False, for subtrees that are
+    sanitized when applied), and give every node a unique id.
+
+    Returns:
+        The number of nodes in the document
+
+    Raises:
+        ValueError: If the document is malformed or a description is too long
+    """
+    if not isinstance(root, dict):
+        raise ValueError("Mind map data must be a JSON object")
+
+    seen = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+
+        node_id = node.get("id")
+        if not isinstance(node_id, str) or not node_id or node_id in seen:
+            node_id = node["id"] = new_node_id()
+        seen.add(node_id)
+
+        name = node.get("name")
+        if name is not None and not isinstance(name, str):
+            raise ValueError("Node name must be a string")
+
+        description = node.get("description")
+        if description:
+            if not isinstance(description, str):
+                raise ValueError("Node description must be a string")
+            if len(description) > max_length:
+                raise ValueError(f"Node description exceeds {max_length} characters")
+            if sanitize:
+                node["description"] = sanitize_description(description, max_length)
+
+        children = node.get("children")
+        if children is None:
+            continue
+        if not isinstance(children, list):
+            raise ValueError("Node children must be a list")
+        for child in reversed(children):
+            if not isinstance(child, dict):
+                raise ValueError("Node children must be objects")
+            stack.append(child)
+
+    return len(seen)
+
+
+def clear_cache() -> None:
+    _clean_cache.clear()
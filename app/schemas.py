@@ -1,7 +1,9 @@
-from pydantic import BaseModel, EmailStr, field_validator, Field
-from typing import Optional
+from pydantic import BaseModel, EmailStr, field_validator, model_validator, Field, PrivateAttr
+from typing import List, Literal, Optional
 from datetime import datetime
 from .core.config import settings
+from . import codec
+from .sanitizer import prepare_document
 
 
 class UserCreate(BaseModel):
@@ -60,62 +62,135 @@ class MindMapBase(BaseModel):
     data: str  # JSON string
 
 
+def _decode_document(data: str) -> dict:
+    try:
+        document = codec.loads(data)
+    except ValueError:
+        raise ValueError('Invalid JSON format')
+    if not isinstance(document, dict):
+        raise ValueError('Mind map data must be a JSON object')
+    return document
+
+
 class MindMapCreate(MindMapBase):
-    @field_validator('data')
-    @classmethod
-    def validate_mindmap_data(cls, v: str) -> str:
+    # Decoded once here; node-level checks and sanitizing happen in a single
+    # pass over this tree (see sanitizer.prepare_document)
+    _document: dict = PrivateAttr(default=None)
+
+    @model_validator(mode='after')
+    def decode_mindmap_data(self):
         """Validate mind map data structure."""
-        import json
-        try:
-            data = json.loads(v)
-            # Recursively validate all node descriptions
-            cls._validate_node_descriptions(data)
-            return v
-        except json.JSONDecodeError:
-            raise ValueError('Invalid JSON format')
-        except ValueError as e:
-            raise ValueError(str(e))
-    
-    @staticmethod
-    def _validate_node_descriptions(node: dict, max_length: int = 5000):
-        """Recursively validate node descriptions."""
-        if 'description' in node and node['description']:
-            desc = node['description']
-            if len(desc) > max_length:
-                raise ValueError(f"Node description exceeds {max_length} characters")
-        
-        # Recursively check children
-        if 'children' in node and isinstance(node['children'], list):
-            for child in node['children']:
-                MindMapCreate._validate_node_descriptions(child, max_length)
+        self._document = _decode_document(self.data)
+        return self
+
+    @property
+    def document(self) -> dict:
+        return self._document
 
 
 class MindMapUpdate(BaseModel):
     title: Optional[str] = Field(None, min_length=1, max_length=200)
     data: Optional[str] = None
-    
-    @field_validator('data')
-    @classmethod
-    def validate_mindmap_data(cls, v: Optional[str]) -> Optional[str]:
+    # Revision the client last saw; the save is rejected with 409 if the map moved on.
+    # Can also be sent as an If-Match header.
+    base_revision: Optional[int] = None
+    _document: Optional[dict] = PrivateAttr(default=None)
+
+    @model_validator(mode='after')
+    def decode_mindmap_data(self):
         """Validate mind map data structure."""
-        if v is None:
-            return v
-        
-        import json
-        try:
-            data = json.loads(v)
-            # Recursively validate all node descriptions
-            MindMapCreate._validate_node_descriptions(data)
-            return v
-        except json.JSONDecodeError:
-            raise ValueError('Invalid JSON format')
-        except ValueError as e:
-            raise ValueError(str(e))
+        if self.data is not None:
+            self._document = _decode_document(self.data)
+        return self
+
+    @property
+    def document(self) -> Optional[dict]:
+        return self._document
+
+
+class NodeOperation(BaseModel):
+    """A single node-level edit, addressed by stable node id."""
+    op: Literal["add", "update", "move", "delete"]
+    id: Optional[str] = None
+    parent_id: Optional[str] = None
+    index: Optional[int] = Field(None, ge=0)
+    node: Optional[dict] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    isCollapsed: Optional[bool] = None
+
+    @model_validator(mode='after')
+    def validate_operation(self):
+        """Check that each operation carries the fields it needs."""
+        if self.op in ("update", "move", "delete") and not self.id:
+            raise ValueError(f'"{self.op}" operation requires an id')
+        if self.op in ("add", "move") and not self.parent_id:
+            raise ValueError(f'"{self.op}" operation requires a parent_id')
+        if self.op == "add":
+            if self.node is None:
+                raise ValueError('"add" operation requires a node')
+            # Descriptions are sanitized when the operation is applied
+            prepare_document(self.node, sanitize=False)
+        if self.description and len(self.description) > 5000:
+            raise ValueError("Node description exceeds 5000 characters")
+        return self
+
+
+class MindMapPatch(BaseModel):
+    base_revision: int
+    ops: List[NodeOperation] = Field(..., min_length=1, max_length=1000)
+
+
+class MindMapPatchResponse(BaseModel):
+    id: int
+    revision: int
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+
+class MindMapSummary(BaseModel):
+    """A map without its document, for listings."""
+    id: int
+    title: str
+    revision: int
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    node_count: Optional[int] = None
+    byte_size: Optional[int] = None
+
+
+class MindMapSummaryPage(BaseModel):
+    items: List[MindMapSummary]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= to fetch the next page
+
+
+class SearchResult(BaseModel):
+    """A node matching a search, with the titles of its ancestors from the root."""
+    map_id: int
+    map_title: str
+    node_id: str
+    title: str
+    path: List[str]
+    snippet: str
+
+
+class MapImportError(BaseModel):
+    record: str  # Line number, or file name within a zip
+    detail: str
+
+
+class MapImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[MapImportError]  # The first few failures
 
 
 class MindMapResponse(MindMapBase):
     id: int
     user_id: int
+    revision: int
     created_at: Optional[datetime]
     updated_at: Optional[datetime]
 
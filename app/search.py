@@ -0,0 +1,337 @@
+"""
+Full-text search over node titles and descriptions.
+
+Every node has a ``SearchEntry`` row holding the plain text of its title and
+description. The rows are written in the same transaction as the map:
+
+- a full save diffs the new document against the existing rows and only
+  writes the ones that changed;
+- node operations touch only the rows of the nodes they change;
+- copies and deletes are single statements.
+
+On SQLite the rows feed an external-content FTS5 table (``search_fts``)
+through triggers; on PostgreSQL a generated ``tsvector`` column with a GIN
+index. Both match every word of the query as a prefix and rank title matches
+above description matches. If SQLite was built without FTS5, searches fall
+back to ``LIKE``.
+
+Maps held in the write buffer are indexed when they are flushed. Maps saved
+before search existed are indexed in batches by a background task at
+startup (``index_missing_maps``).
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, delete, exists, insert, literal, or_, select, text, tuple_, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from . import codec, models
+from .mindmap_ops import ensure_node_ids
+from .utils import extract_plain_text
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+Entry = models.SearchEntry
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+_IN_CHUNK_SIZE = 500
+
+# Longest query we look at; more words only make the match stricter
+MAX_QUERY_WORDS = 8
+
+_WORD = re.compile(r"\w+")
+
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, content='search_entries', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS search_entries_ai AFTER INSERT ON search_entries BEGIN "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_entries_ad AFTER DELETE ON search_entries BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_entries_au AFTER UPDATE OF title, body ON search_entries BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+)
+
+_POSTGRES_DDL = (
+    "ALTER TABLE search_entries ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_search_entries_vector ON search_entries USING GIN (search_vector)",
+)
+
+
+def _chunks(items: list):
+    for start in range(0, len(items), _IN_CHUNK_SIZE):
+        yield items[start:start + _IN_CHUNK_SIZE]
+
+
+def create_index(engine) -> None:
+    """Create the full-text index on top of the ``search_entries`` table."""
+    if engine.dialect.name == "postgresql":
+        statements = _POSTGRES_DDL
+    elif engine.dialect.name == "sqlite":
+        statements = _SQLITE_DDL
+    else:
+        return
+    try:
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+    except OperationalError as e:
+        # SQLite without FTS5; search() falls back to LIKE
+        logger.warning(f"Full-text index unavailable, search will be slower: {str(e)}")
+
+
+def _entries(root: dict, map_id: int, user_id: int, parent_id: Optional[str] = None) -> List[dict]:
+    """Index rows for a node and its descendants."""
+    rows = []
+    stack = [(root, parent_id)]
+    while stack:
+        node, parent = stack.pop()
+        node_id = node.get("id")
+        if not node_id:
+            continue
+        rows.append({
+            "map_id": map_id,
+            "node_id": node_id,
+            "user_id": user_id,
+            "parent_id": parent,
+            "title": node.get("name") or "",
+            "body": extract_plain_text(node.get("description") or ""),
+        })
+        for child in node.get("children") or []:
+            if isinstance(child, dict):
+                stack.append((child, node_id))
+    return rows
+
+
+def index_document(db: Session, map_item: models.MindMap, document: dict) -> None:
+    """Bring the index rows of a map in line with ``document``, writing only what changed."""
+    existing = {
+        row.node_id: row for row in db.execute(
+            select(Entry.id, Entry.node_id, Entry.parent_id, Entry.title, Entry.body)
+            .where(Entry.map_id == map_item.id)
+        )
+    }
+    inserts = []
+    for row in _entries(document, map_item.id, map_item.user_id):
+        current = existing.pop(row["node_id"], None)
+        if current is None:
+            inserts.append(row)
+        elif (current.parent_id, current.title, current.body) != (row["parent_id"], row["title"], row["body"]):
+            values = {key: row[key] for key in ("parent_id", "title", "body") if getattr(current, key) != row[key]}
+            db.execute(update(Entry).where(Entry.id == current.id).values(**values))
+    for chunk in _chunks([row.id for row in existing.values()]):
+        db.execute(delete(Entry).where(Entry.id.in_(chunk)))
+    if inserts:
+        db.execute(insert(Entry), inserts)
+
+
+def _subtree_ids(db: Session, map_id: int, node_id: str) -> List[str]:
+    ids = [node_id]
+    level = [node_id]
+    while level:
+        next_level = []
+        for chunk in _chunks(level):
+            next_level.extend(db.execute(
+                select(Entry.node_id).where(Entry.map_id == map_id, Entry.parent_id.in_(chunk))
+            ).scalars())
+        ids.extend(next_level)
+        level = next_level
+    return ids
+
+
+def apply_operations(db: Session, map_item: models.MindMap, operations: Iterable[dict]) -> None:
+    """
+    Update the index rows of a map for node operations that were just applied
+    to it (so they are valid and every added node has an id).
+    """
+    map_id = map_item.id
+    for operation in operations:
+        op = operation.get("op")
+        if op == "add":
+            rows = _entries(operation["node"], map_id, map_item.user_id, operation.get("parent_id"))
+            if rows:
+                db.execute(insert(Entry), rows)
+        elif op == "update":
+            values = {}
+            if "name" in operation:
+                values["title"] = operation["name"] or ""
+            if "description" in operation:
+                values["body"] = extract_plain_text(operation["description"] or "")
+            if values:
+                db.execute(update(Entry).where(Entry.map_id == map_id, Entry.node_id == operation["id"]).values(**values))
+        elif op == "move":
+            db.execute(
+                update(Entry)
+                .where(Entry.map_id == map_id, Entry.node_id == operation["id"])
+                .values(parent_id=operation["parent_id"])
+            )
+        elif op == "delete":
+            for chunk in _chunks(_subtree_ids(db, map_id, operation["id"])):
+                db.execute(delete(Entry).where(Entry.map_id == map_id, Entry.node_id.in_(chunk)))
+
+
+def copy_map(db: Session, source: models.MindMap, target: models.MindMap) -> None:
+    db.execute(
+        insert(Entry).from_select(
+            ["map_id", "node_id", "user_id", "parent_id", "title", "body"],
+            select(literal(target.id), Entry.node_id, literal(target.user_id), Entry.parent_id, Entry.title, Entry.body)
+            .where(Entry.map_id == source.id),
+        )
+    )
+
+
+def remove_map(db: Session, map_item: models.MindMap) -> None:
+    db.execute(delete(Entry).where(Entry.map_id == map_item.id))
+
+
+def index_missing_maps(db: Session, load, after_id: int = 0, limit: int = 100,
+                       skip: Optional[Callable[[int], bool]] = None) -> Tuple[Optional[int], int]:
+    """
+    Index up to ``limit`` maps with ids above ``after_id`` that have no index
+    rows yet (maps created before search existed). Maps saved before nodes
+    had ids get ids first, written back so the index rows match the stored
+    document. Maps whose document cannot be read, maps for which ``skip``
+    returns True (e.g. held in the write buffer) and maps saved while they
+    were being indexed are left for later.
+
+    Returns the last map id looked at, to pass as ``after_id`` for the next
+    batch (None when there are no more), and how many maps were indexed. The
+    caller commits each batch.
+    """
+    maps = db.execute(
+        select(models.MindMap)
+        .where(models.MindMap.id > after_id, ~exists().where(Entry.map_id == models.MindMap.id))
+        .order_by(models.MindMap.id)
+        .limit(limit)
+    ).scalars().all()
+    indexed = 0
+    for map_item in maps:
+        if skip is not None and skip(map_item.id):
+            continue
+        try:
+            document = load(db, map_item)
+        except ValueError as e:
+            logger.warning(f"Skipping search indexing of map {map_item.id}: {str(e)}")
+            continue
+        if document is None:
+            continue
+        if ensure_node_ids(document) and map_item.data is not None:
+            # Only blob documents predate node ids. Write them only if the map wasn't
+            # saved since it was loaded, and leave revision and updated_at alone so
+            # open editors and the write buffer don't see a conflicting save.
+            result = db.execute(
+                update(models.MindMap)
+                .where(models.MindMap.id == map_item.id, models.MindMap.revision == map_item.revision)
+                .values(data=codec.dumps(document), updated_at=models.MindMap.updated_at)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                continue
+        index_document(db, map_item, document)
+        indexed += 1
+    return (maps[-1].id if maps else None), indexed
+
+
+def _words(query: str) -> List[str]:
+    return _WORD.findall(query.lower())[:MAX_QUERY_WORDS]
+
+
+def _has_fts5(db: Session) -> bool:
+    return db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_fts'")
+    ).first() is not None
+
+
+def _find(db: Session, user_id: int, words: List[str], limit: int) -> list:
+    """Return ``(map_id, node_id, parent_id, title, snippet)`` rows, best match first."""
+    dialect = db.get_bind().dialect.name
+    params = {"user_id": user_id, "limit": limit}
+    if dialect == "postgresql":
+        params["query"] = " & ".join(f"{word}:*" for word in words)
+        return db.execute(text(
+            "SELECT e.map_id, e.node_id, e.parent_id, e.title, left(e.body, 160) AS snippet "
+            "FROM search_entries e, to_tsquery('simple', :query) q "
+            "WHERE e.user_id = :user_id AND e.search_vector @@ q "
+            "ORDER BY ts_rank(e.search_vector, q) DESC, e.id LIMIT :limit"
+        ), params).all()
+    if dialect == "sqlite" and _has_fts5(db):
+        # Quoted so words are never read as FTS5 operators; * makes each a prefix
+        params["query"] = " ".join(f'"{word}"*' for word in words)
+        return db.execute(text(
+            "SELECT e.map_id, e.node_id, e.parent_id, e.title, "
+            "snippet(search_fts, 1, '', '', '…', 16) AS snippet "
+            "FROM search_fts JOIN search_entries e ON e.id = search_fts.rowid "
+            "WHERE search_fts MATCH :query AND e.user_id = :user_id "
+            "ORDER BY bm25(search_fts, 10.0, 1.0) LIMIT :limit"
+        ), params).all()
+    conditions = [
+        or_(Entry.title.contains(word, autoescape=True), Entry.body.contains(word, autoescape=True))
+        for word in words
+    ]
+    rows = db.execute(
+        select(Entry.map_id, Entry.node_id, Entry.parent_id, Entry.title, Entry.body)
+        .where(Entry.user_id == user_id, and_(*conditions))
+        .order_by(Entry.map_id, Entry.id)
+        .limit(limit)
+    ).all()
+    return [(map_id, node_id, parent_id, title, body[:160]) for map_id, node_id, parent_id, title, body in rows]
+
+
+def _ancestors(db: Session, hits: list) -> Dict[Tuple[int, str], Tuple[Optional[str], str]]:
+    """``(map_id, node_id) -> (parent_id, title)`` for the hits and all their ancestors, one query per level."""
+    known = {(map_id, node_id): (parent_id, title) for map_id, node_id, parent_id, title, _ in hits}
+    wanted = {(map_id, parent_id) for map_id, _, parent_id, _, _ in hits if parent_id}
+    while wanted:
+        wanted -= known.keys()
+        found = []
+        for chunk in _chunks(list(wanted)):
+            found.extend(db.execute(
+                select(Entry.map_id, Entry.node_id, Entry.parent_id, Entry.title)
+                .where(tuple_(Entry.map_id, Entry.node_id).in_(chunk))
+            ))
+        for map_id, node_id, parent_id, title in found:
+            known[(map_id, node_id)] = (parent_id, title)
+        wanted = {(map_id, parent_id) for map_id, _, parent_id, _ in found if parent_id}
+    return known
+
+
+def search(db: Session, user_id: int, query: str, limit: int = 20) -> List[dict]:
+    """
+    Find a user's nodes whose title or description contain every word of
+    ``query`` (as prefixes). Each result has the map, the node, its path of
+    ancestor titles from the root, and a snippet of the description.
+    """
+    words = _words(query)
+    if not words:
+        return []
+    hits = _find(db, user_id, words, limit)
+    if not hits:
+        return []
+
+    map_ids = sorted({hit[0] for hit in hits})
+    map_titles = dict(db.execute(
+        select(models.MindMap.id, models.MindMap.title).where(models.MindMap.id.in_(map_ids))
+    ).all())
+    known = _ancestors(db, hits)
+
+    results = []
+    for map_id, node_id, parent_id, title, snippet in hits:
+        path = []
+        seen = {node_id}
+        while parent_id and parent_id not in seen and (map_id, parent_id) in known:
+            seen.add(parent_id)
+            parent_id, parent_title = known[(map_id, parent_id)]
+            path.append(parent_title)
+        path.reverse()
+        results.append({
+            "map_id": map_id,
+            "map_title": map_titles.get(map_id, ""),
+            "node_id": node_id,
+            "title": title,
+            "path": path,
+            "snippet": snippet or "",
+        })
+    return results
@@ -0,0 +1,145 @@
+"""
+Production server, started with ``python -m app``.
+
+Runs uvicorn with one worker process per available CPU core (or
+``WEB_CONCURRENCY``), uvloop and httptools when they are installed, and
+keep-alive, backlog and shutdown timeouts from the settings.
+
+Database connections are budgeted across workers: with
+``DB_MAX_CONNECTIONS`` set, each worker's pool is shrunk so that all of
+them together stay below it, and the worker count is reduced if even one
+connection each would not fit. Behind PgBouncer (``DB_PGBOUNCER``) workers
+keep no pool, so there is nothing to budget.
+
+Settings that keep state per process force a single worker: the write
+buffer, in-memory pub/sub (live edits would only reach sessions on the same
+worker) and in-memory rate limits (each worker would count separately).
+Several workers need ``PUBSUB_BACKEND=redis`` and a shared
+``RATE_LIMIT_BACKEND``.
+
+On SIGTERM uvicorn stops accepting connections, lets running requests
+finish for up to ``GRACEFUL_TIMEOUT`` seconds, then runs the app's
+shutdown (which flushes the write buffer) in every worker.
+"""
+from importlib.util import find_spec
+from typing import Optional, Tuple
+import argparse
+import logging
+import math
+import os
+import subprocess
+import sys
+
+import uvicorn
+
+from .core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Connections a worker may open besides its async pool (the sync engine used at startup)
+SYNC_CONNECTIONS_PER_WORKER = 1
+
+
+def available_cpus() -> int:
+    """CPU cores this process may use, honouring affinity and a cgroup v2 CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+def plan_workers(requested: int, cpus: int) -> int:
+    """Worker count: ``requested`` if set, else one per core, and 1 when state is per process."""
+    workers = requested if requested > 0 else cpus
+    if workers <= 1:
+        return workers
+    per_process = [
+        reason for enabled, reason in (
+            (settings.WRITE_BUFFER_ENABLED, "WRITE_BUFFER_ENABLED keeps unsaved maps per process"),
+            (settings.PUBSUB_BACKEND == "memory", "PUBSUB_BACKEND=memory only reaches editors on the same worker"),
+            (settings.RATE_LIMIT_BACKEND == "memory", "RATE_LIMIT_BACKEND=memory counts requests per worker"),
+        ) if enabled
+    ]
+    if per_process:
+        logger.warning(f"{'; '.join(per_process)}: running a single worker")
+        return 1
+    return workers
+
+
+def plan_pool(workers: int, max_connections: int, pool_size: int, max_overflow: int) -> Tuple[int, int, int]:
+    """
+    Fit ``workers`` pools of ``pool_size + max_overflow`` connections (plus
+    the startup connection) into ``max_connections`` (0 for no limit).
+    Returns ``(workers, pool_size, max_overflow)``.
+    """
+    if max_connections <= 0:
+        return workers, pool_size, max_overflow
+    per_connection = 1 + SYNC_CONNECTIONS_PER_WORKER
+    if workers * per_connection > max_connections:
+        workers = max(max_connections // per_connection, 1)
+        logger.warning(f"DB_MAX_CONNECTIONS={max_connections} only fits {workers} workers")
+    budget = max(max_connections // workers - SYNC_CONNECTIONS_PER_WORKER, 1)
+    pool_size = min(pool_size, budget)
+    max_overflow = min(max_overflow, budget - pool_size)
+    return workers, pool_size, max_overflow
+
+
+def _backlog(requested: int) -> int:
+    # The kernel silently caps the listen queue at somaxconn
+    try:
+        with open("/proc/sys/net/core/somaxconn") as f:
+            somaxconn = int(f.read())
+    except (OSError, ValueError):
+        return requested
+    if requested > somaxconn:
+        logger.warning(f"BACKLOG={requested} is above net.core.somaxconn={somaxconn}, the kernel uses {somaxconn}")
+    return requested
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app", description="Run the Mind Map server")
+    parser.add_argument("--host", default=settings.HOST, help=f"Bind address (default: {settings.HOST})")
+    parser.add_argument("--port", type=int, default=settings.PORT, help=f"Port (default: {settings.PORT})")
+    parser.add_argument("--workers", type=int, default=settings.WEB_CONCURRENCY,
+                        help="Worker processes, 0 for one per CPU core (default: WEB_CONCURRENCY)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    workers = plan_workers(args.workers, available_cpus())
+    if settings.database_is_postgres and not settings.DB_PGBOUNCER:
+        workers, pool_size, max_overflow = plan_pool(
+            workers, settings.DB_MAX_CONNECTIONS, settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW
+        )
+        # Workers read their pool size from the environment when they import the app
+        os.environ["DB_POOL_SIZE"] = str(pool_size)
+        os.environ["DB_MAX_OVERFLOW"] = str(max_overflow)
+        logger.info(f"Database pool per worker: {pool_size} + {max_overflow} overflow")
+
+    if workers > 1:
+        # Create and migrate the schema once, so workers don't race on DDL
+        subprocess.run([sys.executable, "-c", "import app.main"], check=True)
+
+    loop = "uvloop" if find_spec("uvloop") else "asyncio"
+    http = "httptools" if find_spec("httptools") else "h11"
+    logger.info(f"Starting {workers} worker(s) on {args.host}:{args.port} ({loop}, {http})")
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=_backlog(settings.BACKLOG),
+        timeout_keep_alive=settings.KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.FORWARDED_ALLOW_IPS,
+    )
@@ -9,6 +9,10 @@ const API = {
         if (token) {
             headers['Authorization'] = `Bearer ${token}`;
         }
+        // Live editor sessions skip events about their own saves
+        if (typeof Collab !== 'undefined' && Collab.session) {
+            headers['X-Collab-Session'] = Collab.session;
+        }
         
         const response = await fetch(url, {
             ...options,
@@ -32,11 +36,36 @@ const API = {
         return null;
     },
     
-    async updateMap(id, data) {
+    // Replace the whole map. With a baseRevision the server rejects the save
+    // (409) if the map changed since. Resolves to { ok, status, map }.
+    async updateMap(id, data, baseRevision = null) {
+        const headers = {};
+        if (baseRevision !== null) {
+            headers['If-Match'] = `"${baseRevision}"`;
+        }
         const response = await this.request(`/api/maps/${id}`, {
             method: 'PUT',
+            headers,
             body: JSON.stringify(data)
         });
-        return response && response.ok;
+        if (!response) {
+            return { ok: false, status: 0, map: null };
+        }
+        const map = response.ok ? await response.json() : null;
+        return { ok: response.ok, status: response.status, map };
+    },
+
+    // Send node-level operations instead of the whole document.
+    // Resolves to { ok, status, revision }.
+    async patchMap(id, baseRevision, ops) {
+        const response = await this.request(`/api/maps/${id}`, {
+            method: 'PATCH',
+            body: JSON.stringify({ base_revision: baseRevision, ops })
+        });
+        if (!response) {
+            return { ok: false, status: 0, revision: null };
+        }
+        const body = response.ok ? await response.json() : null;
+        return { ok: response.ok, status: response.status, revision: body ? body.revision : null };
     }
 };
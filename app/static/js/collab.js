@@ -0,0 +1,152 @@
+// Live connection to the other editor sessions of a map. Local edits are
+// sent over the socket as node operations; edits made elsewhere arrive as
+// operations and are applied to the local document.
+const Collab = {
+    PING_MS: 30000,
+    session: null, // Set once connected; sent with REST saves so they are not echoed back
+    socket: null,
+    _mapId: null,
+    _handlers: {},
+    _nextId: 1,
+    _waiting: new Map(), // request id -> resolve
+    _retryDelay: 1000,
+    _ping: null,
+
+    // handlers: onConnect(revision), onOps(ops, revision), onReplace(), onDeleted()
+    connect(mapId, handlers) {
+        this._mapId = mapId;
+        this._handlers = handlers;
+        this._open();
+    },
+
+    isOpen() {
+        return this.session !== null && this.socket !== null && this.socket.readyState === WebSocket.OPEN;
+    },
+
+    // Send operations; resolves to { ok, status, revision, detail }.
+    // status 0 means the connection dropped and the outcome is unknown.
+    sendOps(ops) {
+        return new Promise((resolve) => {
+            const id = this._nextId++;
+            this._waiting.set(id, resolve);
+            this.socket.send(JSON.stringify({ type: 'ops', id, ops }));
+        });
+    },
+
+    _open() {
+        const token = localStorage.getItem('token');
+        if (!token || !window.WebSocket) {
+            return;
+        }
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const socket = new WebSocket(`${scheme}://${window.location.host}/ws/maps/${this._mapId}`);
+        this.socket = socket;
+
+        // The token goes in the first message rather than the URL, which ends up in server logs
+        socket.onopen = () => socket.send(JSON.stringify({ type: 'auth', token }));
+        socket.onmessage = (event) => this._receive(JSON.parse(event.data));
+        socket.onclose = (event) => {
+            this.session = null;
+            this.socket = null;
+            clearInterval(this._ping);
+            for (const resolve of this._waiting.values()) {
+                resolve({ ok: false, status: 0 });
+            }
+            this._waiting.clear();
+            // 1008: invalid, expired or revoked token, 4404: map not found - retrying won't help
+            if (event.code === 1008 || event.code === 4404) {
+                return;
+            }
+            setTimeout(() => this._open(), this._retryDelay);
+            this._retryDelay = Math.min(30000, this._retryDelay * 2);
+        };
+    },
+
+    _receive(message) {
+        switch (message.type) {
+            case 'hello':
+                this.session = message.session;
+                this._retryDelay = 1000;
+                this._ping = setInterval(() => {
+                    if (this.isOpen()) this.socket.send(JSON.stringify({ type: 'ping' }));
+                }, this.PING_MS);
+                this._handlers.onConnect(message.revision);
+                break;
+            case 'ack':
+            case 'error': {
+                const resolve = this._waiting.get(message.id);
+                if (!resolve) {
+                    console.warn('Live session:', message.detail || message.type);
+                    break;
+                }
+                this._waiting.delete(message.id);
+                resolve(message.type === 'ack'
+                    ? { ok: true, status: 200, revision: message.revision }
+                    : { ok: false, status: message.status || 400, detail: message.detail });
+                break;
+            }
+            case 'ops':
+                this._handlers.onOps(message.ops, message.revision);
+                break;
+            case 'replace':
+                this._handlers.onReplace();
+                break;
+            case 'deleted':
+                this._handlers.onDeleted();
+                break;
+        }
+    }
+};
+
+// Apply operations made elsewhere to the local document, as the server did.
+// Returns false if one refers to a node we don't have (the caller should reload).
+function applyRemoteOperations(root, ops) {
+    const index = new Map(); // id -> { node, parent }
+    const addToIndex = (node, parent) => {
+        const stack = [[node, parent]];
+        while (stack.length) {
+            const [current, currentParent] = stack.pop();
+            index.set(current.id, { node: current, parent: currentParent });
+            (current.children || []).forEach(child => stack.push([child, current]));
+        }
+    };
+    const detach = (entry) => {
+        const siblings = entry.parent.children;
+        siblings.splice(siblings.indexOf(entry.node), 1);
+    };
+    const insert = (parent, node, position) => {
+        if (!parent.children) parent.children = [];
+        const at = (position === undefined || position === null) ? parent.children.length : Math.min(position, parent.children.length);
+        parent.children.splice(at, 0, node);
+    };
+    addToIndex(root, null);
+
+    for (const op of ops) {
+        if (op.op === 'add') {
+            const parent = index.get(op.parent_id);
+            if (!parent) return false;
+            ensureDescriptionField(op.node);
+            insert(parent.node, op.node, op.index);
+            addToIndex(op.node, parent.node);
+        } else {
+            const entry = index.get(op.id);
+            if (!entry) return false;
+            if (op.op === 'update') {
+                ['name', 'description', 'isCollapsed'].forEach(field => {
+                    if (field in op) entry.node[field] = op[field];
+                });
+            } else if (op.op === 'move') {
+                const parent = index.get(op.parent_id);
+                if (!parent || !entry.parent) return false;
+                detach(entry);
+                insert(parent.node, entry.node, op.index);
+                entry.parent = parent.node;
+            } else if (op.op === 'delete') {
+                if (!entry.parent) return false;
+                detach(entry);
+                index.delete(op.id);
+            }
+        }
+    }
+    return true;
+}
@@ -0,0 +1,82 @@
+// Undo/redo history kept as a log of changes rather than copies of the map.
+// A change references the node objects it touched, so undoing or redoing it
+// costs as much as the edit itself, whatever the size of the map:
+//   { type: 'insert', parent, node, index }  - node was added under parent
+//   { type: 'remove', parent, node, index }  - node was removed from parent
+//   { type: 'set', node, before, after }     - node fields were changed
+// Applying or reverting changes returns the matching PATCH operations.
+const EditHistory = {
+    limit: 100, // Number of edits that can be undone
+    _undo: [],
+    _redo: [],
+
+    // Record an edit that has already been applied to the map
+    record(changes) {
+        this._undo.push(changes);
+        if (this._undo.length > this.limit) {
+            this._undo.shift();
+        }
+        this._redo = [];
+    },
+
+    canUndo() {
+        return this._undo.length > 0;
+    },
+
+    canRedo() {
+        return this._redo.length > 0;
+    },
+
+    // Revert the last edit; returns the operations to save, or null
+    undo() {
+        const changes = this._undo.pop();
+        if (!changes) {
+            return null;
+        }
+        this._redo.push(changes);
+        return changes.slice().reverse().map(change => applyHistoryChange(change, false));
+    },
+
+    // Apply the last undone edit again; returns the operations to save, or null
+    redo() {
+        const changes = this._redo.pop();
+        if (!changes) {
+            return null;
+        }
+        this._undo.push(changes);
+        return changes.map(change => applyHistoryChange(change, true));
+    },
+
+    clear() {
+        this._undo = [];
+        this._redo = [];
+    }
+};
+
+function applyHistoryChange(change, forward) {
+    if (change.type === 'set') {
+        const values = forward ? change.after : change.before;
+        Object.assign(change.node, values);
+        return { op: 'update', id: change.node.id, ...values };
+    }
+
+    const insert = (change.type === 'insert') === forward;
+    const parent = change.parent;
+    if (insert) {
+        if (!parent.children) parent.children = [];
+        parent.children.splice(change.index, 0, change.node);
+        // Copy the subtree: it may change again before the save is sent
+        return {
+            op: 'add',
+            parent_id: parent.id,
+            index: change.index,
+            node: JSON.parse(JSON.stringify(change.node))
+        };
+    }
+
+    const index = parent.children.indexOf(change.node);
+    if (index > -1) {
+        parent.children.splice(index, 1);
+    }
+    return { op: 'delete', id: change.node.id };
+}
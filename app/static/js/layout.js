@@ -0,0 +1,229 @@
+// Incremental tree layout for the editor.
+//
+// Node sizes are measured once per title/description and cached by data
+// object. Each subtree caches its vertical extent and the offsets of its
+// children, and stays valid until something inside it changes: a new title
+// or description, or a different list of visible children (add, delete,
+// collapse, undo). Only the changed nodes and their ancestors are laid out
+// again; the rest of the map is placed from the cache.
+//
+// Coordinates follow the editor: x is vertical, y is horizontal (depth).
+const Layout = {
+    MIN_WIDTH: 140,
+    MAX_WIDTH: 240,
+    BASE_HEIGHT: 50,
+    PADDING: 30,
+    CHAR_WIDTH: 6, // Approx for 14px font
+    LINE_HEIGHT: 20,
+    DEPTH_SPACING: 130, // Gap between columns
+    NODE_GAP: 40, // Vertical gap between neighbouring subtrees
+
+    _measures: new WeakMap(), // data -> { name, description, naturalWidth, hasDescription, wrapWidth, titleLines, height }
+    _extents: new WeakMap(), // data -> { children, top, bottom, offsets }
+    _columns: [],
+
+    // Lay out a d3 hierarchy whose visible children are in `children`
+    run(root) {
+        const columns = this._checkTree(root);
+        if (!sameItems(columns, this._columns)) {
+            // Wider or narrower columns re-wrap titles, so every height may change
+            this._columns = columns;
+            this._extents = new WeakMap();
+        }
+        this._computeExtents(root);
+        this._place(root);
+    },
+
+    // Forget all cached layout (e.g. after the map was replaced)
+    reset() {
+        this._measures = new WeakMap();
+        this._extents = new WeakMap();
+        this._columns = [];
+    },
+
+    // Pre-order pass: measure changed nodes, drop the cached layout of
+    // changed subtrees, and collect the width of every column
+    _checkTree(root) {
+        const columns = [];
+        const stack = [root];
+        while (stack.length) {
+            const d = stack.pop();
+            const data = d.data;
+
+            let measure = this._measures.get(data);
+            const changed = !measure || measure.name !== data.name || measure.description !== data.description;
+            if (changed) {
+                measure = this._measure(data);
+                this._measures.set(data, measure);
+            }
+            if (changed || !this._sameChildren(d)) {
+                this._invalidate(d);
+            }
+
+            if (!(columns[d.depth] >= measure.naturalWidth)) {
+                columns[d.depth] = measure.naturalWidth;
+            }
+            if (d.children) {
+                for (let i = d.children.length - 1; i >= 0; i--) {
+                    stack.push(d.children[i]);
+                }
+            }
+        }
+        return columns;
+    },
+
+    _sameChildren(d) {
+        const extent = this._extents.get(d.data);
+        if (!extent) {
+            return false;
+        }
+        const children = d.children || [];
+        if (extent.children.length !== children.length) {
+            return false;
+        }
+        return children.every((child, index) => extent.children[index] === child.data);
+    },
+
+    // Drop the cached layout of a node and its ancestors. An ancestor without
+    // a cached layout has already been invalidated along with its own ancestors.
+    _invalidate(d) {
+        for (let node = d; node && this._extents.delete(node.data); node = node.parent);
+    },
+
+    _measure(data) {
+        const title = data.name || "Untitled";
+        const titleWidth = title.length * this.CHAR_WIDTH + this.PADDING * 2;
+        // Check description (strip HTML first)
+        const plainDesc = (data.description || "").replace(/<[^>]*>/g, '').trim();
+        return {
+            name: data.name,
+            description: data.description,
+            naturalWidth: Math.max(this.MIN_WIDTH, Math.min(titleWidth, this.MAX_WIDTH)),
+            hasDescription: plainDesc.length > 0,
+            wrapWidth: null,
+            titleLines: null,
+            height: 0
+        };
+    },
+
+    // Wrap the title to the column width and size the node
+    _fit(measure, data, width) {
+        if (measure.wrapWidth === width) {
+            return measure;
+        }
+        const approxCharsPerLine = Math.floor((width - this.PADDING * 2) / this.CHAR_WIDTH);
+        measure.titleLines = wrapText(data.name || "Untitled", approxCharsPerLine);
+        let contentHeight = measure.titleLines.length * this.LINE_HEIGHT;
+        if (measure.hasDescription) {
+            contentHeight += this.LINE_HEIGHT + 1; // Add space for description + gap
+        }
+        measure.height = Math.max(this.BASE_HEIGHT, contentHeight + 12);
+        measure.wrapWidth = width;
+        return measure;
+    },
+
+    // Post-order pass over subtrees without a cached layout: stack the child
+    // subtrees top to bottom and center the parent on its first and last child
+    _computeExtents(root) {
+        const stack = [[root, false]];
+        while (stack.length) {
+            const [d, childrenDone] = stack.pop();
+            if (this._extents.has(d.data)) {
+                continue;
+            }
+            const children = d.children || [];
+            if (!childrenDone) {
+                stack.push([d, true]);
+                for (const child of children) {
+                    stack.push([child, false]);
+                }
+                continue;
+            }
+
+            const measure = this._fit(this._measures.get(d.data), d.data, this._columns[d.depth]);
+            const half = measure.height / 2;
+            const offsets = [];
+            let top = -half;
+            let bottom = half;
+
+            if (children.length > 0) {
+                let offset = 0;
+                let previous = null;
+                for (const child of children) {
+                    const extent = this._extents.get(child.data);
+                    if (previous) {
+                        offset += previous.bottom + this.NODE_GAP - extent.top;
+                    }
+                    offsets.push(offset);
+                    previous = extent;
+                }
+                const center = (offsets[0] + offsets[offsets.length - 1]) / 2;
+                for (let index = 0; index < offsets.length; index++) {
+                    offsets[index] -= center;
+                }
+                const first = this._extents.get(children[0].data);
+                top = Math.min(top, offsets[0] + first.top);
+                bottom = Math.max(bottom, offsets[offsets.length - 1] + previous.bottom);
+            }
+
+            this._extents.set(d.data, {
+                children: children.map(child => child.data),
+                top,
+                bottom,
+                offsets
+            });
+        }
+    },
+
+    // Pre-order pass: assign positions and sizes from the cached layout
+    _place(root) {
+        const columnY = [0];
+        for (let depth = 1; depth < this._columns.length; depth++) {
+            columnY[depth] = columnY[depth - 1] + this._columns[depth - 1] + this.DEPTH_SPACING;
+        }
+
+        root.x = 0;
+        const stack = [root];
+        while (stack.length) {
+            const d = stack.pop();
+            const measure = this._measures.get(d.data);
+            d.y = columnY[d.depth];
+            d.width = this._columns[d.depth];
+            d.height = measure.height;
+            d.titleLines = measure.titleLines;
+            d.hasDescription = measure.hasDescription;
+
+            if (d.children) {
+                const offsets = this._extents.get(d.data).offsets;
+                for (let index = 0; index < d.children.length; index++) {
+                    d.children[index].x = d.x + offsets[index];
+                    stack.push(d.children[index]);
+                }
+            }
+        }
+    }
+};
+
+function sameItems(a, b) {
+    return a.length === b.length && a.every((item, index) => item === b[index]);
+}
+
+function wrapText(text, maxChars) {
+    if (text === null || typeof text === 'undefined') return [""];
+    if (!text) return [""];
+    const words = text.split(/\s+/);
+    let lines = [];
+    let currentLine = words[0];
+
+    for (let i = 1; i < words.length; i++) {
+        const word = words[i];
+        if (currentLine.length + 1 + word.length <= maxChars) {
+            currentLine += " " + word;
+        } else {
+            lines.push(currentLine);
+            currentLine = word;
+        }
+    }
+    lines.push(currentLine);
+    return lines;
+}
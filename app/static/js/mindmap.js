@@ -1,11 +1,12 @@
 let rootData = null;
-let svg, g, tree, zoom;
+let svg, g, zoom;
 let i = 0;
 let duration = 500;
 let root;
-let undoStack = [];
-let redoStack = [];
 let currentNode = null; // For editing
+let mapRevision = null; // Server revision the next patch is based on
+let loadedRevision = null; // Revision of the document last fetched; live edits up to it are already in it
+let needsFullSave = false; // Set when node ids were assigned locally
 
 
 // Initialize D3
@@ -19,17 +20,71 @@ document.addEventListener('DOMContentLoaded', async () => {
     try {
         const loadedData = JSON.parse(mapData.data);
         rootData = loadedData;
+        mapRevision = loadedRevision = mapData.revision;
 
         // Ensure description field exists for all nodes
         ensureDescriptionField(rootData);
     } catch (e) {
         console.error("Error parsing map data:", e);
-        rootData = { name: mapData.title, description: "", children: [] };
+        rootData = { id: newNodeId(), name: mapData.title, description: "", children: [] };
+        needsFullSave = true;
+    }
+
+    SaveScheduler.init({
+        mapId: MAP_ID,
+        send: persistMap,
+        snapshot: () => ({ revision: mapRevision, data: JSON.stringify(rootData) }),
+        onStatus: showSaveStatus
+    });
+
+    // Edits that did not reach the server last time (offline, tab closed)
+    const unsaved = await SaveScheduler.restore();
+    if (unsaved) {
+        if (unsaved.revision === mapRevision) {
+            rootData = JSON.parse(unsaved.data);
+            ensureDescriptionField(rootData);
+            saveMap();
+        } else {
+            // The map was saved elsewhere since; those edits would overwrite it
+            console.warn('Discarding unsaved changes made to an older version of this map');
+            SaveScheduler.discardOffline();
+        }
     }
 
     initMap();
+
+    // Edits from other tabs and devices show up live
+    Collab.connect(MAP_ID, {
+        onConnect: (revision) => {
+            // Catch up on anything missed while disconnected
+            if (revision !== mapRevision && !SaveScheduler.hasPending()) reloadMap();
+        },
+        onOps: (ops, revision) => {
+            // Already in the document we fetched (sent while connecting or reloading)
+            if (loadedRevision !== null && revision <= loadedRevision) return;
+            if (!applyRemoteOperations(rootData, ops)) {
+                reloadMap();
+                return;
+            }
+            mapRevision = Math.max(mapRevision, revision);
+            refreshMap();
+        },
+        onReplace: () => reloadMap(),
+        onDeleted: () => openErrorModal('This map was deleted in another session.')
+    });
 });
 
+// Replace the local document with the server's version
+async function reloadMap() {
+    const mapData = await API.getMap(MAP_ID);
+    if (!mapData) return;
+    rootData = JSON.parse(mapData.data);
+    ensureDescriptionField(rootData);
+    mapRevision = loadedRevision = mapData.revision;
+    EditHistory.clear();
+    refreshMap();
+}
+
 function initMap() {
     const width = window.innerWidth;
     const height = window.innerHeight - 60;
@@ -41,6 +96,7 @@ function initMap() {
         .scaleExtent([0.1, 3])  // Min/max zoom levels
         .on("zoom", (event) => {
             g.attr("transform", event.transform);
+            scheduleViewportRender();
         });
 
     svg = d3.select("#whiteboard").append("svg")
@@ -51,8 +107,7 @@ function initMap() {
         .on("click", null);
 
     g = svg.append("g");
-
-    tree = d3.tree().nodeSize([120, 200]);
+    Viewport.attach(document.getElementById('whiteboard'), width, height);
 
     root = d3.hierarchy(rootData, d => d.children);
     root.x0 = 0;
@@ -67,7 +122,20 @@ function initMap() {
     );
 }
 
+function newNodeId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID().replace(/-/g, '');
+    }
+    return Date.now().toString(16) + Math.random().toString(16).slice(2);
+}
+
 function ensureDescriptionField(node) {
+    // Stable ids let edits be saved as node-level operations
+    if (!node.id) {
+        node.id = newNodeId();
+        needsFullSave = true;
+    }
+
     if (!node.description) {
         node.description = "";
     }
@@ -99,25 +167,31 @@ function update(source) {
         // Verify Data Consistency before Layout
         syncCollapseState(root);
 
-        // Calculate node dimensions and positions before rendering
-        calculateNodeLayout(root);
-
-        const treeData = tree(root);
-
-        // Adjust specific spacing to prevent overlaps (Fix #2 & #3)
-        adjustNodeSpacing(root);
+        // Calculate node dimensions and positions before rendering;
+        // only the parts of the map that changed are laid out again
+        Layout.run(root);
 
-        // Compute the new tree layout.
-        const nodes = treeData.descendants();
-        const links = treeData.links();
+        const allNodes = root.descendants();
+        Viewport.index(allNodes);
+        render(source, duration);
 
-        // Normalize for fixed-depth (using calculated y positions)
-        nodes.forEach(d => {
-            d.y = d.targetY; // Use the y position calculated in calculateNodeLayout
+        // Store the old positions for transition.
+        allNodes.forEach(d => {
+            d.x0 = d.x;
+            d.y0 = d.y;
         });
+    } catch (e) {
+        console.error("Error in update:", e);
+    }
+}
 
-
-
+// Mount the nodes and links in view (all of them for smaller maps)
+function render(source, transitionMs) {
+    try {
+        const transform = d3.zoomTransform(svg.node());
+        const nodes = Viewport.visibleNodes(transform);
+        const links = visibleLinks(nodes);
+        Viewport.draw(transform);
 
         // ****************** Nodes section ***************************
 
@@ -232,7 +306,7 @@ function update(source) {
 
         // Transition to the proper position for the node
         nodeUpdate.transition()
-            .duration(duration)
+            .duration(transitionMs)
             .attr("transform", d => `translate(${d.y},${d.x})`);
 
         // Update Main Rect
@@ -325,7 +399,7 @@ function update(source) {
 
         // Remove any exiting nodes
         const nodeExit = node.exit().transition()
-            .duration(duration)
+            .duration(transitionMs)
             .attr("transform", d => `translate(${source.y},${source.x})`)
             .remove();
 
@@ -351,27 +425,54 @@ function update(source) {
         const linkUpdate = linkEnter.merge(link);
 
         linkUpdate.transition()
-            .duration(duration)
+            .duration(transitionMs)
             .attr('d', d => diagonal(d.source, d.target));
 
         const linkExit = link.exit().transition()
-            .duration(duration)
+            .duration(transitionMs)
             .attr('d', d => {
                 const o = { x: source.x, y: source.y };
                 return diagonal(o, o);
             })
             .remove();
-
-        // Store the old positions for transition.
-        nodes.forEach(d => {
-            d.x0 = d.x;
-            d.y0 = d.y;
-        });
     } catch (e) {
-        console.error("Error in update:", e);
+        console.error("Error in render:", e);
     }
 }
 
+// Links to the parent of every mounted node, and to children that are not mounted
+function visibleLinks(nodes) {
+    const mounted = new Set(nodes);
+    const links = [];
+    nodes.forEach(d => {
+        if (d.parent) {
+            links.push({ source: d.parent, target: d });
+        }
+        if (d.children) {
+            d.children.forEach(child => {
+                if (!mounted.has(child)) links.push({ source: d, target: child });
+            });
+        }
+    });
+    return links;
+}
+
+// Re-mount nodes once panning or zooming moves past the mounted area
+let viewportFrame = null;
+function scheduleViewportRender() {
+    if (viewportFrame !== null) return;
+    viewportFrame = requestAnimationFrame(() => {
+        viewportFrame = null;
+        if (!root) return;
+        const transform = d3.zoomTransform(svg.node());
+        if (Viewport.needsRender(transform)) {
+            render(root, 0);
+        } else {
+            Viewport.draw(transform);
+        }
+    });
+}
+
 function diagonal(s, d) {
     return `M ${s.y} ${s.x}
             C ${(s.y + d.y) / 2} ${s.x},
@@ -385,7 +486,7 @@ function toggleChildren(d) {
             d.data.isCollapsed = false;
         }
         d.data.isCollapsed = !d.data.isCollapsed;
-        saveMap();
+        saveMap([{ op: 'update', id: d.data.id, isCollapsed: d.data.isCollapsed }]);
     }
 }
 
@@ -429,36 +530,23 @@ function click(event, d) {
 
 // --- Actions ---
 
-function pushToUndo() {
-    // Deep copy current state
-    undoStack.push(JSON.parse(JSON.stringify(rootData)));
-    if (undoStack.length > 20) undoStack.shift(); // Limit stack size
-    redoStack = []; // Clear redo
-}
-
 function undo() {
-    if (undoStack.length === 0) return;
-
-    redoStack.push(JSON.parse(JSON.stringify(rootData)));
-    rootData = undoStack.pop();
+    const ops = EditHistory.undo();
+    if (!ops) return;
 
     refreshMap();
-    saveMap();
+    saveMap(ops);
 }
 
 function redo() {
-    if (redoStack.length === 0) return;
-
-    undoStack.push(JSON.parse(JSON.stringify(rootData)));
-    rootData = redoStack.pop();
+    const ops = EditHistory.redo();
+    if (!ops) return;
 
     refreshMap();
-    saveMap();
+    saveMap(ops);
 }
 
 function addChild(d) {
-    pushToUndo();
-
     if (!d.data.children) d.data.children = [];
 
     // If children were hidden, show them
@@ -467,11 +555,12 @@ function addChild(d) {
         d._children = null;
     }
 
-    const newChild = { name: "New Topic", description: "", children: [] };
+    const newChild = { id: newNodeId(), name: "New Topic", description: "", children: [] };
     d.data.children.push(newChild);
+    EditHistory.record([{ type: 'insert', parent: d.data, node: newChild, index: d.data.children.length - 1 }]);
 
     refreshMap();
-    saveMap();
+    saveMap([{ op: 'add', parent_id: d.data.id, node: JSON.parse(JSON.stringify(newChild)) }]);
 
     // Auto expand to show new child
     if (d.children) {
@@ -575,7 +664,6 @@ function saveNodeEdit() {
         return;
     }
 
-    pushToUndo();
     const newName = document.getElementById('nodeTitleInput').value.trim();
     const rawDescription = document.getElementById('nodeDescriptionInput').innerHTML.trim();
 
@@ -598,12 +686,19 @@ function saveNodeEdit() {
         return;
     }
 
+    EditHistory.record([{
+        type: 'set',
+        node: currentNode.data,
+        before: { name: currentNode.data.name, description: currentNode.data.description },
+        after: { name: newName, description: newDescription }
+    }]);
     currentNode.data.name = newName;
     currentNode.data.description = newDescription;
+    const ops = [{ op: 'update', id: currentNode.data.id, name: newName, description: newDescription }];
 
     closeModal();
     refreshMap();
-    saveMap();
+    saveMap(ops);
 }
 
 function openDeleteConfirmModal() {
@@ -622,18 +717,18 @@ function closeDeleteNodeConfirmModal() {
 function confirmDeleteNode() {
     if (!currentNode) return;
 
-    pushToUndo();
-
     const parent = currentNode.parent;
     const index = parent.data.children.indexOf(currentNode.data);
     if (index > -1) {
         parent.data.children.splice(index, 1);
+        EditHistory.record([{ type: 'remove', parent: parent.data, node: currentNode.data, index }]);
     }
+    const ops = [{ op: 'delete', id: currentNode.data.id }];
 
     closeDeleteNodeConfirmModal();
     closeModal();
     refreshMap();
-    saveMap();
+    saveMap(ops);
 }
 
 function openErrorModal(msg) {
@@ -664,17 +759,83 @@ function refreshMap() {
     update(root);
 }
 
-async function saveMap() {
-    const status = document.getElementById('saveStatus');
-    status.textContent = "Saving...";
+function saveMap(ops) {
+    // Edits are batched and sent by the scheduler, one request at a time
+    SaveScheduler.schedule(ops);
+}
+
+// Send one batch of edits. Resolves to 'saved', 'conflict', 'rejected' or
+// 'failed' (network or server error, which the scheduler retries).
+async function persistMap({ ops, full }) {
+    if (!full && ops.length > 0 && !needsFullSave && Collab.isOpen()) {
+        const result = await Collab.sendOps(ops);
+        if (result.ok) {
+            mapRevision = Math.max(mapRevision, result.revision);
+            return 'saved';
+        }
+        // Connection dropped, or rate limited: the scheduler retries
+        if (result.status === 0 || result.status === 429) {
+            return 'failed';
+        }
+        // The edit no longer applies, e.g. its node was deleted elsewhere
+        await reloadMap();
+        openErrorModal('Your last change conflicted with an edit made elsewhere. The map has been reloaded.');
+        return 'rejected';
+    }
 
-    const success = await API.updateMap(MAP_ID, {
+    if (!full && ops.length > 0 && mapRevision !== null && !needsFullSave) {
+        const result = await API.patchMap(MAP_ID, mapRevision, ops);
+        if (result.ok) {
+            mapRevision = result.revision;
+            return 'saved';
+        }
+        if (result.status === 409) {
+            return 'conflict';
+        }
+        if (result.status >= 500) {
+            return 'failed';
+        }
+    }
+
+    // Full save: first save, or the patch could not be applied.
+    // The document already includes every edit made so far.
+    const saved = await API.updateMap(MAP_ID, {
         data: JSON.stringify(rootData)
-    });
+    }, mapRevision);
+    if (saved.ok) {
+        mapRevision = saved.map.revision;
+        needsFullSave = false;
+        return 'saved';
+    }
+    if (saved.status === 409) {
+        return 'conflict';
+    }
+    if (saved.status >= 500) {
+        return 'failed';
+    }
+    needsFullSave = true;
+    return 'rejected';
+}
 
-    if (success) {
+function showSaveStatus(state) {
+    const status = document.getElementById('saveStatus');
+    status.style.color = "";
+    if (state === 'pending') {
+        status.textContent = "Unsaved changes";
+    } else if (state === 'saving') {
+        status.textContent = "Saving...";
+    } else if (state === 'saved') {
         status.textContent = "Saved";
-        setTimeout(() => status.textContent = "", 2000);
+        setTimeout(() => {
+            if (status.textContent === "Saved") status.textContent = "";
+        }, 2000);
+    } else if (state === 'offline') {
+        status.textContent = "Offline - changes kept on this device, retrying";
+        status.style.color = "#e67e22";
+    } else if (state === 'conflict') {
+        // Someone saved this map elsewhere (e.g. another tab); don't overwrite their changes
+        status.textContent = "Changed elsewhere - reload to see the latest version";
+        status.style.color = "red";
     } else {
         status.textContent = "Error saving";
         status.style.color = "red";
@@ -764,167 +925,3 @@ function highlightToolbarButton(command) {
         btn.classList.remove('active');
     }, 200);
 }
-
-// --- Layout Helpers ---
-
-function calculateNodeLayout(rootNode) {
-    const MIN_WIDTH = 140;
-    const MAX_WIDTH = 240;
-    const BASE_HEIGHT = 50;
-    const PADDING = 30;
-    const CHAR_WIDTH = 6; // Approx for 14px font
-    const LINE_HEIGHT = 20;
-
-    const depthWidths = {}; // Store max width per depth
-
-    // 1. First Pass: Calculate required width for each node
-    rootNode.descendants().forEach(d => {
-        const title = d.data.name || "Untitled";
-        const titleWidth = title.length * CHAR_WIDTH + PADDING * 2;
-
-        // Clamp width
-        let width = Math.max(MIN_WIDTH, Math.min(titleWidth, MAX_WIDTH));
-
-        // Store max width for this depth
-        if (!depthWidths[d.depth] || width > depthWidths[d.depth]) {
-            depthWidths[d.depth] = width;
-        }
-    });
-
-    // 2. Second Pass: Assign final width and calculate height/wrapping
-    rootNode.descendants().forEach(d => {
-        // Assign consistent width for the column
-        d.width = depthWidths[d.depth];
-
-        // Calculate Text Wrapping
-        const title = d.data.name || "Untitled";
-        const maxTextWidth = d.width - PADDING * 2;
-        const approxCharsPerLine = Math.floor(maxTextWidth / CHAR_WIDTH);
-
-        d.titleLines = wrapText(title, approxCharsPerLine);
-
-        // Check description (strip HTML first)
-        const plainDesc = (d.data.description || "").replace(/<[^>]*>/g, '').trim();
-        d.hasDescription = plainDesc.length > 0;
-
-        // Calculate Height
-        let contentHeight = d.titleLines.length * LINE_HEIGHT;
-        if (d.hasDescription) {
-            contentHeight += LINE_HEIGHT + 1; // Add space for description + gap
-        }
-
-        d.height = Math.max(BASE_HEIGHT, contentHeight + 12);
-    });
-
-    // 3. Calculate Y positions (horizontal spacing)
-    const DEPTH_SPACING = 130; // Gap between columns
-
-    // Re-iterate to set targetY
-    rootNode.descendants().forEach(d => {
-        let yPos = 0;
-        for (let i = 0; i < d.depth; i++) {
-            yPos += (depthWidths[i] || MIN_WIDTH) + DEPTH_SPACING;
-        }
-        d.targetY = yPos;
-    });
-}
-
-function calculateSubtreeBounds(node) {
-    let top = node.x;
-    let bottom = node.x;
-
-    if (node.children) {
-        node.children.forEach(child => {
-            const childBounds = calculateSubtreeBounds(child);
-            if (childBounds.top < top) top = childBounds.top;
-            if (childBounds.bottom > bottom) bottom = childBounds.bottom;
-        });
-    }
-
-    return { top, bottom };
-}
-
-function adjustNodeSpacing(node, depth = 0) {
-    try {
-        if (depth > 20) {
-            console.warn("Max depth exceeded in adjustNodeSpacing");
-            return;
-        }
-        if (!node.children || node.children.length === 0) return;
-
-        // Process children first (post-order traversal)
-        node.children.forEach(child => adjustNodeSpacing(child, depth + 1));
-
-        // Sort children by vertical position (x)
-        node.children.sort((a, b) => a.x - b.x);
-
-        const MIN_NODE_GAP = 40;
-
-        for (let i = 0; i < node.children.length - 1; i++) {
-            const child1 = node.children[i];
-            const child2 = node.children[i + 1];
-
-            // Bounds of the subtrees (visual extent)
-            // We really care about the bottom of child1's tree vs top of child2's tree
-            const bounds1 = calculateSubtreeBounds(child1);
-            const bounds2 = calculateSubtreeBounds(child2);
-
-            // However, standard d3.tree layout does a good job of separating subtrees.
-            // The issue is mostly with the adjacent nodes themselves when heights are variable.
-            // Or if d3.tree fixed spacing is too tight for the custom content height.
-
-            // Let's ensure the gap between the actual nodes is respected.
-            // AND the gap between the subtrees.
-
-            // Gap required based on node heights:
-            const requiredDist = (child1.height / 2) + MIN_NODE_GAP + (child2.height / 2);
-            const currentDist = child2.x - child1.x;
-
-            let shift = 0;
-            if (currentDist < requiredDist) {
-                shift = requiredDist - currentDist;
-            }
-
-            // Apply shift to child2 and all following siblings
-            if (shift > 0) {
-                for (let j = i + 1; j < node.children.length; j++) {
-                    const sibling = node.children[j];
-                    shiftSubtree(sibling, shift);
-                }
-            }
-        }
-    } catch (e) {
-        console.error("Error in adjustNodeSpacing:", e);
-    }
-}
-
-function shiftSubtree(node, dy) {
-    node.x += dy;
-    if (node.children) {
-        node.children.forEach(child => shiftSubtree(child, dy));
-    }
-}
-
-
-
-
-function wrapText(text, maxChars) {
-    if (text === null || typeof text === 'undefined') return [""];
-    if (!text) return [""];
-    const words = text.split(/\s+/);
-    let lines = [];
-    let currentLine = words[0];
-
-    for (let i = 1; i < words.length; i++) {
-        const word = words[i];
-        if (currentLine.length + 1 + word.length <= maxChars) {
-            currentLine += " " + word;
-        } else {
-            lines.push(currentLine);
-            currentLine = word;
-        }
-    }
-    lines.push(currentLine);
-    return lines;
-}
-
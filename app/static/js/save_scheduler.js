@@ -0,0 +1,198 @@
+// Unsent editor changes kept in IndexedDB, so they survive a failed save,
+// going offline, or closing the tab. One record per map.
+const OfflineSaves = {
+    DB_NAME: 'mindmap-editor',
+    STORE: 'pendingSaves',
+    _db: null,
+
+    _open() {
+        if (!window.indexedDB) {
+            return Promise.resolve(null);
+        }
+        if (!this._db) {
+            this._db = new Promise((resolve) => {
+                const request = indexedDB.open(this.DB_NAME, 1);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore(this.STORE, { keyPath: 'mapId' });
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => resolve(null);
+            });
+        }
+        return this._db;
+    },
+
+    async _run(mode, action) {
+        const db = await this._open();
+        if (!db) {
+            return null;
+        }
+        return new Promise((resolve) => {
+            const request = action(db.transaction(this.STORE, mode).objectStore(this.STORE));
+            request.onsuccess = () => resolve(request.result || null);
+            request.onerror = () => resolve(null);
+        });
+    },
+
+    get(mapId) {
+        return this._run('readonly', store => store.get(mapId));
+    },
+
+    put(record) {
+        return this._run('readwrite', store => store.put(record));
+    },
+
+    remove(mapId) {
+        return this._run('readwrite', store => store.delete(mapId));
+    }
+};
+
+// Coalesces editor saves. Changes are sent after a short pause in editing
+// (or after maxWaitMs of continuous editing), with at most one request in
+// flight; changes made meanwhile are merged and sent next, so superseded
+// states are never sent. Failed saves are kept offline and retried.
+const SaveScheduler = {
+    debounceMs: 600,
+    maxWaitMs: 3000,
+    retryMinMs: 1000,
+    retryMaxMs: 30000,
+    maxOps: 1000, // Server limit per PATCH; larger batches are sent as a full save
+
+    _mapId: null,
+    _send: null,
+    _snapshot: null,
+    _onStatus: null,
+    _ops: [],
+    _full: false,
+    _dirty: false,
+    _firstChangeAt: 0,
+    _timer: null,
+    _inFlight: false,
+    _retryDelay: 0,
+    _stopped: false,
+
+    // send({ ops, full }) resolves to 'saved', 'conflict', 'rejected' or 'failed';
+    // only 'failed' (network or server error) is retried.
+    // snapshot() returns { revision, data } to keep offline while a save is pending.
+    init({ mapId, send, snapshot, onStatus }) {
+        this._mapId = mapId;
+        this._send = send;
+        this._snapshot = snapshot;
+        this._onStatus = onStatus || (() => {});
+
+        window.addEventListener('online', () => this.flush());
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') {
+                this.flush();
+            }
+        });
+        window.addEventListener('beforeunload', (event) => {
+            if (this.hasPending()) {
+                this._keepOffline();
+                event.preventDefault();
+                event.returnValue = '';
+            }
+        });
+    },
+
+    // Changes that never reached the server in an earlier session, if any
+    restore() {
+        return OfflineSaves.get(this._mapId);
+    },
+
+    discardOffline() {
+        return OfflineSaves.remove(this._mapId);
+    },
+
+    // Queue a save: node operations, or a full save of the document when ops is empty
+    schedule(ops) {
+        if (this._stopped) {
+            return;
+        }
+        if (ops && ops.length > 0) {
+            this._ops.push(...ops);
+        } else {
+            this._full = true;
+        }
+        if (!this._dirty) {
+            this._firstChangeAt = Date.now();
+        }
+        this._dirty = true;
+        this._onStatus('pending');
+
+        if (this._retryDelay > 0) {
+            return; // A retry is already scheduled and will include this change
+        }
+        clearTimeout(this._timer);
+        const untilMaxWait = this._firstChangeAt + this.maxWaitMs - Date.now();
+        this._timer = setTimeout(() => this.flush(), Math.max(0, Math.min(this.debounceMs, untilMaxWait)));
+    },
+
+    hasPending() {
+        return this._dirty || this._inFlight;
+    },
+
+    async flush() {
+        clearTimeout(this._timer);
+        this._timer = null;
+        // A request in flight sends whatever is pending when it finishes
+        if (this._inFlight || !this._dirty || this._stopped) {
+            return;
+        }
+
+        const batch = { ops: this._ops, full: this._full || this._ops.length > this.maxOps };
+        this._ops = [];
+        this._full = false;
+        this._dirty = false;
+        this._inFlight = true;
+        this._onStatus('saving');
+
+        let result;
+        try {
+            result = await this._send(batch);
+        } catch (error) {
+            console.error('Error saving map:', error);
+            result = 'failed';
+        }
+        this._inFlight = false;
+
+        if (result === 'failed') {
+            // Put the batch back in front of newer changes and try again later
+            this._ops = batch.ops.concat(this._ops);
+            this._full = this._full || batch.full;
+            if (!this._dirty) {
+                this._firstChangeAt = Date.now();
+            }
+            this._dirty = true;
+            this._keepOffline();
+            this._retryDelay = Math.min(this.retryMaxMs, Math.max(this.retryMinMs, this._retryDelay * 2));
+            this._onStatus('offline');
+            this._timer = setTimeout(() => this.flush(), this._retryDelay);
+            return;
+        }
+
+        this._retryDelay = 0;
+        if (result === 'conflict') {
+            // Someone else saved this map; stop rather than overwrite their changes
+            this._stopped = true;
+            this.discardOffline();
+            this._onStatus('conflict');
+            return;
+        }
+
+        if (this._dirty) {
+            this._onStatus('pending');
+            if (this._timer === null) {
+                this.flush();
+            }
+        } else {
+            this.discardOffline();
+            this._onStatus(result === 'saved' ? 'saved' : 'error');
+        }
+    },
+
+    _keepOffline() {
+        const snapshot = this._snapshot();
+        OfflineSaves.put({ mapId: this._mapId, savedAt: Date.now(), ...snapshot });
+    }
+};
@@ -0,0 +1,219 @@
+// Virtualized rendering for large maps.
+//
+// Below MIN_NODES visible nodes the whole map is mounted as SVG, as before.
+// Larger maps keep a uniform grid of the laid-out node positions and only
+// mount the nodes inside the viewport (plus a margin), re-mounting when
+// panning or zooming leaves that window. When zoomed out below CANVAS_SCALE
+// no SVG nodes are mounted at all: the map is drawn on a canvas instead,
+// as plain boxes and links without text.
+//
+// Layout coordinates follow the editor: x is vertical, y is horizontal.
+const Viewport = {
+    MIN_NODES: 1000, // Smaller maps are rendered in full
+    CELL_SIZE: 400, // Grid cell size, in layout units
+    MARGIN: 300, // Screen pixels mounted around the viewport
+    CANVAS_SCALE: 0.4, // Zoom level below which large maps are drawn on the canvas
+
+    canvas: null,
+    _width: 0,
+    _height: 0,
+    _nodes: [],
+    _cells: new Map(),
+    _maxHalfWidth: 0,
+    _maxHalfHeight: 0,
+    _window: null, // Layout-space rectangle currently mounted as SVG
+    _canvasMode: false,
+
+    // Add the canvas used for zoomed-out drawing over the SVG
+    attach(container, width, height) {
+        const ratio = window.devicePixelRatio || 1;
+        this._width = width;
+        this._height = height;
+        this.canvas = document.createElement('canvas');
+        this.canvas.width = Math.round(width * ratio);
+        this.canvas.height = Math.round(height * ratio);
+        Object.assign(this.canvas.style, {
+            position: 'absolute',
+            top: '0',
+            left: '0',
+            width: `${width}px`,
+            height: `${height}px`,
+            pointerEvents: 'none', // Let the SVG underneath handle zoom and pan
+            display: 'none'
+        });
+        container.appendChild(this.canvas);
+    },
+
+    // Rebuild the spatial index after a layout
+    index(nodes) {
+        this._nodes = nodes;
+        this._cells = new Map();
+        this._window = null;
+        this._maxHalfWidth = 0;
+        this._maxHalfHeight = 0;
+        if (!this.enabled()) {
+            return;
+        }
+        for (const d of nodes) {
+            const key = this._cellKey(Math.floor(d.x / this.CELL_SIZE), Math.floor(d.y / this.CELL_SIZE));
+            const cell = this._cells.get(key);
+            if (cell) {
+                cell.push(d);
+            } else {
+                this._cells.set(key, [d]);
+            }
+            this._maxHalfWidth = Math.max(this._maxHalfWidth, d.width / 2);
+            this._maxHalfHeight = Math.max(this._maxHalfHeight, d.height / 2);
+        }
+    },
+
+    enabled() {
+        return this._nodes.length >= this.MIN_NODES;
+    },
+
+    isCanvasMode(transform) {
+        return this.enabled() && transform.k < this.CANVAS_SCALE;
+    },
+
+    // Nodes to mount as SVG for the given zoom transform (all of them for small maps)
+    visibleNodes(transform) {
+        this._canvasMode = this.isCanvasMode(transform);
+        if (!this.enabled()) {
+            return this._nodes;
+        }
+        if (this._canvasMode) {
+            this._window = null;
+            return [];
+        }
+        this._window = this._bounds(transform, this.MARGIN);
+        return this._query(this._window);
+    },
+
+    // Whether panning/zooming to `transform` needs the SVG to be mounted again
+    needsRender(transform) {
+        if (!this.enabled()) {
+            return false;
+        }
+        if (this.isCanvasMode(transform) !== this._canvasMode) {
+            return true;
+        }
+        if (this._canvasMode) {
+            return false;
+        }
+        const view = this._bounds(transform, 0);
+        const w = this._window;
+        return !w || view.x0 < w.x0 || view.x1 > w.x1 || view.y0 < w.y0 || view.y1 > w.y1;
+    },
+
+    // Draw the zoomed-out map on the canvas, or hide the canvas
+    draw(transform) {
+        if (!this.canvas) {
+            return;
+        }
+        if (!this.isCanvasMode(transform)) {
+            this.canvas.style.display = 'none';
+            return;
+        }
+        this.canvas.style.display = 'block';
+
+        const ratio = window.devicePixelRatio || 1;
+        const ctx = this.canvas.getContext('2d');
+        ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+        ctx.clearRect(0, 0, this._width, this._height);
+        ctx.setTransform(ratio * transform.k, 0, 0, ratio * transform.k, ratio * transform.x, ratio * transform.y);
+
+        const nodes = this._query(this._bounds(transform, 0));
+
+        // Links to the parent of every node in view, and to children out of view
+        ctx.beginPath();
+        for (const d of nodes) {
+            if (d.parent) {
+                this._link(ctx, d.parent, d);
+            }
+        }
+        const inView = new Set(nodes);
+        for (const d of nodes) {
+            if (d.children) {
+                for (const child of d.children) {
+                    if (!inView.has(child)) this._link(ctx, d, child);
+                }
+            }
+        }
+        ctx.strokeStyle = '#ccc';
+        ctx.lineWidth = 2;
+        ctx.stroke();
+
+        // Node boxes, batched by border colour (same colours as the SVG nodes)
+        const borders = { '#ccc': [], '#7F9CF5': [], '#6C63FF': [] };
+        for (const d of nodes) {
+            const colour = d.depth === 0 ? '#6C63FF' : (d.data.isCollapsed === true ? '#7F9CF5' : '#ccc');
+            borders[colour].push(d);
+        }
+        ctx.fillStyle = '#fff';
+        for (const [colour, group] of Object.entries(borders)) {
+            if (group.length === 0) continue;
+            ctx.beginPath();
+            for (const d of group) {
+                ctx.rect(d.y - d.width / 2, d.x - d.height / 2, d.width, d.height);
+            }
+            ctx.fill();
+            ctx.strokeStyle = colour;
+            ctx.stroke();
+        }
+    },
+
+    _link(ctx, s, d) {
+        const mid = (s.y + d.y) / 2;
+        ctx.moveTo(s.y, s.x);
+        ctx.bezierCurveTo(mid, s.x, mid, d.x, d.y, d.x);
+    },
+
+    _cellKey(row, column) {
+        // Numeric keys are much cheaper than strings; fine for +/-13M layout units
+        return (row + 32768) * 65536 + (column + 32768);
+    },
+
+    // Layout-space rectangle shown at `transform`, grown by `margin` screen pixels
+    _bounds(transform, margin) {
+        return {
+            x0: (-margin - transform.y) / transform.k,
+            x1: (this._height + margin - transform.y) / transform.k,
+            y0: (-margin - transform.x) / transform.k,
+            y1: (this._width + margin - transform.x) / transform.k
+        };
+    },
+
+    // Nodes whose box intersects the rectangle
+    _query(rect) {
+        const result = [];
+        // Nodes are indexed by their center, so widen the search by the largest node
+        const rowStart = Math.floor((rect.x0 - this._maxHalfHeight) / this.CELL_SIZE);
+        const rowEnd = Math.floor((rect.x1 + this._maxHalfHeight) / this.CELL_SIZE);
+        const columnStart = Math.floor((rect.y0 - this._maxHalfWidth) / this.CELL_SIZE);
+        const columnEnd = Math.floor((rect.y1 + this._maxHalfWidth) / this.CELL_SIZE);
+
+        if ((rowEnd - rowStart + 1) * (columnEnd - columnStart + 1) > this._cells.size) {
+            // Zoomed far out: walking the cells is cheaper than probing empty ones
+            for (const cell of this._cells.values()) {
+                this._collect(cell, rect, result);
+            }
+            return result;
+        }
+        for (let row = rowStart; row <= rowEnd; row++) {
+            for (let column = columnStart; column <= columnEnd; column++) {
+                const cell = this._cells.get(this._cellKey(row, column));
+                if (cell) this._collect(cell, rect, result);
+            }
+        }
+        return result;
+    },
+
+    _collect(cell, rect, result) {
+        for (const d of cell) {
+            if (d.x + d.height / 2 >= rect.x0 && d.x - d.height / 2 <= rect.x1 &&
+                d.y + d.width / 2 >= rect.y0 && d.y - d.width / 2 <= rect.y1) {
+                result.push(d);
+            }
+        }
+    }
+};
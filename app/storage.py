@@ -0,0 +1,337 @@
+"""
+Storage backends for mind map documents.
+
+Two backends are available, selected with the ``MINDMAP_STORAGE`` setting:
+
+- ``blob`` (default): the whole document is one JSON string in ``MindMap.data``.
+- ``nodes``: one ``MindMapNode`` row per node, indexed on ``(map_id, parent_id)``.
+  Subtrees can be loaded level by level and edits touch only the affected rows.
+
+Maps still stored as a blob are read as they are by the ``nodes`` backend
+and migrated to node rows the first time it writes them, and the ``blob`` backend can still read maps
+that only have node rows, so switching backends never loses data.
+
+Backends never commit; the caller owns the transaction.
+"""
+from typing import Callable, Iterable, List, Optional
+from sqlalchemy import LargeBinary, cast, delete, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+from . import codec, models
+from .core.config import settings
+from .mindmap_ops import (
+    OperationError, apply_operations, build_document, count_nodes, flatten_document,
+    index_nodes, new_node_id, node_from_row, truncate_document, view_document,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists well below SQLite's bound parameter limit
+_IN_CHUNK_SIZE = 500
+
+Node = models.MindMapNode
+_NODE_COLUMNS = (Node.id, Node.parent_id, Node.ordinal, Node.name, Node.description, Node.is_collapsed)
+
+
+def _empty_document(map_item: models.MindMap) -> dict:
+    return {"id": new_node_id(), "name": map_item.title or "", "description": "", "isCollapsed": False, "children": []}
+
+
+def _chunks(items: List[str]):
+    for start in range(0, len(items), _IN_CHUNK_SIZE):
+        yield items[start:start + _IN_CHUNK_SIZE]
+
+
+class BlobStorage:
+    """Whole-document storage in the ``MindMap.data`` column."""
+
+    name = "blob"
+
+    def load(self, db: Session, map_item: models.MindMap, root_id: Optional[str] = None, depth: Optional[int] = None) -> Optional[dict]:
+        if map_item.data is None:
+            # Map was written by the node backend
+            return _node_storage.load(db, map_item, root_id, depth)
+        return view_document(codec.loads(map_item.data), root_id, depth)
+
+    def dumps(self, db: Session, map_item: models.MindMap, root_id: Optional[str] = None, depth: Optional[int] = None) -> Optional[str]:
+        if root_id is None and depth is None and map_item.data is not None:
+            return map_item.data
+        document = self.load(db, map_item, root_id, depth)
+        return codec.dumps(document) if document is not None else None
+
+    def save(self, db: Session, map_item: models.MindMap, data: str, node_count: Optional[int] = None,
+             document: Optional[dict] = None) -> None:
+        map_item.data = data
+        map_item.node_count = node_count
+
+    def apply(self, db: Session, map_item: models.MindMap, operations: Iterable[dict], sanitize: Callable[[str], str]) -> None:
+        document = self.load(db, map_item)
+        apply_operations(document, operations, sanitize)
+        map_item.data = codec.dumps(document)
+        map_item.node_count = count_nodes(document)
+
+    def copy(self, db: Session, source: models.MindMap, target: models.MindMap) -> None:
+        # Stored documents are sanitized on write, so they can be copied verbatim
+        target.data = self.dumps(db, source)
+        target.node_count = source.node_count
+
+    def delete(self, db: Session, map_item: models.MindMap) -> None:
+        db.execute(delete(Node).where(Node.map_id == map_item.id))
+
+
+class NodeStorage:
+    """One row per node in the ``mindmap_nodes`` table."""
+
+    name = "nodes"
+
+    # --- Helpers ---
+
+    def _migrate(self, db: Session, map_item: models.MindMap) -> None:
+        """Move a map that is still stored as a JSON blob into node rows."""
+        if map_item.data is None:
+            return
+        try:
+            document = codec.loads(map_item.data)
+        except ValueError:
+            logger.warning(f"Map {map_item.id} has invalid JSON, migrating as an empty map")
+            document = _empty_document(map_item)
+        self._replace_rows(db, map_item, document)
+        logger.info(f"Migrated mind map {map_item.id} to node storage")
+
+    def _replace_rows(self, db: Session, map_item: models.MindMap, document: dict) -> None:
+        db.execute(delete(Node).where(Node.map_id == map_item.id))
+        rows = flatten_document(document)
+        for row in rows:
+            row["map_id"] = map_item.id
+        db.execute(insert(Node), rows)
+        map_item.data = None
+        map_item.node_count = len(rows)
+
+    def _get(self, db: Session, map_id: int, node_id: Optional[str]):
+        row = db.execute(
+            select(*_NODE_COLUMNS).where(Node.map_id == map_id, Node.id == node_id)
+        ).mappings().first()
+        if row is None:
+            raise OperationError(f"Unknown node id: {node_id}")
+        return row
+
+    def _siblings(self, map_id: int, parent_id: Optional[str]):
+        parent_clause = Node.parent_id.is_(None) if parent_id is None else Node.parent_id == parent_id
+        return (Node.map_id == map_id, parent_clause)
+
+    def _make_room(self, db: Session, map_id: int, parent_id: str, index: Optional[int]) -> int:
+        """Return the ordinal for a new child, shifting later siblings if needed."""
+        if index is None:
+            last = db.execute(
+                select(func.max(Node.ordinal)).where(*self._siblings(map_id, parent_id))
+            ).scalar()
+            return 0 if last is None else last + 1
+        db.execute(
+            update(Node)
+            .where(*self._siblings(map_id, parent_id), Node.ordinal >= index)
+            .values(ordinal=Node.ordinal + 1)
+        )
+        return index
+
+    def _close_gap(self, db: Session, map_id: int, parent_id: str, ordinal: int) -> None:
+        db.execute(
+            update(Node)
+            .where(*self._siblings(map_id, parent_id), Node.ordinal > ordinal)
+            .values(ordinal=Node.ordinal - 1)
+        )
+
+    def _subtree_ids(self, db: Session, map_id: int, node_id: str) -> List[str]:
+        ids = [node_id]
+        level = [node_id]
+        while level:
+            next_level = []
+            for chunk in _chunks(level):
+                next_level.extend(db.execute(
+                    select(Node.id).where(Node.map_id == map_id, Node.parent_id.in_(chunk))
+                ).scalars())
+            ids.extend(next_level)
+            level = next_level
+        return ids
+
+    # --- Backend interface ---
+
+    def load(self, db: Session, map_item: models.MindMap, root_id: Optional[str] = None, depth: Optional[int] = None) -> Optional[dict]:
+        if map_item.data is not None:
+            # Reads don't write: the blob moves to node rows on the map's next save
+            try:
+                document = codec.loads(map_item.data)
+            except ValueError:
+                document = _empty_document(map_item)
+            return view_document(document, root_id, depth)
+
+        if root_id is None and depth is None:
+            rows = db.execute(select(*_NODE_COLUMNS).where(Node.map_id == map_item.id)).mappings()
+            return build_document(rows) or _empty_document(map_item)
+
+        # Walk down level by level, one indexed (map_id, parent_id) query per level
+        start_clause = Node.parent_id.is_(None) if root_id is None else Node.id == root_id
+        start = db.execute(
+            select(*_NODE_COLUMNS).where(Node.map_id == map_item.id, start_clause)
+        ).mappings().first()
+        if start is None:
+            return _empty_document(map_item) if root_id is None else None
+
+        root = node_from_row(start)
+        level = {root["id"]: root}
+        remaining = depth
+        while level and (remaining is None or remaining > 0):
+            next_level = {}
+            for chunk in _chunks(list(level)):
+                rows = db.execute(
+                    select(*_NODE_COLUMNS)
+                    .where(Node.map_id == map_item.id, Node.parent_id.in_(chunk))
+                    .order_by(Node.parent_id, Node.ordinal)
+                ).mappings()
+                for row in rows:
+                    node = node_from_row(row)
+                    level[row["parent_id"]]["children"].append(node)
+                    next_level[node["id"]] = node
+            level = next_level
+            if remaining is not None:
+                remaining -= 1
+
+        # Tell the client which frontier nodes have children left to load
+        for chunk in _chunks(list(level)):
+            counts = db.execute(
+                select(Node.parent_id, func.count())
+                .where(Node.map_id == map_item.id, Node.parent_id.in_(chunk))
+                .group_by(Node.parent_id)
+            )
+            for parent_id, count in counts:
+                level[parent_id]["childCount"] = count
+        return root
+
+    def dumps(self, db: Session, map_item: models.MindMap, root_id: Optional[str] = None, depth: Optional[int] = None) -> Optional[str]:
+        document = self.load(db, map_item, root_id, depth)
+        return codec.dumps(document) if document is not None else None
+
+    def save(self, db: Session, map_item: models.MindMap, data: str, node_count: Optional[int] = None,
+             document: Optional[dict] = None) -> None:
+        # Callers that already decoded the document pass it to avoid a second parse
+        self._replace_rows(db, map_item, document if document is not None else codec.loads(data))
+
+    def apply(self, db: Session, map_item: models.MindMap, operations: Iterable[dict], sanitize: Callable[[str], str]) -> None:
+        self._migrate(db, map_item)
+        map_id = map_item.id
+
+        for operation in operations:
+            op = operation.get("op")
+
+            if op == "add":
+                parent = self._get(db, map_id, operation.get("parent_id"))
+                node = operation.get("node")
+                if not isinstance(node, dict):
+                    raise OperationError("Add operation requires a node")
+                rows = flatten_document(node)
+                new_ids = [row["id"] for row in rows]
+                for chunk in _chunks(new_ids):
+                    existing = db.execute(
+                        select(Node.id).where(Node.map_id == map_id, Node.id.in_(chunk))
+                    ).scalars().first()
+                    if existing is not None:
+                        raise OperationError(f"Node id already exists: {existing}")
+                for row in rows:
+                    row["map_id"] = map_id
+                    if row["description"]:
+                        row["description"] = sanitize(row["description"])
+                rows[0]["parent_id"] = parent["id"]
+                rows[0]["ordinal"] = self._make_room(db, map_id, parent["id"], operation.get("index"))
+                db.execute(insert(Node), rows)
+
+            elif op == "update":
+                row = self._get(db, map_id, operation.get("id"))
+                values = {}
+                if "name" in operation:
+                    values["name"] = operation["name"] or ""
+                if "description" in operation:
+                    values["description"] = sanitize(operation["description"]) if operation["description"] else ""
+                if "isCollapsed" in operation:
+                    values["is_collapsed"] = bool(operation["isCollapsed"])
+                if values:
+                    db.execute(update(Node).where(Node.map_id == map_id, Node.id == row["id"]).values(**values))
+
+            elif op == "move":
+                row = self._get(db, map_id, operation.get("id"))
+                new_parent = self._get(db, map_id, operation.get("parent_id"))
+                if row["parent_id"] is None:
+                    raise OperationError("Cannot move the root node")
+                ancestor = new_parent
+                while ancestor is not None:
+                    if ancestor["id"] == row["id"]:
+                        raise OperationError("Cannot move a node into its own subtree")
+                    ancestor = self._get(db, map_id, ancestor["parent_id"]) if ancestor["parent_id"] else None
+                self._close_gap(db, map_id, row["parent_id"], row["ordinal"])
+                # Park the node outside both sibling lists while ordinals shift
+                db.execute(update(Node).where(Node.map_id == map_id, Node.id == row["id"]).values(ordinal=-1))
+                ordinal = self._make_room(db, map_id, new_parent["id"], operation.get("index"))
+                db.execute(
+                    update(Node)
+                    .where(Node.map_id == map_id, Node.id == row["id"])
+                    .values(parent_id=new_parent["id"], ordinal=ordinal)
+                )
+
+            elif op == "delete":
+                row = self._get(db, map_id, operation.get("id"))
+                if row["parent_id"] is None:
+                    raise OperationError("Cannot delete the root node")
+                for chunk in _chunks(self._subtree_ids(db, map_id, row["id"])):
+                    db.execute(delete(Node).where(Node.map_id == map_id, Node.id.in_(chunk)))
+                self._close_gap(db, map_id, row["parent_id"], row["ordinal"])
+
+            else:
+                raise OperationError(f"Unsupported operation: {op}")
+
+        map_item.node_count = db.execute(select(func.count()).where(Node.map_id == map_id)).scalar()
+
+    def copy(self, db: Session, source: models.MindMap, target: models.MindMap) -> None:
+        self._migrate(db, source)
+        db.execute(
+            insert(Node).from_select(
+                ["map_id", "id", "parent_id", "ordinal", "name", "description", "is_collapsed"],
+                select(literal(target.id), *_NODE_COLUMNS).where(Node.map_id == source.id),
+            )
+        )
+        target.data = None
+        target.node_count = source.node_count
+
+    def delete(self, db: Session, map_item: models.MindMap) -> None:
+        db.execute(delete(Node).where(Node.map_id == map_item.id))
+
+
+_blob_storage = BlobStorage()
+_node_storage = NodeStorage()
+_BACKENDS = {backend.name: backend for backend in (_blob_storage, _node_storage)}
+
+
+def _text_bytes(column):
+    if settings.database_is_postgres:
+        return func.octet_length(column)
+    # SQLite's length() counts characters for TEXT but bytes for BLOB
+    return func.length(cast(column, LargeBinary))
+
+
+def stored_size_expression():
+    """
+    SQL expression for the stored size of a map in bytes, computed in the
+    database so listings never load ``MindMap.data``. For maps kept as node
+    rows this is the size of their names and descriptions.
+    """
+    node_bytes = (
+        select(func.sum(_text_bytes(Node.name) + _text_bytes(Node.description)))
+        .where(Node.map_id == models.MindMap.id)
+        .scalar_subquery()
+    )
+    return func.coalesce(_text_bytes(models.MindMap.data), node_bytes)
+
+
+def get_storage():
+    """Return the storage backend selected by ``settings.MINDMAP_STORAGE``."""
+    try:
+        return _BACKENDS[settings.MINDMAP_STORAGE.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown MINDMAP_STORAGE: {settings.MINDMAP_STORAGE}")
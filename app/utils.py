@@ -1,4 +1,5 @@
 import bleach
+import html
 from typing import Optional
 
 # Allowed HTML tags for rich text descriptions
@@ -55,7 +56,11 @@ def extract_plain_text(html_content: str) -> str:
     """
     if not html_content:
         return ""
-    
-    # Remove all HTML tags
+
+    if "<" not in html_content and "&" not in html_content:
+        # Most descriptions have no markup; skip the HTML parser
+        return html_content.strip()
+
+    # Remove all HTML tags, then decode the entities bleach leaves behind
     plain = bleach.clean(html_content, tags=[], strip=True)
-    return plain.strip()
+    return html.unescape(plain).strip()
@@ -0,0 +1,248 @@
+"""
+Write-behind buffer for map saves.
+
+The editor saves after every edit. With ``WRITE_BUFFER_ENABLED`` set, saves
+(full documents and node operations) are applied to an in-memory copy of the
+map and acknowledged right away; the latest document is written to the
+database once the map has been idle for ``WRITE_BUFFER_IDLE_MS``, and at the
+latest ``WRITE_BUFFER_FLUSH_MS`` after its first unsaved change. Pending
+writes are flushed on shutdown.
+
+Reads of a buffered map are served from memory, and revisions keep counting
+up exactly as they would without the buffer, so conflict detection works the
+same way. The buffer lives in one process: only enable it with a single
+worker (or sticky routing per map), and accept that a crash loses at most
+``WRITE_BUFFER_FLUSH_MS`` of edits.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import defer
+
+from . import codec, models, search
+from .core.config import settings
+from .database import AsyncSessionLocal
+from .mindmap_ops import apply_operations, count_nodes, ensure_node_ids, index_nodes
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class RevisionConflict(Exception):
+    """Raised when a save is based on a revision the map has moved past."""
+
+
+@dataclass
+class PendingMap:
+    """The in-memory state of a map with unsaved changes."""
+    id: int
+    user_id: int
+    title: str
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    document: dict
+    revision: int
+    # Revision currently in the database; the flush only applies on top of it
+    stored_revision: int
+    first_change: float = 0.0
+    last_change: float = 0.0
+    # Node id -> (node, parent) for ``document``, built by the first operation batch
+    index: Optional[Dict[str, Tuple[dict, Optional[dict]]]] = field(default=None, repr=False)
+
+    @property
+    def dirty(self) -> bool:
+        return self.revision != self.stored_revision
+
+
+class WriteBuffer:
+    def __init__(self, session_factory=AsyncSessionLocal, flush_ms: Optional[int] = None, idle_ms: Optional[int] = None):
+        self.session_factory = session_factory
+        self.flush_ms = settings.WRITE_BUFFER_FLUSH_MS if flush_ms is None else flush_ms
+        self.idle_ms = settings.WRITE_BUFFER_IDLE_MS if idle_ms is None else idle_ms
+        self._maps: Dict[int, PendingMap] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.WRITE_BUFFER_ENABLED
+
+    def get(self, map_id: int, user_id: int) -> Optional[PendingMap]:
+        """Return the buffered state of a map owned by ``user_id``, if any."""
+        pending = self._maps.get(map_id)
+        if pending is None or pending.user_id != user_id:
+            return None
+        return pending
+
+    def is_buffered(self, map_id: int) -> bool:
+        """Whether the buffer holds a map, whoever owns it."""
+        return map_id in self._maps
+
+    async def _load(self, db, map_id: int, user_id: int) -> PendingMap:
+        result = await db.execute(select(models.MindMap).where(
+            models.MindMap.id == map_id,
+            models.MindMap.user_id == user_id
+        ))
+        map_item = result.scalars().first()
+        if map_item is None:
+            raise LookupError(map_id)
+        document = await db.run_sync(lambda session: get_storage().load(session, map_item))
+        return PendingMap(
+            id=map_id, user_id=user_id, title=map_item.title,
+            created_at=map_item.created_at, updated_at=map_item.updated_at,
+            document=document, revision=map_item.revision, stored_revision=map_item.revision,
+        )
+
+    async def save(self, db, map_id: int, user_id: int, expected: Optional[int], document: Optional[dict] = None,
+                   operations: Optional[Iterable[dict]] = None, sanitize: Optional[Callable[[str], str]] = None,
+                   title: Optional[str] = None) -> PendingMap:
+        """
+        Apply a save to the buffered map, loading it first if needed.
+
+        ``document`` replaces the whole (already sanitized) document;
+        ``operations`` are applied to it as with PATCH.
+
+        Raises:
+            LookupError: If the map does not exist or is not the user's
+            RevisionConflict: If ``expected`` is not the current revision
+            ValueError: If an operation cannot be applied
+        """
+        pending = self.get(map_id, user_id)
+        if pending is None:
+            if map_id in self._maps:
+                raise LookupError(map_id)
+            # Holding the flush lock means no flush can commit a newer revision while we load
+            async with self._flush_lock:
+                pending = self.get(map_id, user_id)
+                if pending is None:
+                    pending = await self._load(db, map_id, user_id)
+                    self._maps[map_id] = pending
+
+        if expected is not None and pending.revision != expected:
+            raise RevisionConflict(map_id)
+
+        if operations is not None:
+            if pending.index is None:
+                ensure_node_ids(pending.document)
+                pending.index = index_nodes(pending.document)
+            # Applied in place; a failing batch is undone, leaving the buffered map untouched
+            apply_operations(pending.document, operations, sanitize, pending.index)
+        if document is not None:
+            pending.document = document
+            pending.index = None
+        if title is not None:
+            pending.title = title
+
+        now = time.monotonic()
+        if not pending.dirty:
+            pending.first_change = now
+        pending.last_change = now
+        pending.revision += 1
+        # Naive UTC, like the timestamps read back from the database
+        pending.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        return pending
+
+    def discard(self, map_id: int) -> None:
+        self._maps.pop(map_id, None)
+
+    async def flush(self, map_id: Optional[int] = None) -> None:
+        """Write one map (or every buffered map) to the database."""
+        map_ids = [map_id] if map_id is not None else list(self._maps)
+        async with self._flush_lock:
+            for buffered_id in map_ids:
+                await self._flush_map(buffered_id)
+
+    async def _flush_map(self, map_id: int) -> None:
+        pending = self._maps.get(map_id)
+        if pending is None:
+            return
+        if not pending.dirty:
+            del self._maps[map_id]
+            return
+
+        # Snapshot without awaiting, so saves arriving during the write go to the next flush.
+        # Operations change the buffered document in place, so index a copy of what is written.
+        data = codec.dumps(pending.document)
+        document = codec.loads(data)
+        node_count = count_nodes(document)
+        revision, stored_revision = pending.revision, pending.stored_revision
+        title = pending.title
+        # The row is stamped when it is written, not with the time of the edit, so an
+        # incremental export (db_manager export-data --since) that started before this
+        # flush still picks the map up next time
+        updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+
+        try:
+            async with self.session_factory() as db:
+                result = await db.execute(
+                    update(models.MindMap)
+                    .where(models.MindMap.id == map_id, models.MindMap.revision == stored_revision)
+                    .values(revision=revision, title=title, updated_at=updated_at)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 0:
+                    await db.rollback()
+                    logger.error(f"Dropping buffered changes to map {map_id}: it was changed or deleted outside the buffer")
+                    self._maps.pop(map_id, None)
+                    return
+                map_item = (await db.execute(
+                    select(models.MindMap).options(defer(models.MindMap.data)).where(models.MindMap.id == map_id)
+                )).scalars().first()
+                def save(session):
+                    # Index first so its queries don't flush the map row before updated_at is set
+                    search.index_document(session, map_item, document)
+                    get_storage().save(session, map_item, data, node_count)
+
+                await db.run_sync(save)
+                map_item.updated_at = updated_at
+                await db.commit()
+        except Exception as e:
+            # Keep the changes buffered and retry on the next flush
+            logger.error(f"Error flushing buffered map {map_id}: {str(e)}")
+            return
+
+        logger.debug(f"Flushed map {map_id} at revision {revision}")
+        if pending.revision == revision:
+            self._maps.pop(map_id, None)
+        else:
+            pending.stored_revision = revision
+            pending.first_change = time.monotonic()
+
+    def _due(self) -> list:
+        now = time.monotonic()
+        return [
+            map_id for map_id, pending in self._maps.items()
+            if not pending.dirty
+            or now - pending.last_change >= self.idle_ms / 1000
+            or now - pending.first_change >= self.flush_ms / 1000
+        ]
+
+    async def _run(self) -> None:
+        interval = max(0.05, min(self.idle_ms, self.flush_ms) / 2000)
+        while True:
+            await asyncio.sleep(interval)
+            for map_id in self._due():
+                await self.flush(map_id)
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flusher and write everything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+write_buffer = WriteBuffer()
@@ -0,0 +1,71 @@
+"""
+Benchmark JSON encode/decode throughput for map documents.
+
+Compares the stdlib json module with every codec backend that is installed
+(see app/codec.py), over generated maps of realistic sizes.
+
+Usage:
+    python benchmarks/bench_codec.py [--sizes 100,1000,10000,50000] [--repeat 20]
+
+Maps are generated at most 8 levels deep. orjson does not encode documents
+nested deeper than 255 levels; app.codec falls back to json for those.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_sanitize import make_map
+
+BACKENDS = {"json": (json.loads, lambda obj: json.dumps(obj).encode("utf-8"))}
+try:
+    import orjson
+    BACKENDS["orjson"] = (orjson.loads, orjson.dumps)
+except ImportError:
+    pass
+try:
+    import msgspec
+    BACKENDS["msgspec"] = (msgspec.json.decode, msgspec.json.encode)
+except ImportError:
+    pass
+
+
+def best_of(func, arg, repeat: int) -> float:
+    # Like timeit, keep the garbage collector out of the measurement
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(arg)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,50000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from app import codec
+    print(f"app.codec backend: {codec.BACKEND}")
+    print(f"{'nodes':>7} {'KiB':>7} {'backend':>8} {'decode MB/s':>12} {'encode MB/s':>12}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        document = make_map(size, max_depth=8)
+        encoded = json.dumps(document).encode("utf-8")
+        megabytes = len(encoded) / 1e6
+        for name, (decode, encode) in BACKENDS.items():
+            decode_s = best_of(decode, encoded, args.repeat)
+            encode_s = best_of(encode, document, args.repeat)
+            print(f"{size:>7} {len(encoded) / 1024:>7.0f} {name:>8} {megabytes / decode_s:>12.0f} {megabytes / encode_s:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
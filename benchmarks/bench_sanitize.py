@@ -0,0 +1,111 @@
+"""
+Benchmark saving a large mind map through the sanitization pipeline.
+
+Compares the previous pipeline (recursive walk, bleach on every description)
+with app.sanitizer on a generated 10k-node map:
+
+  - cold: first save, nothing cached yet
+  - warm: the same map saved again after editing one description
+
+Usage:
+    python benchmarks/bench_sanitize.py [--nodes 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sanitizer
+from app.routers.maps import sanitize_mindmap_data
+from app.utils import sanitize_html
+
+DESCRIPTIONS = [
+    lambda i: "",
+    lambda i: f"Notes for topic {i}: follow up with the team next week.",
+    lambda i: f"<b>Key point {i}</b> with <i>emphasis</i> and a <br> break",
+    lambda i: f"Q{i % 4 + 1} revenue & costs",
+    lambda i: f"<b onclick=\"alert({i})\">Click</b><script>alert({i})</script>",
+]
+WEIGHTS = [20, 50, 20, 7, 3]
+
+
+def make_map(node_count: int, seed: int = 1, max_depth: int = None) -> dict:
+    """
+    Generate a map. Parents are picked among recently added nodes, which makes
+    large maps very deep; pass ``max_depth`` for the shallow shape of real maps.
+    """
+    rng = random.Random(seed)
+    root = {"id": "n0", "name": "Root", "description": "", "isCollapsed": False, "children": []}
+    nodes = [(root, 0)]
+    for i in range(1, node_count):
+        parent, depth = nodes[rng.randrange(max(1, len(nodes) - 50), len(nodes))] if i > 1 else nodes[0]
+        if max_depth is not None and depth >= max_depth:
+            parent, depth = nodes[rng.randrange(len(nodes))]
+            if depth >= max_depth:
+                parent, depth = nodes[0]
+        describe = rng.choices(DESCRIPTIONS, WEIGHTS)[0]
+        node = {"id": f"n{i}", "name": f"Node {i}", "description": describe(i), "isCollapsed": False, "children": []}
+        parent["children"].append(node)
+        nodes.append((node, depth + 1))
+    return root
+
+
+def legacy_sanitize_mindmap_data(data_str: str) -> str:
+    """The pipeline before app.sanitizer, kept here for comparison."""
+    def sanitize_node(node):
+        if 'description' in node and node['description']:
+            node['description'] = sanitize_html(node['description'])
+        if 'children' in node and isinstance(node['children'], list):
+            node['children'] = [sanitize_node(child) for child in node['children']]
+        return node
+    return json.dumps(sanitize_node(json.loads(data_str)))
+
+
+def save(data_str: str) -> str:
+    """The current pipeline: decode once, one validating/sanitizing pass, encode once."""
+    return sanitize_mindmap_data(json.loads(data_str))[0]
+
+
+def time_call(func, data_str: str, repeat: int, setup=None) -> float:
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func(data_str)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    document = make_map(args.nodes)
+    data_str = json.dumps(document)
+    # Warm saves change one description, the usual edit between two saves
+    document["children"][0]["description"] = "<b>edited</b> description"
+    edited_str = json.dumps(document)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.nodes + 100))
+
+    legacy = time_call(legacy_sanitize_mindmap_data, edited_str, args.repeat)
+    cold = time_call(save, data_str, args.repeat, setup=sanitizer.clear_cache)
+    sanitizer.clear_cache()
+    save(data_str)
+    warm = time_call(save, edited_str, args.repeat)
+
+    print(f"{args.nodes} nodes, {len(data_str) / 1024:.0f} KiB, median of {args.repeat} runs")
+    print(f"  before (bleach on every description): {legacy:8.1f} ms")
+    print(f"  after, cold cache:                    {cold:8.1f} ms  ({legacy / cold:.1f}x)")
+    print(f"  after, warm cache (one edit):         {warm:8.1f} ms  ({legacy / warm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
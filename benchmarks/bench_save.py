@@ -0,0 +1,80 @@
+"""
+Benchmark end-to-end save latency (PUT /api/maps/{id}) for a large map.
+
+Runs the app in-process against a throwaway SQLite database, creates one map
+and saves it repeatedly with a single edited description, the way the editor
+does. Reports p50 and p99 request latency.
+
+Requires httpx (used by FastAPI's TestClient).
+
+Usage:
+    python benchmarks/bench_save.py [--nodes 10000] [--saves 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--saves", type=int, default=50)
+    args = parser.parse_args()
+
+    db_path = tempfile.mktemp(suffix=".db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    import logging
+    logging.disable(logging.INFO)
+
+    # Imported after DATABASE_URL is set, since settings are read on import
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from bench_sanitize import make_map
+
+    try:
+        with TestClient(app) as client:
+            client.post("/auth/signup", json={
+                "email": "bench@example.com", "password": "Benchmark1", "security_question": "Benchmark?",
+                "security_answer": "yes", "hint": "",
+            })
+            token = client.post("/auth/token", data={"username": "bench@example.com", "password": "Benchmark1"}).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            document = make_map(args.nodes)
+            created = client.post("/api/maps/", json={"title": "Benchmark", "data": json.dumps(document)}, headers=headers)
+            created.raise_for_status()
+            map_id = created.json()["id"]
+            document = json.loads(created.json()["data"])
+            edited = document["children"][0]
+
+            timings = []
+            for i in range(args.saves):
+                edited["description"] = f"<b>edit {i}</b>"
+                body = {"data": json.dumps(document)}
+                start = time.perf_counter()
+                response = client.put(f"/api/maps/{map_id}", json=body, headers=headers)
+                timings.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+    finally:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+    print(f"{args.nodes} nodes, {args.saves} saves")
+    print(f"  p50: {statistics.median(timings):8.1f} ms")
+    print(f"  p99: {percentile(timings, 99):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
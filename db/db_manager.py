@@ -5,13 +5,17 @@ Mind Map Database Manager
 AVAILABLE COMMANDS:
 
 VIEW COMMANDS:
-  view-users              View all users with their associated map IDs
-  view-maps               View all mind maps with user information
+  view-users              View users with their associated map IDs
+  view-maps               View mind maps with user information
   view-all                View complete database (users + maps)
+                          Options: --limit [n] (default 100, 0 for all)
+                                   --after [id] (next page)
 
 EXPORT COMMANDS:
-  export-data             Export database to JSON or CSV file
-                          Options: --format [json|csv] --output [filename]
+  export-data             Export database to a file, streaming rows in batches
+                          Options: --format [json|ndjson|csv|parquet]
+                                   --compress [none|gzip|zstd] --output [filename]
+                                   --since [ISO timestamp] --batch-size [n]
 
 DELETE COMMANDS:
   delete-users            Delete one or multiple users (and their maps)
@@ -23,28 +27,52 @@ UPDATE COMMANDS:
   update-user             Update user details (email, password)
   update-map              Update mind map details (title)
 
+MIGRATION COMMANDS:
+  migrate-nodes           Move maps stored as JSON blobs into the mindmap_nodes
+                          table (for MINDMAP_STORAGE=nodes)
+                          Options: --batch-size [n]
+
+PASSWORD COMMANDS:
+  benchmark-hash          Pick the password hash work factor for this host
+                          Options: --target-ms [ms] (default 250)
+                                   --scheme [pbkdf2_sha256|bcrypt]
+
 EXAMPLES:
   python db_manager.py view-all
+  python db_manager.py view-maps --limit 50 --after 1200
   python db_manager.py delete-users 1 2 --force
   python db_manager.py delete-maps 1 2 3 --force
   python db_manager.py export-data --format json --output backup.json
+  python db_manager.py export-data --format ndjson --compress zstd --since 2024-06-01T00:00:00
+  python db_manager.py migrate-nodes
+  python db_manager.py benchmark-hash --target-ms 100
 """
 
 import sqlite3
 import argparse
 import sys
 import os
+import io
 import json
 import csv
-import hashlib
-from passlib.context import CryptContext
-from datetime import datetime
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-# Configure password hashing (must match app/auth.py)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Make the app package importable when run as "python db_manager.py"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.core.passwords import ROUNDS_LIMITS, benchmark, get_password_hash
+from app.mindmap_ops import build_document, flatten_document
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "mindmap.db")
 
+# Tables with one row per node of a map, deleted along with the map
+MAP_CHILD_TABLES = ('mindmap_nodes', 'search_entries')
+
+# Keep IN (...) lists below SQLite's bound parameter limit (999 on older builds)
+IN_CHUNK_SIZE = 500
+
 def get_db_connection():
     if not os.path.exists(DB_PATH):
         print(f"Error: Database file not found at {DB_PATH}")
@@ -53,82 +81,145 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_password_hash(password):
-    """Hash password using the same logic as the main app."""
-    hashed_input = hashlib.sha256(password.encode()).hexdigest()
-    return pwd_context.hash(hashed_input)
+def has_table(cursor, name):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def has_column(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row['name'] == column for row in cursor.fetchall())
+
+def parse_timestamp(value):
+    """Parse an ISO timestamp into naive UTC, the way the app stores updated_at."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid ISO timestamp: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def chunks(items, size=IN_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def select_ids(cursor, ids):
+    """
+    Put ``ids`` in a temporary table and return a subquery selecting them,
+    for ``IN (...)`` clauses over any number of ids.
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS selected_ids (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.selected_ids")
+    cursor.executemany("INSERT OR IGNORE INTO temp.selected_ids (id) VALUES (?)", [(i,) for i in ids])
+    return "SELECT id FROM temp.selected_ids"
+
+def page_clause(args, column):
+    """``AND column > ? ... LIMIT ?`` for keyset paging with --after/--limit."""
+    sql, params = "", []
+    if args.after:
+        sql += f" AND {column} > ?"
+        params.append(args.after)
+    sql += f" ORDER BY {column}"
+    if args.limit:
+        sql += " LIMIT ?"
+        params.append(args.limit)
+    return sql, params
+
+def print_page_footer(args, label, shown, total, last_id):
+    print(f"\n{'='*120}")
+    print(f"TOTAL {label}: {total} (showing {shown})")
+    if args.limit and shown == args.limit:
+        print(f"Next page: --after {last_id} --limit {args.limit}")
+    print(f"{'='*120}\n")
 
 def view_users(args):
-    """View all users with their map IDs."""
+    """View users with their map IDs, a page at a time."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        # Get all users
-        cursor.execute("SELECT * FROM users ORDER BY id")
+        # One page of users, then the maps of that whole page in one query
+        page_sql, params = page_clause(args, "u.id")
+        page = f"SELECT u.id FROM users u WHERE 1 = 1 {page_sql}"
+        cursor.execute(f"""
+            SELECT u.id, u.email, substr(u.hashed_password, 1, 50) AS password_preview, u.hint
+            FROM users u
+            WHERE 1 = 1 {page_sql}
+        """, params)
         users = cursor.fetchall()
-        
+
         print("\n" + "="*120)
         print("USER DATA (with associated Map IDs)")
         print("="*120)
-        
+
         if not users:
             print("No users found.")
             return
-        
+
+        # The page is selected again as a subquery rather than bound id by id,
+        # which would pass SQLite's parameter limit with --limit 0
+        maps_by_user = {}
+        cursor.execute(f"""
+            SELECT id, title, user_id FROM mindmaps
+            WHERE user_id IN ({page}) ORDER BY user_id, id
+        """, params)
+        for m in cursor.fetchall():
+            maps_by_user.setdefault(m['user_id'], []).append(m)
+
         for user in users:
-            # Get all maps for this user
-            cursor.execute("SELECT id, title FROM mindmaps WHERE user_id = ? ORDER BY id", (user['id'],))
-            maps = cursor.fetchall()
-            
+            maps = maps_by_user.get(user['id'], [])
             map_ids = ', '.join([str(m['id']) for m in maps]) if maps else 'None'
-            
+
             print(f"\nUser ID: {user['id']}")
             print(f"  Email:            {user['email']}")
-            print(f"  Hashed Password:  {user['hashed_password'][:50]}...")
+            print(f"  Hashed Password:  {user['password_preview']}...")
             print(f"  Hint:             {user['hint'] or 'N/A'}")
             print(f"  Map IDs:          {map_ids}")
             print(f"  Total Maps:       {len(maps)}")
-            
+
             if maps:
                 print(f"  Map Details:")
                 for m in maps:
                     print(f"    - ID {m['id']}: {m['title']}")
-        
-        print(f"\n{'='*120}")
-        print(f"TOTAL USERS: {len(users)}")
-        print(f"{'='*120}\n")
+
+        cursor.execute("SELECT COUNT(*) AS count FROM users")
+        print_page_footer(args, "USERS", len(users), cursor.fetchone()['count'], users[-1]['id'])
     finally:
         conn.close()
 
 def view_maps(args):
-    """View all mind maps with user information."""
+    """View mind maps with user information, a page at a time."""
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        query = """
-        SELECT 
-            m.id as map_id,
-            m.title,
-            m.data,
-            m.user_id,
-            m.created_at,
-            m.updated_at,
-            u.email as owner_email
-        FROM mindmaps m 
-        JOIN users u ON m.user_id = u.id
-        ORDER BY m.id
-        """
-        cursor.execute(query)
+        # Only a preview and the size of each document are read, never the whole column
+        page_sql, params = page_clause(args, "m.id")
+        node_count = "m.node_count" if has_column(cursor, 'mindmaps', 'node_count') else "NULL"
+        cursor.execute(f"""
+            SELECT
+                m.id as map_id,
+                m.title,
+                substr(m.data, 1, 100) AS data_preview,
+                length(m.data) AS data_length,
+                {node_count} AS node_count,
+                m.user_id,
+                m.created_at,
+                m.updated_at,
+                u.email as owner_email
+            FROM mindmaps m
+            JOIN users u ON m.user_id = u.id
+            WHERE 1 = 1 {page_sql}
+        """, params)
         maps = cursor.fetchall()
-        
+
         print("\n" + "="*120)
         print("MIND MAP DATA")
         print("="*120)
-        
+
         if not maps:
             print("No mind maps found.")
             return
-        
+
         for m in maps:
             print(f"\nMap ID: {m['map_id']}")
             print(f"  Title:       {m['title']}")
@@ -136,12 +227,15 @@ def view_maps(args):
             print(f"  Owner:       {m['owner_email']}")
             print(f"  Created:     {m['created_at']}")
             print(f"  Updated:     {m['updated_at']}")
-            data_preview = m['data'][:100] + "..." if m['data'] and len(m['data']) > 100 else m['data']
-            print(f"  Data:        {data_preview}")
-        
-        print(f"\n{'='*120}")
-        print(f"TOTAL MAPS: {len(maps)}")
-        print(f"{'='*120}\n")
+            if m['data_length'] is None:
+                print(f"  Data:        (stored as {m['node_count'] or 0} node rows)")
+            else:
+                data_preview = m['data_preview'] + "..." if m['data_length'] > 100 else m['data_preview']
+                print(f"  Data:        {data_preview}")
+                print(f"  Size:        {m['data_length']} characters")
+
+        cursor.execute("SELECT COUNT(*) AS count FROM mindmaps")
+        print_page_footer(args, "MAPS", len(maps), cursor.fetchone()['count'], maps[-1]['map_id'])
     finally:
         conn.close()
 
@@ -153,59 +247,234 @@ def view_all(args):
     view_users(args)
     view_maps(args)
 
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Write-only file that gzips fixed-size blocks on a thread pool (zlib
+    releases the GIL) and writes them in order as concatenated gzip members,
+    which gzip/zcat read back as a single stream. At most two blocks per
+    worker are in flight, so memory stays bounded.
+    """
+
+    def __init__(self, path, level=6, block_size=1 << 20, workers=None):
+        super().__init__()
+        self._file = open(path, 'wb')
+        self._level = level
+        self._block_size = block_size
+        workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._max_pending = workers * 2
+        self._pending = deque()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._pool.submit(gzip.compress, block, self._level, mtime=0))
+        while len(self._pending) > self._max_pending:
+            self._file.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._file.write(self._pending.popleft().result())
+        finally:
+            self._pool.shutdown()
+            self._file.close()
+            super().close()
+
+def open_export_file(path, compress):
+    """Open a text file for writing, compressed with gzip or zstd (multi-threaded) if asked."""
+    if compress == 'gzip':
+        return io.TextIOWrapper(io.BufferedWriter(ParallelGzipWriter(path)), encoding='utf-8', newline='')
+    if compress == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            print("Error: --compress zstd requires the zstandard package (pip install zstandard)")
+            sys.exit(1)
+        writer = zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(open(path, 'wb'))
+        return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+def iter_rows(cursor, batch_size):
+    """Yield batches of rows as dicts, fetching ``batch_size`` at a time."""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield [dict(row) for row in rows]
+
+def fill_node_documents(conn, maps):
+    """Rebuild ``data`` for maps kept as node rows (data is NULL), one query per batch."""
+    missing = {m['id']: m for m in maps if m['data'] is None}
+    if not missing:
+        return
+    cursor = conn.cursor()
+    if not has_table(cursor, 'mindmap_nodes'):
+        return
+    rows_by_map = {}
+    for chunk in chunks(missing):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f"""
+            SELECT map_id, id, parent_id, ordinal, name, description, is_collapsed
+            FROM mindmap_nodes WHERE map_id IN ({placeholders})
+        """, chunk)
+        for row in cursor.fetchall():
+            rows_by_map.setdefault(row['map_id'], []).append(row)
+    for map_id, rows in rows_by_map.items():
+        document = build_document(rows)
+        if document is not None:
+            missing[map_id]['data'] = json.dumps(document, ensure_ascii=False, separators=(',', ':'))
+
+def export_tables(conn, args):
+    """Yield ``(table, columns, batches)`` for users and maps, reading through cursors."""
+    users = conn.cursor()
+    users.execute("SELECT * FROM users ORDER BY id")
+    yield 'users', [column[0] for column in users.description], iter_rows(users, args.batch_size)
+
+    maps = conn.cursor()
+    query = "SELECT m.*, u.email as owner_email FROM mindmaps m JOIN users u ON m.user_id = u.id"
+    params = []
+    if args.since:
+        query += " WHERE m.updated_at >= ?"
+        params.append(args.since.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    maps.execute(query + " ORDER BY m.id", params)
+
+    def map_batches():
+        for batch in iter_rows(maps, args.batch_size):
+            fill_node_documents(conn, batch)
+            yield batch
+
+    yield 'mindmaps', [column[0] for column in maps.description], map_batches()
+
+def export_json(conn, args, output_file, header):
+    counts = {}
+    with open_export_file(output_file, args.compress) as f:
+        f.write('{\n')
+        for key, value in header.items():
+            f.write(f'  {json.dumps(key)}: {json.dumps(value)},\n')
+        for index, (table, _, batches) in enumerate(export_tables(conn, args)):
+            f.write(f'  "{table}": [')
+            count = 0
+            for batch in batches:
+                for row in batch:
+                    f.write(',\n    ' if count else '\n    ')
+                    f.write(json.dumps(row, ensure_ascii=False))
+                    count += 1
+            f.write('\n  ]' if count else ']')
+            f.write(',\n' if index == 0 else '\n')
+            counts[table] = count
+        f.write('}\n')
+    return [output_file], counts
+
+def export_ndjson(conn, args, output_file, header):
+    counts = {}
+    with open_export_file(output_file, args.compress) as f:
+        f.write(json.dumps({'table': 'export', 'row': header}) + '\n')
+        for table, _, batches in export_tables(conn, args):
+            counts[table] = 0
+            for batch in batches:
+                f.writelines(json.dumps({'table': table, 'row': row}, ensure_ascii=False) + '\n' for row in batch)
+                counts[table] += len(batch)
+    return [output_file], counts
+
+def table_file(output_file, table, extension):
+    """mindmap_export.csv.gz -> mindmap_export_users.csv.gz"""
+    base, _, suffix = output_file.partition(f'.{extension}')
+    return f"{base}_{'maps' if table == 'mindmaps' else table}.{extension}{suffix}"
+
+def export_csv(conn, args, output_file, header):
+    files, counts = [], {}
+    for table, columns, batches in export_tables(conn, args):
+        path = table_file(output_file, table, 'csv')
+        with open_export_file(path, args.compress) as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            counts[table] = 0
+            for batch in batches:
+                writer.writerows(batch)
+                counts[table] += len(batch)
+        files.append(path)
+    return files, counts
+
+def export_parquet(conn, args, output_file, header):
+    try:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("Error: --format parquet requires pandas and pyarrow (pip install pyarrow)")
+        sys.exit(1)
+
+    # Declared SQLite types -> Arrow types, so every batch has the same schema
+    # even when a column is entirely NULL in one of them
+    def arrow_type(declared):
+        declared = (declared or '').upper()
+        if 'INT' in declared:
+            return pa.int64()
+        if 'BOOL' in declared:
+            return pa.bool_()
+        return pa.string()
+
+    cursor = conn.cursor()
+    files, counts = [], {}
+    for table, columns, batches in export_tables(conn, args):
+        cursor.execute(f"PRAGMA table_info({table})")
+        declared = {row['name']: row['type'] for row in cursor.fetchall()}
+        schema = pa.schema([(column, arrow_type(declared.get(column))) for column in columns])
+        path = table_file(output_file, table, 'parquet')
+        compression = {'none': 'none', 'gzip': 'gzip', 'zstd': 'zstd'}[args.compress]
+        counts[table] = 0
+        # One row group per batch; pandas alone can only write a whole frame at once
+        with pq.ParquetWriter(path, schema, compression=compression) as writer:
+            for batch in batches:
+                frame = pd.DataFrame.from_records(batch, columns=columns)
+                writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+                counts[table] += len(batch)
+        files.append(path)
+    return files, counts
+
+EXPORTERS = {'json': export_json, 'ndjson': export_ndjson, 'csv': export_csv, 'parquet': export_parquet}
+
 def export_data(args):
-    """Export database to JSON or CSV."""
+    """
+    Export the database, streaming rows through cursors in batches so memory
+    use does not depend on the size of the database.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
+
     try:
-        # Get users
-        cursor.execute("SELECT * FROM users")
-        users = [dict(row) for row in cursor.fetchall()]
-        
-        # Get maps
-        cursor.execute("""
-            SELECT m.*, u.email as owner_email 
-            FROM mindmaps m 
-            JOIN users u ON m.user_id = u.id
-        """)
-        maps = [dict(row) for row in cursor.fetchall()]
-        
-        output_file = args.output or f"mindmap_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{args.format}"
-        
-        if args.format == 'json':
-            data = {
-                'export_date': datetime.now().isoformat(),
-                'users': users,
-                'mindmaps': maps
-            }
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            print(f"✓ Data exported to {output_file} (JSON format)")
-            
-        elif args.format == 'csv':
-            # Export users to CSV
-            users_file = output_file.replace('.csv', '_users.csv')
-            with open(users_file, 'w', newline='', encoding='utf-8') as f:
-                if users:
-                    writer = csv.DictWriter(f, fieldnames=users[0].keys())
-                    writer.writeheader()
-                    writer.writerows(users)
-            
-            # Export maps to CSV
-            maps_file = output_file.replace('.csv', '_maps.csv')
-            with open(maps_file, 'w', newline='', encoding='utf-8') as f:
-                if maps:
-                    writer = csv.DictWriter(f, fieldnames=maps[0].keys())
-                    writer.writeheader()
-                    writer.writerows(maps)
-            
-            print(f"✓ Data exported to:")
-            print(f"  - {users_file} (Users)")
-            print(f"  - {maps_file} (Maps)")
-        
-        print(f"\nExported {len(users)} users and {len(maps)} maps")
-        
+        started = datetime.now(timezone.utc)
+        header = {'export_date': started.isoformat()}
+        if args.since:
+            header['since'] = args.since.isoformat()
+
+        suffix = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}[args.compress] if args.format != 'parquet' else ''
+        output_file = args.output or f"mindmap_export_{started.strftime('%Y%m%d_%H%M%S')}.{args.format}{suffix}"
+
+        files, counts = EXPORTERS[args.format](conn, args, output_file, header)
+
+        print(f"✓ Data exported to:")
+        for path in files:
+            print(f"  - {path}")
+        print(f"\nExported {counts.get('users', 0)} users and {counts.get('mindmaps', 0)} maps")
+        if args.since:
+            print(f"Only maps updated since {args.since.isoformat()} were included.")
+        print(f"For the next incremental export use: --since {started.isoformat()}")
+
     except Exception as e:
         print(f"Error exporting data: {e}")
     finally:
@@ -219,23 +488,23 @@ def delete_users(args):
     try:
         user_ids = args.user_ids
         
-        # Verify users exist and get info
-        placeholders = ','.join('?' * len(user_ids))
-        cursor.execute(f"SELECT id, email FROM users WHERE id IN ({placeholders})", user_ids)
+        # Verify users exist and count their maps in one query
+        selected = select_ids(cursor, user_ids)
+        cursor.execute(f"""
+            SELECT u.id, u.email, COUNT(m.id) AS map_count
+            FROM users u LEFT JOIN mindmaps m ON m.user_id = u.id
+            WHERE u.id IN ({selected})
+            GROUP BY u.id, u.email
+            ORDER BY u.id
+        """)
         existing_users = cursor.fetchall()
         
         if not existing_users:
             print("No users found with the provided IDs.")
             return
         
-        # Count maps for each user
-        total_maps = 0
-        user_info = []
-        for user in existing_users:
-            cursor.execute("SELECT COUNT(*) as count FROM mindmaps WHERE user_id = ?", (user['id'],))
-            map_count = cursor.fetchone()['count']
-            total_maps += map_count
-            user_info.append(f"  - User {user['id']}: {user['email']} ({map_count} maps)")
+        total_maps = sum(user['map_count'] for user in existing_users)
+        user_info = [f"  - User {user['id']}: {user['email']} ({user['map_count']} maps)" for user in existing_users]
         
         # Confirmation
         if not args.force:
@@ -248,12 +517,18 @@ def delete_users(args):
                 print("Operation cancelled.")
                 return
         
-        # Delete maps first
-        cursor.execute(f"DELETE FROM mindmaps WHERE user_id IN ({placeholders})", user_ids)
+        # Delete maps first (and their node rows and search entries)
+        for table in MAP_CHILD_TABLES:
+            if has_table(cursor, table):
+                cursor.execute(f"""
+                    DELETE FROM {table}
+                    WHERE map_id IN (SELECT id FROM mindmaps WHERE user_id IN ({selected}))
+                """)
+        cursor.execute(f"DELETE FROM mindmaps WHERE user_id IN ({selected})")
         maps_deleted = cursor.rowcount
         
         # Delete users
-        cursor.execute(f"DELETE FROM users WHERE id IN ({placeholders})", user_ids)
+        cursor.execute(f"DELETE FROM users WHERE id IN ({selected})")
         users_deleted = cursor.rowcount
         
         conn.commit()
@@ -275,13 +550,13 @@ def delete_maps(args):
         map_ids = args.map_ids
         
         # Verify maps exist
-        placeholders = ','.join('?' * len(map_ids))
+        selected = select_ids(cursor, map_ids)
         cursor.execute(f"""
             SELECT m.id, m.title, u.email 
             FROM mindmaps m 
             JOIN users u ON m.user_id = u.id 
-            WHERE m.id IN ({placeholders})
-        """, map_ids)
+            WHERE m.id IN ({selected})
+        """)
         existing_maps = cursor.fetchall()
         
         if not existing_maps:
@@ -299,7 +574,10 @@ def delete_maps(args):
                 return
         
         # Delete maps
-        cursor.execute(f"DELETE FROM mindmaps WHERE id IN ({placeholders})", map_ids)
+        for table in MAP_CHILD_TABLES:
+            if has_table(cursor, table):
+                cursor.execute(f"DELETE FROM {table} WHERE map_id IN ({selected})")
+        cursor.execute(f"DELETE FROM mindmaps WHERE id IN ({selected})")
         deleted = cursor.rowcount
         conn.commit()
         
@@ -326,6 +604,10 @@ def update_user(args):
             hashed = get_password_hash(args.password)
             updates.append("hashed_password = ?")
             params.append(hashed)
+            # Revoke tokens issued with the old password (running app workers
+            # notice once their cached copy of the user expires)
+            if has_column(cursor, 'users', 'token_version'):
+                updates.append("token_version = COALESCE(token_version, 0) + 1")
             
         if not updates:
             print("No updates specified.")
@@ -370,6 +652,64 @@ def update_map(args):
     finally:
         conn.close()
 
+def migrate_nodes(args):
+    """Move maps stored as JSON blobs into the mindmap_nodes table."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if not has_table(cursor, 'mindmap_nodes'):
+            print("Error: mindmap_nodes table not found. Start the app once to create it.")
+            return
+
+        migrated = 0
+        while True:
+            cursor.execute("SELECT id, title, data FROM mindmaps WHERE data IS NOT NULL LIMIT ?", (args.batch_size,))
+            batch = cursor.fetchall()
+            if not batch:
+                break
+
+            for m in batch:
+                try:
+                    document = json.loads(m['data'])
+                except ValueError:
+                    print(f"  ! Map {m['id']} has invalid JSON, migrating as an empty map")
+                    document = {"name": m['title'] or "", "children": []}
+
+                rows = flatten_document(document)
+                cursor.execute("DELETE FROM mindmap_nodes WHERE map_id = ?", (m['id'],))
+                cursor.executemany(
+                    "INSERT INTO mindmap_nodes (map_id, id, parent_id, ordinal, name, description, is_collapsed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(m['id'], r['id'], r['parent_id'], r['ordinal'], r['name'], r['description'], r['is_collapsed'])
+                     for r in rows]
+                )
+                cursor.execute("UPDATE mindmaps SET data = NULL, node_count = ? WHERE id = ?", (len(rows), m['id']))
+                migrated += 1
+
+            # One transaction per batch keeps memory and lock time bounded
+            conn.commit()
+            print(f"  Migrated {migrated} maps...")
+
+        print(f"\n✓ Migrated {migrated} maps to node storage")
+        print("  Set MINDMAP_STORAGE=nodes so the app reads from the node table.")
+    except Exception as e:
+        print(f"Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def benchmark_hash(args):
+    """Pick the work factor that makes one password verify take about --target-ms here."""
+    print(f"Benchmarking {args.scheme} for a {args.target_ms:g} ms verify...")
+    rounds, measured_ms = benchmark(args.scheme, args.target_ms)
+    low, high = ROUNDS_LIMITS[args.scheme]
+    if rounds in (low, high):
+        print(f"  ! Target is outside the supported range, clamped to {rounds}")
+    setting = "BCRYPT_ROUNDS" if args.scheme == "bcrypt" else "PBKDF2_ROUNDS"
+    print(f"\n✓ {setting}={rounds} takes {measured_ms:.1f} ms per verify on this host")
+    print(f"  Add PASSWORD_HASH_SCHEME={args.scheme} and {setting}={rounds} to this environment's .env;")
+    print("  existing hashes are upgraded as users log in.")
+
 def main():
     parser = argparse.ArgumentParser(
         description="Mind Map Database Manager",
@@ -378,15 +718,24 @@ def main():
     )
     subparsers = parser.add_subparsers(dest="command", help="Command to execute")
 
-    # View Commands
-    subparsers.add_parser("view-users", help="View all users with their map IDs")
-    subparsers.add_parser("view-maps", help="View all mind maps with user info")
-    subparsers.add_parser("view-all", help="View complete database")
+    # View Commands (paged)
+    for name, help_text in (("view-users", "View users with their map IDs"),
+                            ("view-maps", "View mind maps with user info"),
+                            ("view-all", "View complete database")):
+        view_parser = subparsers.add_parser(name, help=help_text)
+        view_parser.add_argument("--limit", type=int, default=100, help="Rows per page, 0 for all (default: 100)")
+        view_parser.add_argument("--after", type=int, help="Start after this ID (from the previous page)")
 
     # Export Command
     export_parser = subparsers.add_parser("export-data", help="Export database to file")
-    export_parser.add_argument("--format", choices=['json', 'csv'], default='json', 
-                              help="Export format (default: json)")
+    export_parser.add_argument("--format", choices=list(EXPORTERS), default='json',
+                              help="Export format (default: json; parquet needs pyarrow)")
+    export_parser.add_argument("--compress", choices=['none', 'gzip', 'zstd'], default='none',
+                              help="Compress the output; gzip and zstd use all CPU cores (zstd needs zstandard)")
+    export_parser.add_argument("--since", type=parse_timestamp,
+                              help="Only export maps updated at or after this ISO timestamp (UTC if no offset); "
+                                   "users have no timestamp and are always exported")
+    export_parser.add_argument("--batch-size", type=int, default=1000, help="Rows fetched per batch (default: 1000)")
     export_parser.add_argument("--output", help="Output filename (auto-generated if not specified)")
 
     # Delete Users (batch)
@@ -410,6 +759,16 @@ def main():
     up_map.add_argument("map_id", type=int, help="MindMap ID")
     up_map.add_argument("--title", help="New title")
 
+    # Migrate to node storage
+    migrate = subparsers.add_parser("migrate-nodes", help="Move JSON blob maps into the node table")
+    migrate.add_argument("--batch-size", type=int, default=100, help="Maps per transaction (default: 100)")
+
+    # Password hash benchmark
+    bench = subparsers.add_parser("benchmark-hash", help="Pick the password hash work factor for this host")
+    bench.add_argument("--target-ms", type=float, default=250, help="Target verify time in ms (default: 250)")
+    bench.add_argument("--scheme", choices=list(ROUNDS_LIMITS), default="pbkdf2_sha256",
+                       help="Hash scheme (default: pbkdf2_sha256)")
+
     args = parser.parse_args()
 
     if args.command == "view-users":
@@ -428,6 +787,10 @@ def main():
         update_user(args)
     elif args.command == "update-map":
         update_map(args)
+    elif args.command == "migrate-nodes":
+        migrate_nodes(args)
+    elif args.command == "benchmark-hash":
+        benchmark_hash(args)
     else:
         parser.print_help()
 
@@ -0,0 +1,41 @@
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    """Test that the oldest untouched entry is evicted first."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now the most recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    """Test that entries are dropped once their TTL has passed."""
+    now = [100.0]
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(maxsize=10, ttl=5)
+    cache.set("user", "alice")
+    now[0] += 4
+    assert cache.get("user") == "alice"
+    now[0] += 2
+    assert cache.get("user", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_pop_removes_entry():
+    """Test explicit invalidation."""
+    cache = LRUCache(maxsize=10)
+    cache.set(1, "x")
+    cache.pop(1)
+    cache.pop(2)  # Missing keys are ignored
+    assert cache.get(1) is None
@@ -0,0 +1,34 @@
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import codec
+
+
+def test_round_trip_and_invalid_input():
+    """Test that documents survive a round trip and bad JSON raises ValueError."""
+    document = {"id": "root", "name": "Ünïcode ✓", "isCollapsed": False, "children": [{"id": "a", "children": []}]}
+    assert codec.loads(codec.dumps(document)) == document
+    assert codec.loads(codec.dumps_bytes(document)) == document
+    with pytest.raises(ValueError):
+        codec.loads("{not json")
+
+
+def test_deeply_nested_documents_encode():
+    """Test that documents deeper than orjson's nesting limit still encode."""
+    root = node = {"children": []}
+    for _ in range(300):
+        child = {"children": []}
+        node["children"].append(child)
+        node = child
+    assert codec.loads(codec.dumps(root)) == root
+
+
+def test_json_response_renders_with_codec():
+    """Test that the response class produces the codec's output."""
+    response = codec.JSONResponse({"a": [1, 2]})
+    assert response.body == codec.dumps_bytes({"a": [1, 2]})
+    assert response.headers["content-type"] == "application/json"
@@ -0,0 +1,34 @@
+import sys
+import os
+
+import pytest
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from app.database import PoolStats, _instrumented, _listen
+
+
+def test_pool_stats_count_checkouts_overflow_and_timeouts(tmp_path):
+    """Test that instrumented pools report checkouts, overflow connections and timeouts."""
+    stats = PoolStats("test")
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=_instrumented(QueuePool, stats), pool_size=1, max_overflow=1, pool_timeout=0.01,
+    )
+    _listen(engine, stats)
+
+    first, second = engine.connect(), engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    snapshot = stats.snapshot()
+    assert (snapshot["checked_out"], snapshot["overflow"], snapshot["overflow_connects"]) == (2, 1, 1)
+    assert snapshot["timeouts"] == 1
+
+    first.close()
+    second.close()
+    snapshot = stats.snapshot()
+    assert (snapshot["checkouts"], snapshot["checked_out"], snapshot["idle"], snapshot["pool"]) == (2, 0, 1, "QueuePool")
@@ -0,0 +1,40 @@
+import pytest
+import sys
+import os
+from datetime import datetime
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from app.routers.maps import _etag_matches, _map_etag, _parse_if_match
+
+UPDATED = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def test_etag_changes_with_revision_and_variant():
+    """Test that the ETag identifies the revision and the requested subtree."""
+    etag = _map_etag(1, 3, UPDATED)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == _map_etag(1, 3, UPDATED)
+    assert etag != _map_etag(1, 4, UPDATED)
+    assert etag != _map_etag(1, 3, UPDATED, depth=1)
+    assert _map_etag(1, 3, UPDATED, depth=1) != _map_etag(1, 3, UPDATED, node_id="a")
+
+
+def test_if_none_match_parsing():
+    """Test matching against lists of ETags and the wildcard."""
+    etag = _map_etag(1, 3, UPDATED)
+    assert _etag_matches(etag, etag)
+    assert _etag_matches(f'"other", {etag}', etag)
+    assert _etag_matches("*", etag)
+    assert not _etag_matches(_map_etag(1, 2, UPDATED), etag)
+
+
+def test_if_match_revision():
+    """Test reading the expected revision from an ETag or a bare revision."""
+    assert _parse_if_match(_map_etag(7, 3, UPDATED), 7) == 3
+    assert _parse_if_match('"4"', 7) == 4
+    assert _parse_if_match("*", 7) is None
+    with pytest.raises(HTTPException):
+        _parse_if_match(_map_etag(8, 3, UPDATED), 7)
@@ -0,0 +1,43 @@
+import asyncio
+import sys
+import os
+import time
+
+import pytest
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.hashing import HashingBusy, HashingPool
+
+
+def test_pool_rejects_beyond_capacity():
+    """Test that hashes beyond the workers plus the queue fail fast and are counted."""
+    async def run():
+        pool = HashingPool(workers=0, queue_size=1)
+        running = [asyncio.ensure_future(pool.run("login", time.sleep, 0.2)) for _ in range(pool.capacity)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HashingBusy):
+            await pool.run("login", time.sleep, 0.2)
+        await asyncio.gather(*running)
+        return pool.metrics()
+
+    metrics = asyncio.run(run())
+    assert metrics["in_flight"] == 0
+    assert metrics["endpoints"]["login"]["calls"] == 2
+    assert metrics["endpoints"]["login"]["rejected"] == 1
+
+
+def test_hash_and_verify_in_worker_process():
+    """Test that passwords hashed in the process pool verify there too."""
+    async def run():
+        pool = HashingPool(workers=1, queue_size=4)
+        try:
+            hashed = await pool.hash("signup", "correct horse")
+            return hashed, await pool.verify("login", "correct horse", hashed), await pool.verify("login", "wrong", hashed)
+        finally:
+            pool.shutdown()
+
+    hashed, good, bad = asyncio.run(run())
+    assert hashed.startswith("$pbkdf2-sha256$")
+    assert good and not bad
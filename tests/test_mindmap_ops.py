@@ -0,0 +1,112 @@
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.mindmap_ops import (
+    apply_operations, build_document, ensure_node_ids, flatten_document,
+    index_nodes, truncate_document, OperationError,
+)
+from app.utils import sanitize_html
+
+
+def make_map():
+    return {
+        "id": "root", "name": "Root", "description": "", "children": [
+            {"id": "a", "name": "A", "description": "", "children": [
+                {"id": "a1", "name": "A1", "description": "", "children": []},
+            ]},
+            {"id": "b", "name": "B", "description": "", "children": []},
+        ]
+    }
+
+
+def test_ensure_node_ids_fills_missing():
+    """Test that nodes without ids get one and existing ids are kept."""
+    doc = {"id": "root", "name": "Root", "children": [{"name": "Child", "children": []}]}
+    assert ensure_node_ids(doc) is True
+    assert doc["id"] == "root"
+    assert doc["children"][0]["id"]
+    assert ensure_node_ids(doc) is False
+
+
+def test_add_node_sanitizes_description():
+    """Test that added nodes are inserted and sanitized."""
+    doc = make_map()
+    apply_operations(doc, [{
+        "op": "add", "parent_id": "b",
+        "node": {"id": "b1", "name": "B1", "description": '<b>ok</b><script>x</script>', "children": []},
+    }], sanitize_html)
+    added = doc["children"][1]["children"][0]
+    assert added["id"] == "b1"
+    assert "<script>" not in added["description"]
+
+
+def test_update_only_touches_given_fields():
+    """Test that update changes only the provided fields."""
+    doc = make_map()
+    apply_operations(doc, [{"op": "update", "id": "a1", "isCollapsed": True}], sanitize_html)
+    node = index_nodes(doc)["a1"][0]
+    assert node["isCollapsed"] is True
+    assert node["name"] == "A1"
+
+
+def test_move_and_delete():
+    """Test moving a subtree and deleting a node."""
+    doc = make_map()
+    apply_operations(doc, [
+        {"op": "move", "id": "a1", "parent_id": "b", "index": 0},
+        {"op": "delete", "id": "a"},
+    ], sanitize_html)
+    assert [c["id"] for c in doc["children"]] == ["b"]
+    assert doc["children"][0]["children"][0]["id"] == "a1"
+
+
+def test_invalid_operations_are_rejected():
+    """Test that unsafe operations raise OperationError."""
+    with pytest.raises(OperationError):
+        apply_operations(make_map(), [{"op": "delete", "id": "root"}], sanitize_html)
+    with pytest.raises(OperationError):
+        apply_operations(make_map(), [{"op": "move", "id": "a", "parent_id": "a1"}], sanitize_html)
+    with pytest.raises(OperationError):
+        apply_operations(make_map(), [{"op": "update", "id": "missing", "name": "x"}], sanitize_html)
+    with pytest.raises(OperationError):
+        apply_operations(make_map(), [{"op": "add", "parent_id": "a", "node": {"id": "b"}}], sanitize_html)
+
+
+def test_failed_batch_leaves_document_and_index_unchanged():
+    """Test that a batch failing partway undoes the operations before it."""
+    doc = make_map()
+    index = index_nodes(doc)
+    with pytest.raises(OperationError):
+        apply_operations(doc, [
+            {"op": "add", "parent_id": "b", "node": {"id": "b1", "name": "B1", "children": []}},
+            {"op": "update", "id": "a", "name": "Renamed", "isCollapsed": True},
+            {"op": "move", "id": "a1", "parent_id": "root", "index": 0},
+            {"op": "delete", "id": "b"},
+            {"op": "delete", "id": "missing"},
+        ], sanitize_html, index)
+    assert doc == make_map()
+    assert index == index_nodes(doc)
+
+
+def test_flatten_and_build_round_trip():
+    """Test that node rows rebuild the same tree."""
+    doc = make_map()
+    rows = flatten_document(doc)
+    assert [r["id"] for r in rows] == ["root", "a", "a1", "b"]
+    rebuilt = build_document(reversed(rows))
+    assert [c["id"] for c in rebuilt["children"]] == ["a", "b"]
+    assert rebuilt["children"][0]["children"][0]["name"] == "A1"
+
+
+def test_truncate_document_reports_hidden_children():
+    """Test that depth-limited copies mark cut-off subtrees."""
+    doc = make_map()
+    top = truncate_document(doc, 1)
+    assert top["children"][0]["children"] == []
+    assert top["children"][0]["childCount"] == 1
+    assert "childCount" not in top["children"][1]
+    assert doc["children"][0]["children"][0]["id"] == "a1"
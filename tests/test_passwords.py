@@ -0,0 +1,26 @@
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import passwords
+
+
+def test_outdated_hashes_are_upgraded_on_verify(monkeypatch):
+    """Test that a hash made at another work factor verifies and comes back rehashed at the current one."""
+    old_hash = passwords.build_context(pbkdf2_rounds=2000).hash(passwords._prehash("secret"))
+    monkeypatch.setattr(passwords, "pwd_context", passwords.build_context(pbkdf2_rounds=3000))
+
+    assert passwords.verify_and_update("wrong", old_hash) == (False, None)
+    ok, new_hash = passwords.verify_and_update("secret", old_hash)
+    assert ok and new_hash.startswith("$pbkdf2-sha256$3000$")
+    assert passwords.verify_and_update("secret", new_hash) == (True, None)
+
+
+def test_benchmark_scales_rounds_to_target():
+    """Test that a higher latency target picks proportionally more rounds."""
+    fast, _ = passwords.benchmark("pbkdf2_sha256", 2)
+    slow, measured_ms = passwords.benchmark("pbkdf2_sha256", 20)
+    assert passwords.ROUNDS_LIMITS["pbkdf2_sha256"][0] <= fast < slow
+    assert 5 < measured_ms < 80
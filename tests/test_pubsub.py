@@ -0,0 +1,48 @@
+import asyncio
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pubsub import MemoryPubSub, map_channel
+from app.routers.maps import sanitize_operations
+
+
+def test_messages_reach_every_subscriber_in_order():
+    """Test that each subscriber of a channel gets every message, in order."""
+    async def run():
+        pubsub = MemoryPubSub()
+        first = await pubsub.subscribe(map_channel(1))
+        second = await pubsub.subscribe(map_channel(1))
+        other = await pubsub.subscribe(map_channel(2))
+        for revision in range(3):
+            await pubsub.publish(map_channel(1), {"revision": revision})
+        await pubsub.close()
+        return [[message["revision"] async for message in s] for s in (first, second, other)]
+
+    assert asyncio.run(run()) == [[0, 1, 2], [0, 1, 2], []]
+
+
+def test_slow_subscriber_is_dropped():
+    """Test that a subscriber that falls behind is closed instead of buffering forever."""
+    async def run():
+        pubsub = MemoryPubSub(max_pending=2)
+        subscription = await pubsub.subscribe("map:1")
+        for revision in range(5):
+            await pubsub.publish("map:1", {"revision": revision})
+        received = [message["revision"] async for message in subscription]
+        return received, subscription.overflowed, pubsub.subscriber_count("map:1")
+
+    assert asyncio.run(run()) == ([0, 1], True, 0)
+
+
+def test_forwarded_operations_are_sanitized():
+    """Test that operations are sanitized before being applied and passed on."""
+    ops = sanitize_operations([
+        {"op": "update", "id": "a", "description": "<b>ok</b><script>alert(1)</script>"},
+        {"op": "add", "parent_id": "a", "node": {"id": "b", "description": "<img src=x onerror=alert(1)>"}},
+    ])
+    assert "<script>" not in ops[0]["description"]
+    assert "<b>ok</b>" in ops[0]["description"]
+    assert "onerror" not in ops[1]["node"]["description"]
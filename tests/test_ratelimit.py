@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+import sys
+import time
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ratelimit import MemoryStore, RateLimiter, Rule, SQLiteStore
+from app import auth
+
+
+def _replay(store, times):
+    """Feed requests at the given times (seconds) to a 3-per-minute bucket."""
+    async def run():
+        results = [await store.update("k", now, 20.0, 60.0) for now in times]
+        await store.close()
+        return results
+    return asyncio.run(run())
+
+
+def test_buckets_allow_a_burst_then_the_steady_rate(tmp_path):
+    """Test that both stores allow a full burst, then one request per interval, with the right wait."""
+    times = [0, 0, 0, 0, 10, 20, 21, 100]
+    expected = [0, 0, 0, 20, 10, 0, 19, 0]
+    assert _replay(MemoryStore(), times) == expected
+    assert _replay(SQLiteStore(str(tmp_path / "limits.db")), times) == expected
+
+
+def test_sqlite_store_lets_requests_through_while_the_file_is_locked(tmp_path):
+    """Test that a SQLite check gives up quickly and allows the request when another writer holds the lock."""
+    path = str(tmp_path / "limits.db")
+    store = SQLiteStore(path)
+    blocker = sqlite3.connect(path, isolation_level=None)
+
+    async def run():
+        await store.update("k", 0, 20.0, 60.0)
+        blocker.execute("BEGIN IMMEDIATE")
+        start = time.perf_counter()
+        results = [await store.update("k", 0, 20.0, 60.0) for _ in range(5)]
+        elapsed = time.perf_counter() - start
+        blocker.execute("ROLLBACK")
+        results.append(await store.update("k", 0, 20.0, 60.0))
+        await store.close()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(run())
+    blocker.close()
+    # Five locked checks are allowed without counting; the bucket then has room for one more
+    assert results == [0, 0, 0, 0, 0, 0]
+    assert elapsed < 1.0
+
+
+def test_requests_are_keyed_by_route_and_user():
+    """Test that login is limited per IP and other API calls per user from their token."""
+    login, default = Rule("login", 5), Rule("default", 60)
+    limiter = RateLimiter(MemoryStore(), {("POST", "/auth/token"): login}, default)
+    token = auth.create_access_token({"sub": "a@example.com", "uid": 7})
+
+    def scope(method, path, headers=()):
+        return {"method": method, "path": path, "client": ("10.0.0.1", 5000), "headers": list(headers)}
+
+    assert limiter.classify(scope("POST", "/auth/token")) == (login, "ip:10.0.0.1")
+    authorized = [(b"authorization", f"Bearer {token}".encode())]
+    assert limiter.classify(scope("GET", "/api/maps/", authorized)) == (default, "user:7")
+    assert limiter.classify(scope("GET", "/api/maps/", [(b"authorization", b"Bearer junk")])) == (default, "ip:10.0.0.1")
+    assert limiter.classify(scope("GET", "/static/app.js"))[0] is None
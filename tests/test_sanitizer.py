@@ -0,0 +1,70 @@
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import sanitizer
+from app.sanitizer import prepare_document, sanitize_description, sanitize_document
+from app.utils import sanitize_html
+
+SAMPLES = [
+    "", "  plain text  ", "Tom & Jerry", "a > b", "<b>Bold</b> <i>x</i>",
+    '<b onclick="alert(1)">Click</b><script>alert(1)</script>',
+    "line one\r\nline two", "tab\tand\nnewline", "bell\x07char", "<p>para</p>",
+]
+
+
+def test_matches_sanitize_html():
+    """Test that the cached sanitizer gives the same result as sanitize_html."""
+    sanitizer.clear_cache()
+    for text in SAMPLES:
+        expected = sanitize_html(text)
+        assert sanitize_description(text) == expected
+        # Second call is served from the cache
+        assert sanitize_description(text) == expected
+
+
+def test_plain_text_skips_bleach(monkeypatch):
+    """Test that descriptions without markup characters are not parsed."""
+    def fail(*args, **kwargs):
+        raise AssertionError("bleach should not run")
+    monkeypatch.setattr(sanitizer, "sanitize_html", fail)
+    assert sanitize_description("  Just some notes, nothing else.  ") == "Just some notes, nothing else."
+
+
+def test_too_long_description_is_rejected():
+    """Test that the length limit applies on the fast path too."""
+    with pytest.raises(ValueError):
+        sanitize_description("x" * 5001)
+
+
+def test_deep_document_does_not_recurse():
+    """Test that very deep maps are sanitized without hitting the recursion limit."""
+    root = node = {"name": "0", "description": "<script>x</script>", "children": []}
+    for level in range(sys.getrecursionlimit() * 2):
+        child = {"name": str(level), "description": "<script>x</script>", "children": []}
+        node["children"].append(child)
+        node = child
+    sanitize_document(root)
+    assert node["description"] == "x"
+
+
+def test_prepare_document_single_pass():
+    """Test that one pass sanitizes, fills and dedupes ids, and counts nodes."""
+    doc = {"id": "root", "name": "Root", "children": [
+        {"id": "a", "description": "<script>x</script>ok", "children": []},
+        {"id": "a", "children": [{"name": "leaf"}]},
+    ]}
+    assert prepare_document(doc) == 4
+    assert doc["children"][0]["description"] == "xok"
+    ids = [doc["id"], doc["children"][0]["id"], doc["children"][1]["id"], doc["children"][1]["children"][0]["id"]]
+    assert len(set(ids)) == 4 and all(ids)
+
+
+def test_prepare_document_rejects_bad_structure():
+    """Test that malformed documents and long descriptions raise ValueError."""
+    for doc in ([], {"children": "nope"}, {"children": ["nope"]}, {"description": "x" * 5001}, {"name": 5}):
+        with pytest.raises(ValueError):
+            prepare_document(doc)
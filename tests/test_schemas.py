@@ -0,0 +1,36 @@
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import ValidationError
+from app.schemas import MindMapPatch
+
+
+def _add(node):
+    return {"base_revision": 1, "ops": [{"op": "add", "parent_id": "root", "node": node}]}
+
+
+def test_malformed_added_nodes_are_validation_errors():
+    """Test that badly typed add payloads fail validation (a 422) instead of raising TypeError."""
+    for node in ({"name": "x", "description": 5}, {"name": 5}, {"name": "x", "children": "x"},
+                 {"name": "x", "children": [1]}, {"name": "x", "description": "x" * 5001}):
+        with pytest.raises(ValidationError):
+            MindMapPatch(**_add(node))
+
+
+def test_deep_added_subtree_is_validated_without_recursion():
+    """Test that a subtree deeper than the recursion limit is checked iteratively."""
+    root = node = {"name": "0", "children": []}
+    for depth in range(1, sys.getrecursionlimit() * 2):
+        child = {"name": str(depth), "children": []}
+        node["children"].append(child)
+        node = child
+    patch = MindMapPatch(**_add(root))
+    assert patch.ops[0].node["children"][0]["id"]
+
+    node["description"] = 5
+    with pytest.raises(ValidationError):
+        MindMapPatch(**_add(root))
@@ -0,0 +1,123 @@
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app import codec, models, search
+
+DOCUMENT = {
+    "id": "root", "name": "Project plan", "description": "", "children": [
+        {"id": "a", "name": "Research", "description": "<b>Interview</b> users &amp; vendors", "children": [
+            {"id": "a1", "name": "Survey design", "description": "", "children": []},
+        ]},
+        {"id": "b", "name": "Budget", "description": "", "children": []},
+    ]
+}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    search.create_index(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([models.User(id=1, email="a@example.com"), models.User(id=2, email="b@example.com")])
+    session.add_all([models.MindMap(id=1, title="Plan", user_id=1), models.MindMap(id=2, title="Other", user_id=2)])
+    session.flush()
+    search.index_document(session, session.get(models.MindMap, 1), DOCUMENT)
+    search.index_document(session, session.get(models.MindMap, 2), DOCUMENT)
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_search_matches_prefixes_with_path_and_owner_only(db):
+    """Test that every query word matches as a prefix, only in the user's maps, with the node's path."""
+    results = search.search(db, 1, "surv des")
+    assert [(r["map_id"], r["node_id"], r["path"]) for r in results] == [(1, "a1", ["Project plan", "Research"])]
+    body_match = search.search(db, 1, "vendor")
+    assert body_match[0]["node_id"] == "a"
+    assert "<b>" not in body_match[0]["snippet"] and "&amp;" not in body_match[0]["snippet"]
+    assert search.search(db, 1, '" OR *') == []
+
+
+def test_operations_update_only_affected_entries(db):
+    """Test that node operations keep the index in step with the map."""
+    map_item = db.get(models.MindMap, 1)
+    search.apply_operations(db, map_item, [
+        {"op": "add", "parent_id": "b", "node": {"id": "c", "name": "Travel costs", "children": [
+            {"id": "c1", "name": "Flights", "children": []},
+        ]}},
+        {"op": "update", "id": "b", "name": "Finances"},
+        {"op": "move", "id": "a1", "parent_id": "root"},
+        {"op": "delete", "id": "a"},
+    ])
+    db.commit()
+    assert [r["path"] for r in search.search(db, 1, "flights")] == [["Project plan", "Finances", "Travel costs"]]
+    assert search.search(db, 1, "budget") == []
+    assert search.search(db, 1, "interview") == []
+    assert search.search(db, 1, "survey")[0]["path"] == ["Project plan"]
+
+
+def test_reindexing_a_document_writes_only_changes(db):
+    """Test that a full save, a copy and a delete leave the index matching the maps."""
+    map_item = db.get(models.MindMap, 1)
+    ids_before = dict(db.query(models.SearchEntry.node_id, models.SearchEntry.id).filter_by(map_id=1).all())
+    changed = {**DOCUMENT, "children": [{**DOCUMENT["children"][0], "name": "Discovery"}]}
+    search.index_document(db, map_item, changed)
+    db.add(models.MindMap(id=3, title="Copy", user_id=1))
+    db.flush()
+    search.copy_map(db, map_item, db.get(models.MindMap, 3))
+    db.commit()
+
+    ids_after = dict(db.query(models.SearchEntry.node_id, models.SearchEntry.id).filter_by(map_id=1).all())
+    assert ids_after == {key: ids_before[key] for key in ("root", "a", "a1")}
+    assert sorted(r["map_id"] for r in search.search(db, 1, "discovery")) == [1, 3]
+
+    search.remove_map(db, map_item)
+    db.commit()
+    assert [r["map_id"] for r in search.search(db, 1, "discovery")] == [3]
+
+
+def test_maps_without_node_ids_are_indexed_once(db):
+    """Test that a map saved before node ids gets ids, is searchable, and is not indexed again."""
+    legacy = {"name": "Garden", "description": "", "children": [
+        {"name": "Tomatoes", "description": "", "children": [{"name": "Seedlings", "children": []}]},
+    ]}
+    db.add(models.MindMap(id=3, title="Garden", user_id=1, data=codec.dumps(legacy), revision=4))
+    db.commit()
+    load = lambda session, map_item: codec.loads(map_item.data)
+
+    assert search.index_missing_maps(db, load, skip=lambda map_id: map_id == 3) == (3, 0)
+    assert search.index_missing_maps(db, load, limit=1) == (3, 1)
+    db.commit()
+    db.expire_all()
+    assert db.get(models.MindMap, 3).revision == 4
+    stored = codec.loads(db.get(models.MindMap, 3).data)
+    seedlings = stored["children"][0]["children"][0]
+    assert [r["node_id"] for r in search.search(db, 1, "seedl")] == [seedlings["id"]]
+    assert search.index_missing_maps(db, load) == (None, 0)
+
+
+def test_backfill_does_not_overwrite_a_concurrent_save(db):
+    """Test that a map saved between loading and writing its ids keeps the save and is left for later."""
+    db.add(models.MindMap(id=3, title="Garden", user_id=1, data=codec.dumps({"name": "Old", "children": []})))
+    db.commit()
+
+    def load(session, map_item):
+        document = codec.loads(map_item.data)
+        session.execute(update(models.MindMap).where(models.MindMap.id == 3).values(
+            data=codec.dumps({"id": "r", "name": "Saved", "children": []}), revision=2
+        ).execution_options(synchronize_session=False))  # As another session would
+        return document
+
+    assert search.index_missing_maps(db, load) == (3, 0)
+    db.commit()
+    db.expire_all()
+    assert codec.loads(db.get(models.MindMap, 3).data)["name"] == "Saved"
+    assert search.search(db, 1, "old") == []
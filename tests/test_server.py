@@ -0,0 +1,29 @@
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import server
+from app.server import plan_pool, plan_workers
+
+
+def test_pools_fit_the_connection_budget():
+    """Test that per-worker pools, plus each worker's startup connection, stay within DB_MAX_CONNECTIONS."""
+    assert plan_pool(4, 0, 10, 20) == (4, 10, 20)
+    workers, pool_size, max_overflow = plan_pool(4, 90, 10, 20)
+    assert (workers, pool_size) == (4, 10)
+    assert workers * (pool_size + max_overflow + 1) <= 90
+    assert plan_pool(8, 10, 10, 20) == (5, 1, 0)
+
+
+def test_per_process_state_forces_one_worker(monkeypatch):
+    """Test that in-memory pub/sub or rate limits run a single worker and shared backends allow more."""
+    monkeypatch.setattr(server.settings, "WRITE_BUFFER_ENABLED", False)
+    monkeypatch.setattr(server.settings, "PUBSUB_BACKEND", "memory")
+    monkeypatch.setattr(server.settings, "RATE_LIMIT_BACKEND", "sqlite")
+    assert plan_workers(0, 4) == 1
+    monkeypatch.setattr(server.settings, "PUBSUB_BACKEND", "redis")
+    assert plan_workers(0, 4) == 4
+    monkeypatch.setattr(server.settings, "RATE_LIMIT_BACKEND", "memory")
+    assert plan_workers(3, 4) == 1
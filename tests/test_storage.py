@@ -0,0 +1,96 @@
+import json
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app import models
+from app.mindmap_ops import OperationError
+from app.storage import BlobStorage, NodeStorage, stored_size_expression
+from app.utils import sanitize_html
+
+DOCUMENT = {
+    "id": "root", "name": "Root", "description": "", "isCollapsed": False, "children": [
+        {"id": "a", "name": "A", "description": "<b>a</b>", "isCollapsed": False, "children": [
+            {"id": "a1", "name": "A1", "description": "", "isCollapsed": False, "children": []},
+        ]},
+        {"id": "b", "name": "B", "description": "", "isCollapsed": True, "children": []},
+    ]
+}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(models.User(id=1, email="user@example.com"))
+    session.add(models.MindMap(id=1, title="Map", user_id=1, data=json.dumps(DOCUMENT)))
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_node_storage_migrates_blob_on_first_write(db):
+    """Test that loading a blob map writes nothing and the next edit moves it into node rows."""
+    map_item = db.get(models.MindMap, 1)
+    storage = NodeStorage()
+    assert storage.load(db, map_item) == DOCUMENT
+    assert map_item.data is not None and not db.dirty
+    assert db.query(models.MindMapNode).filter_by(map_id=1).count() == 0
+
+    storage.apply(db, map_item, [{"op": "update", "id": "b", "isCollapsed": False}], sanitize_html)
+    assert map_item.data is None
+    assert db.query(models.MindMapNode).filter_by(map_id=1).count() == 4
+    assert storage.load(db, map_item)["children"][1]["isCollapsed"] is False
+
+
+def test_node_storage_depth_limited_load(db):
+    """Test that depth-limited loads report children that were not loaded."""
+    map_item = db.get(models.MindMap, 1)
+    top = NodeStorage().load(db, map_item, depth=1)
+    assert [c["id"] for c in top["children"]] == ["a", "b"]
+    assert top["children"][0]["childCount"] == 1
+    subtree = NodeStorage().load(db, map_item, root_id="a", depth=1)
+    assert subtree["children"][0]["id"] == "a1"
+
+
+def test_node_and_blob_storage_apply_the_same_operations(db):
+    """Test that both backends produce the same document for the same edits."""
+    operations = [
+        {"op": "add", "parent_id": "b", "node": {"id": "b1", "name": "B1", "description": "<script>x</script>ok",
+                                                  "isCollapsed": False, "children": []}},
+        {"op": "move", "id": "a1", "parent_id": "b", "index": 0},
+        {"op": "update", "id": "a", "name": "A!", "isCollapsed": True},
+        {"op": "delete", "id": "a"},
+    ]
+    blob_map = models.MindMap(title="Blob", data=json.dumps(DOCUMENT))
+    BlobStorage().apply(db, blob_map, [dict(op) for op in operations], sanitize_html)
+
+    map_item = db.get(models.MindMap, 1)
+    storage = NodeStorage()
+    storage.apply(db, map_item, [dict(op) for op in operations], sanitize_html)
+    assert storage.load(db, map_item) == json.loads(blob_map.data)
+
+    with pytest.raises(OperationError):
+        storage.apply(db, map_item, [{"op": "move", "id": "b", "parent_id": "a1"}], sanitize_html)
+
+
+def test_node_count_and_stored_size_are_tracked(db):
+    """Test that both backends keep node_count current and report a stored size."""
+    operations = [{"op": "delete", "id": "a"}]
+    for storage in (BlobStorage(), NodeStorage()):
+        map_item = db.get(models.MindMap, 1)
+        storage.save(db, map_item, json.dumps(DOCUMENT), 4)
+        db.flush()
+        assert map_item.node_count == 4
+        storage.apply(db, map_item, operations, sanitize_html)
+        db.flush()
+        assert map_item.node_count == 2
+        size = db.query(stored_size_expression()).filter(models.MindMap.id == 1).scalar()
+        assert size > 0
@@ -0,0 +1,63 @@
+import gzip
+import io
+import json
+import pytest
+import sys
+import os
+import zipfile
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.routers.maps import _CORRUPT_UPLOAD_ERRORS, _import_records, _prepare_import_batch
+
+RECORDS = [
+    json.dumps({"title": "First", "data": json.dumps({"name": "A", "description": "<script>x</script><b>ok</b>"})}),
+    json.dumps({"title": "Second", "data": json.dumps({"name": "B", "children": []}), "revision": 7}),
+]
+
+
+def _prepare_all(upload, size=1) -> list:
+    records = _import_records(upload)
+    prepared = []
+    while True:
+        batch = _prepare_import_batch(records, size)
+        if not batch:
+            return prepared
+        prepared.extend(batch)
+
+
+def test_import_reads_ndjson_gzip_and_zip_alike():
+    """Test that every upload format yields the same sanitized maps."""
+    ndjson = ("\n".join(RECORDS) + "\n\n").encode()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for index, record in enumerate(RECORDS):
+            zf.writestr(f"map-{index}.json", record)
+
+    for upload in (ndjson, gzip.compress(ndjson), archive.getvalue()):
+        prepared = _prepare_all(io.BytesIO(upload))
+        assert [entry[1].title for entry in prepared] == ["First", "Second"]
+        assert "<script>" not in prepared[0][2] and "<b>ok</b>" in prepared[0][2]
+
+
+def test_import_reports_bad_records_and_keeps_going():
+    """Test that invalid records are reported by line while the rest still import."""
+    upload = "\n".join(['{"title": "", "data": "{}"}', "not json", "[1]", RECORDS[0]]).encode()
+    prepared = _prepare_all(io.BytesIO(upload), size=10)
+    assert [entry[0] for entry in prepared if len(entry) == 2] == ["line 1", "line 2", "line 3"]
+    assert [entry[1].title for entry in prepared if len(entry) == 4] == ["First"]
+
+
+def test_corrupt_archives_raise_upload_errors():
+    """Test that damaged zip and gzip uploads fail with the errors import answers 400 for."""
+    ndjson = ("\n".join(RECORDS) + "\n").encode()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("map-0.json", RECORDS[0] * 20)
+    damaged_member = bytearray(archive.getvalue())
+    damaged_member[40:60] = b"\xff" * 20
+
+    for upload in (b"PK\x03\x04 not a zip", gzip.compress(ndjson)[:-12], b"\x1f\x8b junk", bytes(damaged_member)):
+        with pytest.raises(_CORRUPT_UPLOAD_ERRORS):
+            _prepare_all(io.BytesIO(upload))
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import pytest
+import sys
+import os
+
+# Add the project root to the python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app.database import Base
+from app import models
+from app.sanitizer import sanitize_description
+from app.write_buffer import RevisionConflict, WriteBuffer
+
+DOCUMENT = {"id": "root", "name": "Root", "description": "", "isCollapsed": False, "children": []}
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    path = tmp_path / "buffer.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert().values(id=1, email="user@example.com"))
+        conn.execute(models.MindMap.__table__.insert().values(id=1, title="Map", user_id=1, revision=1, data=json.dumps(DOCUMENT)))
+    engine.dispose()
+    return f"sqlite+aiosqlite:///{path}"
+
+
+def test_burst_of_saves_is_one_write(db_url):
+    """Test that many buffered saves are written to the database once."""
+    async def run():
+        engine = create_async_engine(db_url)
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        writes = []
+        event.listen(engine.sync_engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: writes.append(statement) if statement.startswith("UPDATE") else None)
+        buffer = WriteBuffer(session_factory=sessions, flush_ms=60000, idle_ms=60000)
+        async with sessions() as db:
+            for i in range(30):
+                await buffer.save(db, 1, 1, expected=i + 1, operations=[
+                    {"op": "add", "parent_id": "root", "node": {"id": f"n{i}", "name": f"N{i}", "children": []}}
+                ], sanitize=sanitize_description)
+        assert writes == []
+        assert buffer.get(1, 1).revision == 31
+        edited_at = buffer.get(1, 1).updated_at
+        await buffer.stop()
+        async with sessions() as db:
+            map_item = await db.get(models.MindMap, 1)
+            assert map_item.revision == 31
+            assert map_item.updated_at > edited_at  # Stamped by the flush, not the edit
+            assert map_item.node_count == 31
+            assert len(json.loads(map_item.data)["children"]) == 30
+        assert buffer.get(1, 1) is None
+        await engine.dispose()
+        return writes
+
+    writes = asyncio.run(run())
+    assert 0 < len(writes) <= 2
+
+
+def test_conflicts_and_bad_operations_leave_the_map_untouched(db_url):
+    """Test that stale or failing saves do not change the buffered map."""
+    async def run():
+        engine = create_async_engine(db_url)
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        buffer = WriteBuffer(session_factory=sessions, flush_ms=60000, idle_ms=60000)
+        async with sessions() as db:
+            await buffer.save(db, 1, 1, expected=1, title="Renamed")
+            with pytest.raises(RevisionConflict):
+                await buffer.save(db, 1, 1, expected=1, title="Stale")
+            with pytest.raises(ValueError):
+                await buffer.save(db, 1, 1, expected=2, operations=[
+                    {"op": "update", "id": "root", "name": "Changed"},
+                    {"op": "add", "parent_id": "root", "node": {"id": "n", "name": "N", "children": []}},
+                    {"op": "delete", "id": "missing"},
+                ], sanitize=sanitize_description)
+            with pytest.raises(LookupError):
+                await buffer.save(db, 1, 2, expected=None, title="Not mine")
+        pending = buffer.get(1, 1)
+        assert (pending.title, pending.revision, pending.document["name"]) == ("Renamed", 2, "Root")
+        assert pending.document["children"] == []
+        assert pending.updated_at.tzinfo is None
+        await engine.dispose()
+
+    asyncio.run(run())